@@ -0,0 +1,31 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.export_shards import BYTE_ENCODING, TokenShards, export_shards
+
+
+def test_refined_variants_of_a_source_share_a_split(tmp_path):
+    records = []
+    for source in range(40):
+        original = f"export default function createVisualization() {{ return {source}; }}"
+        for variant in range(5):
+            records.append({'input': f"Chart {source}, take {variant}",
+                            'output': f"{original}\n// refinement {variant}",
+                            'original_output': original})
+    data = tmp_path / 'refined.jsonl'
+    data.write_text(''.join(json.dumps(record) + '\n' for record in records))
+
+    stats = export_shards(data, tmp_path / 'shards', encoding=BYTE_ENCODING, val_fraction=0.5)
+
+    splits = {}
+    for split in ('train', 'validation'):
+        shards = TokenShards(tmp_path / 'shards', split)
+        for i in range(len(shards)):
+            tokens, prompt_length = shards[i]
+            prompt = bytes(tokens[:prompt_length].astype('uint8')).decode()
+            splits.setdefault(prompt.split(',')[0], set()).add(split)
+    assert stats['train examples'] and stats['validation examples']
+    assert len(splits) == 40
+    assert all(len(found) == 1 for found in splits.values())
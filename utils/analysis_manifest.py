@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+
+MANIFEST_NAME = '.analysis_manifest.json'
+MANIFEST_VERSION = 1
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tool_version(tool_path):
+    """Identify a report tool by the hash of its contents."""
+    try:
+        return sha256_file(tool_path)
+    except OSError:
+        return 'missing'
+
+
+class AnalysisManifest:
+    """Per-gallery record of the inputs each JS file was last analyzed with.
+
+    Each entry stores the JS file's size, mtime and content hash, a descriptor
+    for every data source it resolved to, the report tool version and the
+    options the run used. A file is only reprocessed when one of those changed
+    or one of its outputs went missing. Content hashes are only recomputed when
+    a file's size or mtime moved, so checking an unchanged gallery is a stat pass.
+
+    URL sources are recorded with the sha256 of the body they resolved to.
+    ``remote_hash(url)`` gives the current one (e.g. DownloadCache.content_hash,
+    which reads it from the cache's metadata and only revalidates entries
+    older than its TTL); without it a file with URL sources is never
+    considered current.
+    """
+
+    def __init__(self, gallery_root, tool_version='unknown', remote_hash=None):
+        self.gallery_root = Path(gallery_root)
+        self.path = self.gallery_root / MANIFEST_NAME
+        self.tool_version = tool_version
+        self.remote_hash = remote_hash
+        self.entries = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get('version') == MANIFEST_VERSION:
+            self.entries = manifest.get('entries', {})
+
+    def save(self):
+        with self._lock:
+            manifest = {'version': MANIFEST_VERSION, 'entries': self.entries}
+            fd, tmp = tempfile.mkstemp(dir=self.gallery_root, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+
+    def key(self, path):
+        try:
+            return str(Path(path).resolve().relative_to(self.gallery_root.resolve()))
+        except ValueError:
+            return str(Path(path).resolve())
+
+    def file_state(self, path, previous=None):
+        """Return size/mtime/hash for ``path``, reusing ``previous`` hash when stat is unchanged."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        state = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if previous and previous.get('size') == state['size'] and previous.get('mtime_ns') == state['mtime_ns']:
+            state['sha256'] = previous.get('sha256')
+        else:
+            state['sha256'] = sha256_file(path)
+        return state
+
+    def describe_sources(self, js_file, data_sources, resolved=None):
+        """Build descriptors for the data sources a JS file resolved to.
+
+        ``resolved`` maps source names to what process_js_file learned about
+        them, such as the ``sha256`` of a downloaded body.
+        """
+        sources = {}
+        for source_name, data in data_sources.items():
+            if source_name.startswith('dataUrl'):
+                if data.startswith('http'):
+                    sources[source_name] = {'url': data, **((resolved or {}).get(source_name) or {})}
+                else:
+                    local_path = Path(js_file).parent / data
+                    sources[source_name] = {'path': data, 'state': self.file_state(local_path)}
+            else:
+                # Inline data is covered by the JS file hash.
+                sources[source_name] = {'inline': True}
+        return sources
+
+    def _sources_current(self, js_file, sources):
+        for descriptor in sources.values():
+            if 'path' in descriptor:
+                previous = descriptor.get('state')
+                state = self.file_state(Path(js_file).parent / descriptor['path'], previous)
+                if state is None or previous is None or state['sha256'] != previous['sha256']:
+                    return False
+            elif 'url' in descriptor:
+                if self.remote_hash is None or descriptor.get('sha256') is None:
+                    return False
+                if self.remote_hash(descriptor['url']) != descriptor['sha256']:
+                    return False
+        return True
+
+    def is_current(self, js_file, options):
+        """Check whether ``js_file`` was already analyzed with identical inputs."""
+        entry = self.entries.get(self.key(js_file))
+        if not entry:
+            return False
+        if entry.get('tool_version') != self.tool_version or entry.get('options') != options:
+            return False
+        state = self.file_state(js_file, entry.get('js'))
+        if state is None or state['sha256'] != entry['js'].get('sha256'):
+            return False
+        if not self._sources_current(js_file, entry.get('sources', {})):
+            return False
+        parent = Path(js_file).parent
+        if not all((parent / output).exists() for output in entry.get('outputs', [])):
+            return False
+        # Refresh stat data so the next check stays a pure stat pass after a touch.
+        with self._lock:
+            entry['js'] = state
+        return True
+
+    def record(self, js_file, data_sources, options, outputs, resolved=None):
+        """Remember the inputs ``js_file`` was just analyzed with."""
+        key = self.key(js_file)
+        previous = self.entries.get(key, {}).get('js')
+        entry = {
+            'js': self.file_state(js_file, previous),
+            'sources': self.describe_sources(js_file, data_sources, resolved),
+            'tool_version': self.tool_version,
+            'options': options,
+            'outputs': sorted(outputs),
+        }
+        with self._lock:
+            self.entries[key] = entry
+
+    def entries_under(self, viz_dir):
+        """Return the entries belonging to one visualization directory."""
+        prefix = self.key(viz_dir)
+        with self._lock:
+            return {key: entry for key, entry in self.entries.items()
+                    if key == prefix or key.startswith(prefix + os.sep)}
+
+    def merge(self, entries):
+        with self._lock:
+            self.entries.update(entries)
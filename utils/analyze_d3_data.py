@@ -1,202 +1,363 @@
 #!/usr/bin/env python3
 
 import os
-import re
 import json
 import subprocess
-import requests
 import tempfile
 import argparse
 import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
 # Add the utils directory to Python path for local imports
 sys.path.append(str(Path(__file__).parent.parent))
 from utils.openai_infer import D3DataInferer
+from utils.download_cache import DownloadCache, DEFAULT_CACHE_DIR, guess_extension
+from utils.http_client import StreamingDownloader, get_downloader
+from utils.analysis_manifest import AnalysisManifest, sha256_file, tool_version
+from utils.js_extract import find_data_sources, EXTRACTOR_VERSION
+from utils.data_profiler import profile_file, profile_records, PROFILER_VERSION
+from utils.llm_cache import add_cache_arguments, cache_from_args
+from utils.prompt_builder import add_prompt_arguments, builder_from_args
+from utils.llm_response import add_json_mode_argument, format_stats
+from utils.catalog import add_catalog_arguments, catalog_from_args
+from utils.instrumentation import add_instrumentation_arguments, get_instrumentation, instrumented_run, span
 
 D3_GALLERY_PATH = "/home/juke/t5d3/root_resources/d3_gallery_downloads"
+# Optional external profiler; the in-process data_profiler is used unless --report-data-bin is given.
 REPORT_DATA_PATH = "/home/juke/t5d3/utils/report_data"
 
 def extract_data(js_file):
     """Extract both dataUrl and inline data from JavaScript file."""
     with open(js_file, 'r') as f:
         content = f.read()
-    
-    data_sources = {}
-    
-    # Look for dataUrl assignments
-    url_matches = re.findall(r'dataUrl\s*=\s*[\'"]([^\'"]+)[\'"]', content)
-    if url_matches:
-        data_sources['dataUrl'] = url_matches[0]
-    
-    # Look for inline data arrays
-    inline_data_pattern = r'data\d*\s*=\s*(\[[\s\S]*?\])'
-    inline_matches = re.findall(inline_data_pattern, content)
-    
-    for idx, match in enumerate(inline_matches, 1):
-        try:
-            # Clean up the JavaScript object notation to make it valid JSON
-            cleaned_data = re.sub(r'(\w+):', r'"\1":', match)  # Add quotes to property names
-            cleaned_data = re.sub(r'([^\\]|^)\'', r'\1"', cleaned_data)  # Replace single quotes with double quotes
-            data_sources[f'data{idx}'] = json.loads(cleaned_data)
-        except json.JSONDecodeError as e:
-            print(f"Warning: Could not parse inline data{idx} in {js_file}: {str(e)}")
-    
-    return data_sources
-
-def download_data(url):
-    """Download data from URL to a temporary file."""
+
+    return find_data_sources(content, warn=lambda msg: print(f"Warning: {msg} in {js_file}"))
+
+def catalogued_data(js_file, catalog=None):
+    """Data sources of ``js_file`` from the gallery catalog when it has them, else extracted from the file."""
+    data_sources = catalog.data_sources(js_file) if catalog is not None else None
+    return data_sources if data_sources is not None else extract_data(js_file)
+
+def list_js_files(viz_dir, catalog=None):
+    return catalog.js_files(viz_dir) if catalog is not None else list(Path(viz_dir).glob('*.js'))
+
+def download_data(url, cache=None, downloader=None):
+    """Download data from URL to a temporary file, or into the download cache if one is given."""
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        # Create temporary file with appropriate extension
-        ext = '.csv' if 'csv' in url.lower() else '.json'
+        if cache is not None:
+            return cache.fetch(url)
+
+        # Create temporary file with appropriate extension and stream the body into it
+        ext = guess_extension(url)
         temp = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
-        temp.write(response.content)
         temp.close()
+        (downloader or get_downloader()).download(url, temp.name)
         return temp.name
     except Exception as e:
         print(f"Error downloading {url}: {str(e)}")
         return None
 
-def analyze_data(data_path):
-    """Run report_data utility on the data file."""
+def analyze_data(data_path, report_tool=None):
+    """Profile a data file in-process, or with an external report_data tool if one is given."""
     try:
-        result = subprocess.run([REPORT_DATA_PATH, data_path], 
-                              capture_output=True, 
-                              text=True)
-        return result.stdout
+        if report_tool:
+            result = subprocess.run([report_tool, data_path], 
+                                  capture_output=True, 
+                                  text=True)
+            return result.stdout
+        return profile_file(data_path)
     except Exception as e:
         return f"Error analyzing data: {str(e)}"
 
-def process_visualization(viz_dir, infer=False, force_openai=False, failed_inferences=None, temperature=0):
-    """Process a single visualization directory."""
+def analyze_inline_data(data, source_name, report_tool=None, scratch_dir=None):
+    """Profile already-parsed data without a temp-file round trip (unless an external tool needs one)."""
+    if not report_tool:
+        try:
+            return profile_records(data, f"Inline Data Analysis: {source_name}")
+        except Exception as e:
+            return f"Error analyzing inline data: {str(e)}"
+
+    temp_file = Path(scratch_dir) / f'{source_name}.json'
+    try:
+        with open(temp_file, 'w') as f:
+            json.dump(data, f, indent=2)
+        return analyze_data(str(temp_file), report_tool)
+    except Exception as e:
+        return f"Error analyzing inline data: {str(e)}"
+    finally:
+        if temp_file.exists():
+            os.unlink(temp_file)  # Clean up temp file
+
+def write_inference_outputs(js_file, result, inferer, report_tool=None):
+    """Write the sample data, explanation and data report for an inference result."""
+    # Save inferred sample data
+    sample_data_path = js_file.parent / 'inferred_sample_data.json'
+    inferer.save_sample_data(result['sample_data'], sample_data_path)
+
+    # Save explanation separately
+    explanation_path = js_file.parent / 'explanation.txt'
+    explanation_content = [
+        "D3 Visualization Data Structure Inference",
+        "=" * 50,
+        f"\nData Structure:",
+        "-" * 20,
+        result['data_structure'],
+        f"\nDetailed Explanation:",
+        "-" * 20,
+        result['explanation']
+    ]
+    with open(explanation_path, 'w') as f:
+        f.write('\n'.join(explanation_content))
+
+    print(f"\nExplanation saved to: {explanation_path}")
+    print(f"Sample data saved to: {sample_data_path}")
+
+    # Generate data report for the sample data
+    inferred_report_path = js_file.parent / 'inferred_data_report.txt'
+    report_content = [
+        f"\nInferred Sample Data Analysis",
+        "=" * 50,
+        analyze_data(str(sample_data_path), report_tool) if report_tool
+        else profile_records(result['sample_data'], f"JSON File Analysis: {sample_data_path.name}")
+    ]
+
+    # Write report
+    with open(inferred_report_path, 'w') as f:
+        f.write('\n'.join(report_content))
+    print(f"Inferred data analysis report written to: {inferred_report_path}")
+    return [sample_data_path.name, explanation_path.name, inferred_report_path.name]
+
+def analysis_options(infer=False, force_openai=False, temperature=0, inferer=None):
+    """The run options a manifest entry is only current for.
+
+    Runs that may call the API also record the model, JSON mode and prompt
+    budget, which change the generated explanation and inferred reports.
+    """
+    options = {'infer': infer, 'force_openai': force_openai, 'temperature': temperature}
+    if inferer is not None and (infer or force_openai):
+        options.update(inferer.settings())
+    return options
+
+def needs_inference(data_sources, infer=False, force_openai=False):
+    return force_openai or (infer and not data_sources)
+
+def infer_gallery(viz_dirs, inferer, concurrency, temperature=0, infer=False, force_openai=False,
+                  manifest=None, force=False, requests_per_minute=None, tokens_per_minute=None, catalog=None):
+    """Run every inference the gallery needs concurrently before the per-file pass.
+
+    Returns {str(js_file): result or exception} for process_js_file to consume.
+    """
+    manifest_options = analysis_options(infer, force_openai, temperature, inferer)
+    pending = []
+    for viz_dir in viz_dirs:
+        for js_file in list_js_files(viz_dir, catalog):
+            if manifest is not None and not force and manifest.is_current(js_file, manifest_options):
+                continue
+            if needs_inference(catalogued_data(js_file, catalog), infer, force_openai):
+                pending.append(str(js_file))
+    if not pending:
+        return {}
+
+    print(f"\nInferring data structures for {len(pending)} files using OpenAI "
+          f"({concurrency} concurrent requests)...")
+    results = inferer.infer_all(pending, concurrency=concurrency, temperature=temperature,
+                                requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+    # Client exceptions do not always pickle; process-pool workers only need the message.
+    return {path: RuntimeError(str(result)) if isinstance(result, Exception) and not isinstance(result, ValueError)
+            else result for path, result in results.items()}
+
+def process_js_file(js_file, infer=False, force_openai=False, failed_inferences=None, temperature=0, cache=None, downloader=None,
+                    report_tool=None, inferer=None, inferred=None, catalog=None):
+    """Analyze a single JavaScript file; returns its data sources, the outputs it wrote and how each source resolved.
+
+    The last maps each data source to what the manifest records for it (the
+    body's ``sha256`` for a URL), or to None when it could not be downloaded,
+    found or profiled, so the file is analyzed again next run.
+
+    ``inferer`` is shared across files; ``inferred`` holds results precomputed by
+    infer_gallery, keyed by file path, which are used instead of a new request.
+    With a ``catalog`` the data sources it extracted are used instead of parsing
+    the file again.
+    """
+    if failed_inferences is None:
+        failed_inferences = []
+    outputs = []
+    resolved = {}
+
+    print(f"\nAnalyzing {js_file}...")
+    with span('extract', file=str(js_file)):
+        data_sources = catalogued_data(js_file, catalog)
+
+    if not data_sources or force_openai:
+        if not data_sources:
+            print("No data sources found in the JavaScript file.")
+        if infer or force_openai:
+            print("\nInferring data structure using OpenAI...")
+            try:
+                inferer = inferer or D3DataInferer()
+                if inferred is not None and str(js_file) in inferred:
+                    result = inferred[str(js_file)]
+                    if isinstance(result, Exception):
+                        raise result
+                else:
+                    with span('inference', file=str(js_file)):
+                        result = inferer.infer_data_structure(str(js_file), temperature=temperature)
+                with span('write outputs'):
+                    outputs.extend(write_inference_outputs(js_file, result, inferer, report_tool))
+
+            except Exception as e:
+                error_msg = str(e)
+                print(f"Error inferring data structure: {error_msg}")
+
+                # Save the failed response
+                if hasattr(e, 'response_content'):
+                    failed_parse_path = js_file.parent / 'failed_to_parse.txt'
+                    with open(failed_parse_path, 'w') as f:
+                        f.write(str(e.response_content))
+                    print(f"Failed response saved to: {failed_parse_path}")
+
+                # Track the failure
+                failed_inferences.append({
+                    'file': str(js_file),
+                    'error': error_msg,
+                    'has_data': bool(data_sources)
+                })
+
+        if not force_openai:
+            return data_sources, outputs, resolved
+
+    if data_sources:
+        print(f"\nProcessing {js_file.parent.name}...")
+
+        # Prepare report file path
+        report_path = js_file.parent / 'data_report.txt'
+        report_content = []
+
+        # Process each data source
+        for source_name, data in data_sources.items():
+            print(f"Found {source_name}")
+
+            if source_name.startswith('dataUrl'):
+                # Handle remote URL
+                if data.startswith('http'):
+                    temp_file = download_data(data, cache=cache, downloader=downloader)
+                    if temp_file:
+                        with span('profile data', source=data):
+                            source_report = analyze_data(temp_file, report_tool)
+                        resolved[source_name] = {'sha256': cache.content_hash(data) if cache is not None
+                                                 else sha256_file(temp_file)}
+                        if cache is None:
+                            os.unlink(temp_file)
+                        else:
+                            cache.release(temp_file)
+                    else:
+                        source_report = f"Could not download: {data}"
+                        resolved[source_name] = None
+                else:
+                    # For local files, look in the same directory
+                    local_path = js_file.parent / data
+                    if local_path.exists():
+                        with span('profile data', source=data):
+                            source_report = analyze_data(str(local_path), report_tool)
+                        resolved[source_name] = {}
+                    else:
+                        source_report = f"Local file not found: {data}"
+                        resolved[source_name] = None
+            else:
+                # Handle inline data
+                with span('profile data', source=source_name):
+                    source_report = analyze_inline_data(data, source_name, report_tool, scratch_dir=js_file.parent)
+                resolved[source_name] = {}
+            if isinstance(source_report, str) and source_report.startswith(('Error analyzing', 'Could not')):
+                resolved[source_name] = None
+
+            # Add to report
+            report_content.extend([
+                f"\nData Source: {source_name}",
+                "=" * 50,
+                source_report if source_report else "No data analysis available"
+            ])
+
+        # Write complete report
+        with span('write outputs'), open(report_path, 'w') as f:
+            f.write('\n'.join(report_content))
+
+        print(f"Original data analysis report written to: {report_path}")
+        outputs.append(report_path.name)
+
+    return data_sources, outputs, resolved
+
+def process_visualization(viz_dir, infer=False, force_openai=False, failed_inferences=None, temperature=0,
+                          cache=None, downloader=None, manifest=None, force=False, report_tool=None,
+                          inferer=None, inferred=None, catalog=None):
+    """Process a single visualization directory.
+
+    When a manifest is given, JS files whose inputs are unchanged since the last
+    run are skipped unless ``force`` is set.
+    """
     if failed_inferences is None:
         failed_inferences = []
         
-    js_files = list(Path(viz_dir).glob('*.js'))
+    js_files = list_js_files(viz_dir, catalog)
     if not js_files:
         print(f"No JavaScript files found in {viz_dir}")
         return
 
+    manifest_options = analysis_options(infer, force_openai, temperature, inferer)
     for js_file in js_files:
-        print(f"\nAnalyzing {js_file}...")
-        data_sources = extract_data(js_file)
-
-        if not data_sources or force_openai:
-            if not data_sources:
-                print("No data sources found in the JavaScript file.")
-            if infer or force_openai:
-                print("\nInferring data structure using OpenAI...")
-                try:
-                    inferer = D3DataInferer()
-                    result = inferer.infer_data_structure(str(js_file), temperature=temperature)
-                    
-                    # Save inferred sample data
-                    sample_data_path = js_file.parent / 'inferred_sample_data.json'
-                    inferer.save_sample_data(result['sample_data'], sample_data_path)
-                    
-                    # Save explanation separately
-                    explanation_path = js_file.parent / 'explanation.txt'
-                    explanation_content = [
-                        "D3 Visualization Data Structure Inference",
-                        "=" * 50,
-                        f"\nData Structure:",
-                        "-" * 20,
-                        result['data_structure'],
-                        f"\nDetailed Explanation:",
-                        "-" * 20,
-                        result['explanation']
-                    ]
-                    with open(explanation_path, 'w') as f:
-                        f.write('\n'.join(explanation_content))
-                    
-                    print(f"\nExplanation saved to: {explanation_path}")
-                    print(f"Sample data saved to: {sample_data_path}")
-                    
-                    # Generate data report for the sample data
-                    inferred_report_path = js_file.parent / 'inferred_data_report.txt'
-                    report_content = [
-                        f"\nInferred Sample Data Analysis",
-                        "=" * 50,
-                        analyze_data(str(sample_data_path))
-                    ]
-                    
-                    # Write report
-                    with open(inferred_report_path, 'w') as f:
-                        f.write('\n'.join(report_content))
-                    print(f"Inferred data analysis report written to: {inferred_report_path}")
-                    
-                except Exception as e:
-                    error_msg = str(e)
-                    print(f"Error inferring data structure: {error_msg}")
-                    
-                    # Save the failed response
-                    if hasattr(e, 'response_content'):
-                        failed_parse_path = js_file.parent / 'failed_to_parse.txt'
-                        with open(failed_parse_path, 'w') as f:
-                            f.write(str(e.response_content))
-                        print(f"Failed response saved to: {failed_parse_path}")
-                    
-                    # Track the failure
-                    failed_inferences.append({
-                        'file': str(js_file),
-                        'error': error_msg,
-                        'has_data': bool(data_sources)
-                    })
-                    
-            if not force_openai:
-                continue
+        if manifest is not None and not force and manifest.is_current(js_file, manifest_options):
+            print(f"\nSkipping {js_file}: inputs unchanged since last analysis")
+            continue
 
-        if data_sources:
-            print(f"\nProcessing {js_file.parent.name}...")
-            
-            # Prepare report file path
-            report_path = js_file.parent / 'data_report.txt'
-            report_content = []
-            
-            # Process each data source
-            for source_name, data in data_sources.items():
-                print(f"Found {source_name}")
-                
-                if source_name == 'dataUrl':
-                    # Handle remote URL
-                    if data.startswith('http'):
-                        temp_file = download_data(data)
-                        if temp_file:
-                            source_report = analyze_data(temp_file)
-                            os.unlink(temp_file)
-                    else:
-                        # For local files, look in the same directory
-                        local_path = js_file.parent / data
-                        if local_path.exists():
-                            source_report = analyze_data(str(local_path))
-                        else:
-                            source_report = f"Local file not found: {data}"
-                else:
-                    # Handle inline data
-                    temp_file = js_file.parent / f'{source_name}.json'
-                    try:
-                        with open(temp_file, 'w') as f:
-                            json.dump(data, f, indent=2)
-                        source_report = analyze_data(str(temp_file))
-                        os.unlink(temp_file)  # Clean up temp file
-                    except Exception as e:
-                        source_report = f"Error analyzing inline data: {str(e)}"
-                
-                # Add to report
-                report_content.extend([
-                    f"\nData Source: {source_name}",
-                    "=" * 50,
-                    source_report if source_report else "No data analysis available"
-                ])
-            
-            # Write complete report
-            with open(report_path, 'w') as f:
-                f.write('\n'.join(report_content))
-            
-            print(f"Original data analysis report written to: {report_path}")
+        failures_before = len(failed_inferences)
+        data_sources, outputs, resolved = process_js_file(js_file, infer=infer, force_openai=force_openai,
+                                                          failed_inferences=failed_inferences, temperature=temperature,
+                                                          cache=cache, downloader=downloader, report_tool=report_tool,
+                                                          inferer=inferer, inferred=inferred, catalog=catalog)
+
+        # Failed inferences and sources that could not be downloaded or profiled are retried on the next run.
+        if (manifest is not None and len(failed_inferences) == failures_before
+                and all(state is not None for state in resolved.values())):
+            manifest.record(js_file, data_sources, manifest_options, outputs, resolved)
+
+def process_visualization_job(viz_dir, **options):
+    """Process one visualization directory in a pool worker.
+
+    Returns the directory's failures, its manifest entries when a manifest is in
+    use, and in a process-pool worker the spans and counters it recorded, so
+    they can be handed back to the parent.
+    """
+    failures = []
+    process_visualization(viz_dir, failed_inferences=failures, **options)
+    manifest = options.get('manifest')
+    timings = get_instrumentation().drain() if multiprocessing.parent_process() is not None else None
+    return failures, manifest.entries_under(viz_dir) if manifest is not None else {}, timings
+
+def process_gallery(viz_dirs, workers=1, executor='thread', **options):
+    """Process visualization directories, fanning out to a bounded pool when workers > 1.
+
+    Failures are merged in directory order so the summary matches a serial run.
+    """
+    failed_inferences = []
+
+    if workers <= 1:
+        for viz_dir in viz_dirs:
+            process_visualization(viz_dir, failed_inferences=failed_inferences, **options)
+        return failed_inferences
+
+    pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+    with pool_class(max_workers=workers) as pool:
+        futures = [pool.submit(process_visualization_job, viz_dir, **options) for viz_dir in viz_dirs]
+        for future in futures:
+            failures, manifest_entries, timings = future.result()
+            get_instrumentation().merge(timings)
+            failed_inferences.extend(failures)
+            if options.get('manifest') is not None:
+                options['manifest'].merge(manifest_entries)
+
+    return failed_inferences
 
 def main():
     parser = argparse.ArgumentParser(description='Analyze D3 visualization data files')
@@ -204,19 +365,102 @@ def main():
     parser.add_argument('--infer', '-i', action='store_true', help='Use OpenAI to infer data structure when data is unavailable')
     parser.add_argument('--force-open-ai', '-f', action='store_true', help='Force OpenAI inference for all JS files, even if they have data')
     parser.add_argument('--temperature', '-t', type=float, default=0, help='OpenAI temperature parameter (default: 0)')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='Number of visualization directories to process concurrently (default: 1)')
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread', help='Worker pool type used when --workers > 1 (default: thread)')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f'Download cache directory for dataUrl sources (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-max-mb', type=float, default=2048, help='Maximum download cache size in MB before LRU eviction (default: 2048)')
+    parser.add_argument('--no-cache', action='store_true', help='Always download dataUrl sources to temporary files')
+    parser.add_argument('--report-data-bin', nargs='?', const=REPORT_DATA_PATH, default=None,
+                        help=f'Profile data with an external report_data tool instead of the in-process profiler (default path: {REPORT_DATA_PATH})')
+    parser.add_argument('--force', action='store_true', help='Reprocess every JS file, ignoring the incremental analysis manifest')
+    parser.add_argument('--no-manifest', action='store_true', help='Do not read or update the incremental analysis manifest')
+    parser.add_argument('--http-pool-size', type=int, default=8, help='Maximum pooled connections per host for downloads (default: 8)')
+    parser.add_argument('--http-timeout', type=float, default=60, help='Download read timeout in seconds (default: 60)')
+    parser.add_argument('--http-retries', type=int, default=3, help='Retries with exponential backoff for failed downloads (default: 3)')
+    parser.add_argument('--max-download-mb', type=float, default=1024, help='Reject dataUrl bodies larger than this many MB (default: 1024)')
+    parser.add_argument('--offline', action='store_true', help='Serve dataUrl sources only from the download cache')
+    parser.add_argument('--revalidate-hours', type=float,
+                        help='Revalidate cached dataUrl sources last checked more than this many hours ago; '
+                             'by default unchanged JS files trust the cached copy and are skipped without a request')
+    parser.add_argument('--infer-concurrency', type=int, default=0,
+                        help='Run OpenAI inferences up front with this many concurrent requests (default: 0, one at a time inline)')
+    parser.add_argument('--requests-per-minute', type=int, help='Rate limit for concurrent OpenAI requests (default: unlimited)')
+    parser.add_argument('--tokens-per-minute', type=int, help='Token rate limit for concurrent OpenAI requests (default: unlimited)')
+    parser.add_argument('--openai-base-url', help='OpenAI-compatible API base URL, e.g. a local mock server (default: OPENAI_BASE_URL or api.openai.com)')
+    add_json_mode_argument(parser)
+    add_cache_arguments(parser)
+    add_prompt_arguments(parser)
+    add_catalog_arguments(parser)
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
 
     if not os.path.isdir(args.dir):
         print(f"Error: {args.dir} is not a directory")
         sys.exit(1)
 
-    # Track failed inferences
-    failed_inferences = []
-    
-    for viz_dir in sorted(Path(args.dir).iterdir()):
-        if viz_dir.is_dir():
-            process_visualization(viz_dir, infer=args.infer, force_openai=args.force_open_ai, 
-                               failed_inferences=failed_inferences, temperature=args.temperature)
+    downloader = StreamingDownloader(pool_maxsize=args.http_pool_size, retries=args.http_retries,
+                                     timeout=(10, args.http_timeout),
+                                     max_bytes=int(args.max_download_mb * 1024 ** 2))
+    cache = None
+    if not args.no_cache:
+        cache = DownloadCache(args.cache_dir, max_bytes=int(args.cache_max_mb * 1024 ** 2),
+                              offline=args.offline, downloader=downloader,
+                              revalidate_after=args.revalidate_hours * 3600 if args.revalidate_hours is not None else None)
+    elif args.offline:
+        print("Error: --offline requires the download cache")
+        sys.exit(1)
+
+    manifest = None
+    if not args.no_manifest:
+        report_version = tool_version(args.report_data_bin) if args.report_data_bin else PROFILER_VERSION
+        manifest = AnalysisManifest(args.dir, tool_version=f"{report_version}+extract{EXTRACTOR_VERSION}",
+                                    remote_hash=cache.content_hash if cache is not None else None)
+
+    catalog = catalog_from_args(args, args.dir)
+    if catalog is not None:
+        viz_dirs = catalog.visualizations()
+    else:
+        viz_dirs = [viz_dir for viz_dir in sorted(Path(args.dir).iterdir()) if viz_dir.is_dir()]
+
+    inferer = None
+    inferred = None
+    llm_cache = None
+    prompt_builder = None
+    if args.infer or args.force_open_ai:
+        llm_cache = cache_from_args(args)
+        prompt_builder = builder_from_args(args)
+        try:
+            inferer = D3DataInferer(base_url=args.openai_base_url, cache=llm_cache, prompt_builder=prompt_builder,
+                                    json_mode=not args.no_json_mode)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+    with instrumented_run(args):
+        if inferer is not None and args.infer_concurrency > 0:
+            inferred = infer_gallery(viz_dirs, inferer, args.infer_concurrency, temperature=args.temperature,
+                                     infer=args.infer, force_openai=args.force_open_ai, manifest=manifest,
+                                     force=args.force, requests_per_minute=args.requests_per_minute,
+                                     tokens_per_minute=args.tokens_per_minute, catalog=catalog)
+
+        # Track failed inferences
+        failed_inferences = process_gallery(viz_dirs, workers=args.workers, executor=args.executor,
+                                            infer=args.infer, force_openai=args.force_open_ai,
+                                            temperature=args.temperature, cache=cache,
+                                            downloader=downloader, manifest=manifest, force=args.force,
+                                            report_tool=args.report_data_bin, inferer=inferer, inferred=inferred,
+                                            catalog=catalog)
+        if manifest is not None:
+            manifest.save()
+    # Process-pool workers keep their own statistics.
+    if args.workers <= 1 or args.executor == 'thread':
+        if llm_cache is not None:
+            print(llm_cache.summary())
+        if inferer is not None and inferer.parse_stats:
+            print(format_stats(inferer.parse_stats))
+        if prompt_builder is not None and prompt_builder.stats:
+            print("\nPrompt tokens:")
+            print(prompt_builder.format_report(only_trimmed=True))
 
     # Report failures if any occurred
     if failed_inferences:
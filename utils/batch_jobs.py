@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+import requests
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.instrumentation import span
+from utils.jsonl_io import iter_records
+from utils.rate_limit import backoff_delay, retry_after
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+COMPLETION_WINDOW = '24h'
+# OpenAI accepts up to 50,000 requests and 200 MB per batch input file.
+MAX_JOB_REQUESTS = 50_000
+MAX_JOB_BYTES = 190 * 1024 * 1024
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+STATE_NAME = 'jobs.json'
+
+
+def batch_line(custom_id, body):
+    """One line of a batch input file: a chat completion request tagged with ``custom_id``."""
+    return json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': BATCH_ENDPOINT, 'body': body},
+                      ensure_ascii=False) + '\n'
+
+
+def write_job_files(requests, directory, max_requests=MAX_JOB_REQUESTS, max_bytes=MAX_JOB_BYTES):
+    """Serialize ``(custom_id, body)`` pairs into as many job files as the batch limits need.
+
+    Returns the paths written, in order; nothing is held in memory beyond the
+    current line.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    f = None
+    count = size = 0
+    try:
+        for custom_id, body in requests:
+            line = batch_line(custom_id, body).encode('utf-8')
+            if f is None or count >= max_requests or (count and size + len(line) > max_bytes):
+                if f is not None:
+                    f.close()
+                paths.append(os.path.join(directory, f"job_{len(paths):04d}.jsonl"))
+                f = open(paths[-1], 'wb')
+                count = size = 0
+            f.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if f is not None:
+            f.close()
+    return paths
+
+
+def result_content(record):
+    """(assistant message, error) for one line of a batch output or error file."""
+    if record.get('error'):
+        error = record['error']
+        return None, error.get('message', str(error)) if isinstance(error, dict) else str(error)
+    response = record.get('response') or {}
+    body = response.get('body') or {}
+    status = response.get('status_code', 200)
+    if status != 200:
+        message = body.get('error', {}).get('message') if isinstance(body.get('error'), dict) else body
+        return None, f"HTTP {status}: {str(message)[:200]}"
+    try:
+        return body['choices'][0]['message']['content'], None
+    except (KeyError, IndexError, TypeError):
+        return None, "Batch response has no message content"
+
+
+class OpenAIBatchBackend:
+    """Submit job files to the OpenAI Batch API (half price, results within 24 hours)."""
+
+    def __init__(self, api_key=None, base_url=None, download_dir=None):
+        self.client = openai.OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"),
+                                    base_url=base_url or os.getenv("OPENAI_BASE_URL"))
+        self.download_dir = download_dir
+
+    def submit(self, path):
+        with open(path, 'rb') as f:
+            upload = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(input_file_id=upload.id, endpoint=BATCH_ENDPOINT,
+                                           completion_window=COMPLETION_WINDOW)
+        return batch.id
+
+    def retrieve(self, job_id):
+        batch = self.client.batches.retrieve(job_id)
+        counts = batch.request_counts
+        return {
+            'status': batch.status,
+            'output_file_id': batch.output_file_id,
+            'error_file_id': batch.error_file_id,
+            'request_counts': counts.model_dump() if counts is not None else {},
+            'errors': batch.errors.model_dump() if batch.errors is not None else None,
+        }
+
+    def results(self, job_id, job):
+        """Download the job's output and error files to disk and stream their records."""
+        for file_id in (job.get('output_file_id'), job.get('error_file_id')):
+            if not file_id:
+                continue
+            fd, path = tempfile.mkstemp(dir=self.download_dir, suffix='.jsonl')
+            os.close(fd)
+            try:
+                self.client.files.content(file_id).write_to_file(path)
+                yield from iter_records(path)
+            finally:
+                os.unlink(path)
+
+    def cancel(self, job_id):
+        self.client.batches.cancel(job_id)
+
+
+class LocalBatchBackend:
+    """File-based stand-in for the Batch API.
+
+    Each job is a directory under ``root`` holding the submitted
+    ``input.jsonl``, a ``status.json`` and an ``output.jsonl`` in the Batch
+    API's result format. A background thread answers requests with
+    ``handler(body) -> chat completion`` (see ``endpoint_handler`` and
+    ``responder_handler``). Jobs survive restarts: re-attaching to a job that
+    was still running resumes it after the results already written.
+    """
+
+    def __init__(self, root, handler, workers=4):
+        self.root = Path(root)
+        self.handler = handler
+        self.workers = workers
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Threads and locks are per process.
+        state = self.__dict__.copy()
+        state['_threads'] = {}
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _status_path(self, job_id):
+        return self.root / job_id / 'status.json'
+
+    def _read_status(self, job_id):
+        with open(self._status_path(job_id)) as f:
+            return json.load(f)
+
+    def _write_status(self, job_id, status):
+        path = self._status_path(job_id)
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(status))
+        os.replace(tmp, path)
+
+    def submit(self, path):
+        job_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        job_dir = self.root / job_id
+        job_dir.mkdir(parents=True)
+        shutil.copyfile(path, job_dir / 'input.jsonl')
+        total = sum(1 for _ in iter_records(job_dir / 'input.jsonl'))
+        self._write_status(job_id, {'status': 'in_progress', 'created_at': time.time(),
+                                    'request_counts': {'total': total, 'completed': 0, 'failed': 0}})
+        self._start(job_id)
+        return job_id
+
+    def _start(self, job_id):
+        with self._lock:
+            thread = self._threads.get(job_id)
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=self._process, args=(job_id,), daemon=True)
+                self._threads[job_id] = thread
+                thread.start()
+
+    def _answer(self, line):
+        try:
+            body = self.handler(line['body'])
+            response = {'status_code': 200, 'request_id': body.get('id'), 'body': body}
+            return {'id': f"batch_req_{uuid.uuid4().hex[:12]}", 'custom_id': line['custom_id'],
+                    'response': response, 'error': None}
+        except Exception as e:
+            return {'id': f"batch_req_{uuid.uuid4().hex[:12]}", 'custom_id': line['custom_id'],
+                    'response': None, 'error': {'code': 'request_failed', 'message': str(e)}}
+
+    def _process(self, job_id):
+        job_dir = self.root / job_id
+        output = job_dir / 'output.jsonl'
+        status = self._read_status(job_id)
+        counts = status['request_counts']
+        done = set()
+        if output.exists():
+            # A torn last line from an interrupted run is dropped and its request answered again.
+            with open(output, 'r+', encoding='utf-8') as f:
+                good = 0
+                for line in f:
+                    try:
+                        done.add(json.loads(line)['custom_id'])
+                    except (json.JSONDecodeError, KeyError):
+                        break
+                    good += len(line.encode('utf-8'))
+                f.truncate(good)
+        pending = (line for line in iter_records(job_dir / 'input.jsonl') if line['custom_id'] not in done)
+        counts['completed'] = counts['failed'] = 0
+        try:
+            with open(output, 'a', encoding='utf-8') as f, ThreadPoolExecutor(self.workers) as pool:
+                for record in pool.map(self._answer, pending):
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    f.flush()
+                    counts['failed' if record['error'] else 'completed'] += 1
+            status.update(status='completed', completed_at=time.time(), output_file_id=str(output))
+        except Exception as e:
+            logger.error(f"Local batch job {job_id} failed: {e}")
+            status.update(status='failed', errors=str(e))
+        counts['completed'] += len(done)
+        if self._read_status(job_id)['status'] == 'cancelled':
+            return
+        self._write_status(job_id, status)
+
+    def retrieve(self, job_id):
+        status = self._read_status(job_id)
+        if status['status'] not in TERMINAL_STATUSES:
+            self._start(job_id)
+        return status
+
+    def results(self, job_id, job):
+        output = self.root / job_id / 'output.jsonl'
+        if output.exists():
+            yield from iter_records(output)
+
+    def cancel(self, job_id):
+        status = self._read_status(job_id)
+        status['status'] = 'cancelled'
+        self._write_status(job_id, status)
+
+
+def endpoint_handler(base_url, api_key=None, max_retries=5, timeout=600):
+    """Handler for LocalBatchBackend that POSTs each request to a chat completions endpoint."""
+    url = base_url.rstrip('/') + '/chat/completions'
+    headers = {"Authorization": f"Bearer {api_key or os.getenv('OPENAI_API_KEY', '')}",
+               "Content-Type": "application/json"}
+    local = threading.local()
+
+    def handler(body):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        for attempt in range(max_retries + 1):
+            response = session.post(url, headers=headers, json=body, timeout=timeout)
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+            wait = retry_after(response.headers)
+            time.sleep(wait if wait is not None else backoff_delay(attempt))
+
+    return handler
+
+
+def responder_handler(responder):
+    """Handler for LocalBatchBackend that answers with ``responder(body)`` and no network at all."""
+    def handler(body):
+        content = responder(body)
+        return {'id': f"chatcmpl-local-{uuid.uuid4().hex[:12]}", 'object': 'chat.completion',
+                'model': body.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                             'finish_reason': 'stop'}]}
+    return handler
+
+
+class BatchRun:
+    """Submit requests as batch jobs, poll them and stream back their results.
+
+    Job files and job IDs are kept in ``workdir`` (``jobs.json``), so an
+    interrupted run re-attaches to the jobs it already submitted instead of
+    paying for them twice. ``results()`` yields ``(custom_id, content, error)``
+    as each job finishes; ``cleanup()`` removes the working directory once
+    every result has been consumed.
+    """
+
+    def __init__(self, backend, workdir, poll_interval=30.0):
+        self.backend = backend
+        self.workdir = Path(workdir)
+        self.poll_interval = poll_interval
+        self.state_path = self.workdir / STATE_NAME
+        self.jobs = []
+
+    def exists(self):
+        return self.state_path.exists()
+
+    def _save(self):
+        tmp = self.state_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'jobs': self.jobs}, indent=2))
+        os.replace(tmp, self.state_path)
+
+    def load(self):
+        with open(self.state_path) as f:
+            self.jobs = json.load(f)['jobs']
+        logger.info(f"Re-attaching to {len(self.jobs)} batch jobs from {self.state_path}")
+        return self
+
+    def prepare(self, requests):
+        """Write job files for ``(custom_id, body)`` pairs; returns how many files there are."""
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        shutil.rmtree(self.workdir / 'input', ignore_errors=True)
+        with span('batch prepare'):
+            paths = write_job_files(requests, self.workdir / 'input')
+        self.jobs = [{'file': os.path.relpath(path, self.workdir), 'id': None, 'status': None} for path in paths]
+        self._save()
+        return len(paths)
+
+    def submit(self):
+        for job in self.jobs:
+            if job['id'] is None:
+                with span('batch submit', file=job['file']):
+                    job['id'] = self.backend.submit(self.workdir / job['file'])
+                job['status'] = 'submitted'
+                self._save()
+                logger.info(f"Submitted {job['file']} as batch job {job['id']}")
+
+    def results(self):
+        self.submit()
+        pending = [job for job in self.jobs if job['status'] != 'collected']
+        while pending:
+            for job in list(pending):
+                info = self.backend.retrieve(job['id'])
+                if info['status'] != job['status']:
+                    counts = info.get('request_counts') or {}
+                    logger.info(f"Batch job {job['id']}: {info['status']} "
+                                f"({counts.get('completed', 0)}/{counts.get('total', '?')} done)")
+                    job['status'] = info['status']
+                    self._save()
+                if info['status'] not in TERMINAL_STATUSES:
+                    continue
+                if info['status'] != 'completed':
+                    logger.error(f"Batch job {job['id']} ended {info['status']}: {info.get('errors')}")
+                for record in self.backend.results(job['id'], info):
+                    content, error = result_content(record)
+                    yield record['custom_id'], content, error
+                job['status'] = 'collected'
+                self._save()
+                pending.remove(job)
+            if pending:
+                with span('batch wait'):
+                    time.sleep(self.poll_interval)
+
+    def cleanup(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def add_batch_arguments(parser, default_dir_help='OUTPUT.batch'):
+    """Register the --batch/--batch-dir/--poll-interval flags shared by the bulk LLM scripts."""
+    group = parser.add_argument_group('Batch jobs')
+    group.add_argument('--batch', choices=('openai', 'local'),
+                       help='Run requests as batch jobs instead of live calls: "openai" uses the Batch API, '
+                            '"local" a file-based stand-in that calls the endpoint from a background thread')
+    group.add_argument('--batch-dir', help=f'Job files and job IDs for --batch; rerunning with --resume '
+                                           f're-attaches to submitted jobs (default: {default_dir_help})')
+    group.add_argument('--poll-interval', type=float, default=30.0,
+                       help='Seconds between batch job status checks (default: 30)')
+    return group
+
+
+def backend_from_args(args, workdir, api_key=None):
+    """Batch backend selected by --batch, or None for live requests."""
+    if args.batch is None:
+        return None
+    if args.batch == 'openai':
+        return OpenAIBatchBackend(api_key=api_key, base_url=args.base_url, download_dir=workdir)
+    base_url = args.base_url or os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1"
+    return LocalBatchBackend(Path(workdir) / 'local', endpoint_handler(base_url, api_key))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check or cancel batch jobs recorded in a --batch-dir')
+    parser.add_argument('batch_dir', help='Working directory of a --batch run')
+    parser.add_argument('--cancel', action='store_true', help='Cancel every job that has not finished')
+    parser.add_argument('--base-url', help='OpenAI-compatible API base URL')
+    args = parser.parse_args()
+
+    run = BatchRun(None, args.batch_dir)
+    if not run.exists():
+        sys.exit(f"No batch jobs recorded in {args.batch_dir}")
+    local_root = Path(args.batch_dir) / 'local'
+    run.backend = (LocalBatchBackend(local_root, handler=None) if local_root.exists()
+                   else OpenAIBatchBackend(base_url=args.base_url))
+    for job in run.load().jobs:
+        if job['id'] is None:
+            print(f"{job['file']}: not submitted")
+            continue
+        if isinstance(run.backend, LocalBatchBackend):
+            info = run.backend._read_status(job['id'])
+        else:
+            info = run.backend.retrieve(job['id'])
+        counts = info.get('request_counts') or {}
+        print(f"{job['id']}: {info['status']} ({counts.get('completed', 0)}/{counts.get('total', '?')} done, "
+              f"{counts.get('failed', 0)} failed)")
+        if args.cancel and info['status'] not in TERMINAL_STATUSES:
+            run.backend.cancel(job['id'])
+            print("  cancelled")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.generate_training_data import generate_training_data
+from utils.refine_training_data import BatchProcessor
+from utils.jsonl_io import iter_records
+from utils.benchmarks.mock_servers import CompletionsServer
+
+CHART_JS = """import * as d3 from 'd3';
+
+export default function createVisualization(container) {{
+  // chart {i}
+  const margin = {{top: 20, right: 30, bottom: 40, left: 50}};
+  const width = 640 - margin.left - margin.right, height = 400 - margin.top - margin.bottom;
+  const svg = d3.select(container).append('svg')
+      .attr('width', width + margin.left + margin.right)
+      .attr('height', height + margin.top + margin.bottom)
+    .append('g').attr('transform', `translate(${{margin.left}},${{margin.top}})`);
+  d3.csv('data_{i}.csv', d3.autoType).then(data => {{
+    const x = d3.scaleBand().domain(data.map(d => d.name)).range([0, width]).padding(0.1);
+    const y = d3.scaleLinear().domain([0, d3.max(data, d => d.value)]).nice().range([height, 0]);
+    svg.append('g').attr('transform', `translate(0,${{height}})`).call(d3.axisBottom(x));
+    svg.append('g').call(d3.axisLeft(y));
+    svg.selectAll('rect').data(data).join('rect')
+      .attr('x', d => x(d.name)).attr('y', d => y(d.value))
+      .attr('width', x.bandwidth()).attr('height', d => height - y(d.value)).attr('fill', 'steelblue');
+  }});
+}}
+"""
+
+
+def write_gallery(root, charts, queries):
+    for i in range(charts):
+        viz = Path(root) / f"chart_{i}"
+        viz.mkdir()
+        (viz / 'chart.js').write_text(CHART_JS.format(i=i) * 4)
+        (viz / 'queries.json').write_text(json.dumps(
+            {'queries': [{'query': f"Compare the values of dataset {i}, variant {q}"} for q in range(queries)]}))
+
+
+def request_tokens(server):
+    """Prompt and completion tokens the mock server billed, using its own estimates."""
+    prompt = completion = 0
+    for _, request in server.request_log:
+        prompt += server._prompt_tokens(request)
+        completion += max(1, len(server.responder(request)) // 4)
+    return prompt, completion
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare inline and deduplicated training data and grouped refinement')
+    parser.add_argument('--charts', type=int, default=40, help='Synthetic visualizations (default: 40)')
+    parser.add_argument('--queries', type=int, default=5, help='Queries per visualization (default: 5)')
+    parser.add_argument('--latency', type=float, default=0.05, help='Mock latency per request in seconds (default: 0.05)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='dedupe_bench_') as tmp:
+        gallery = os.path.join(tmp, 'gallery')
+        os.mkdir(gallery)
+        write_gallery(gallery, args.charts, args.queries)
+        inline = os.path.join(tmp, 'inline.jsonl')
+        deduped = os.path.join(tmp, 'deduped.jsonl')
+        generate_training_data(gallery, inline)
+        generate_training_data(gallery, deduped, os.path.join(tmp, 'deduped.sources.jsonl'))
+        inline_size = os.path.getsize(inline)
+        deduped_size = os.path.getsize(deduped) + os.path.getsize(os.path.join(tmp, 'deduped.sources.jsonl'))
+        print(f"{args.charts} charts x {args.queries} queries")
+        print(f"training data: inline {inline_size / 1024:.0f} KB, deduplicated {deduped_size / 1024:.0f} KB "
+              f"({inline_size / deduped_size:.1f}x smaller)")
+        print("=" * 78)
+
+        baseline = None
+        for label, source, grouped in (('per example', inline, False), ('grouped', deduped, True)):
+            output = os.path.join(tmp, f"refined_{grouped}.jsonl")
+            with CompletionsServer(latency=args.latency) as server:
+                processor = BatchProcessor(api_key='mock-key', base_url=server.api_base)
+                start = time.perf_counter()
+                processor.process_in_batches(source, output, concurrency=16, group_by_source=grouped)
+                elapsed = time.perf_counter() - start
+                prompt, completion = request_tokens(server)
+            refined = sum(1 for _ in iter_records(output))
+            total = prompt + completion
+            baseline = baseline or total
+            print(f"{label:<12} {len(server.request_log):>5} requests  {prompt:>9,} prompt + {completion:>9,} completion "
+                  f"tokens  ({baseline / total:.1f}x)  {refined} refined  {os.path.getsize(output) / 1024:.0f} KB  "
+                  f"{elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
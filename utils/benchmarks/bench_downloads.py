@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import resource
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.http_client import StreamingDownloader, DownloadTooLarge
+from utils.benchmarks.mock_servers import DataServer
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(size_mb, files, workers, pool_size, fail_first):
+    size = int(size_mb * 1024 ** 2)
+    with DataServer(fail_first=fail_first) as server, tempfile.TemporaryDirectory() as tmp:
+        urls = [server.add_generated(f"large_{i}.csv", size) for i in range(files)]
+        downloader = StreamingDownloader(pool_maxsize=pool_size, backoff_factor=0.01)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            paths = [os.path.join(tmp, f"{i}.csv") for i in range(files)]
+            list(pool.map(downloader.download, urls, paths))
+        elapsed = time.perf_counter() - start
+
+        for path in paths:
+            assert os.path.getsize(path) == size, f"{path} is truncated"
+
+        guarded = StreamingDownloader(max_bytes=size // 2)
+        try:
+            guarded.download(urls[0], os.path.join(tmp, 'guarded.csv'))
+            guard_ok = False
+        except DownloadTooLarge:
+            guard_ok = not os.path.exists(os.path.join(tmp, 'guarded.csv'))
+
+        total_mb = size_mb * files
+        print(f"Downloaded {files} x {size_mb:.0f} MB in {elapsed:.2f}s "
+              f"({total_mb / elapsed:.1f} MB/s, {len(server.request_log)} requests)")
+        print(f"Peak RSS: {peak_rss_mb():.1f} MB")
+        print(f"Size guard rejected oversized body: {'yes' if guard_ok else 'NO'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pooled streaming downloads against a local data server')
+    parser.add_argument('--size-mb', type=float, default=256, help='Size of each served file in MB (default: 256)')
+    parser.add_argument('--files', type=int, default=4, help='Number of files to download (default: 4)')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent downloads (default: 4)')
+    parser.add_argument('--pool-size', type=int, default=4, help='Pooled connections per host (default: 4)')
+    parser.add_argument('--fail-first', type=int, default=1, help='503 responses served before each file succeeds (default: 1)')
+    args = parser.parse_args()
+    run(args.size_mb, args.files, args.workers, args.pool_size, args.fail_first)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+import json
+import math
+import time
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.js_extract import find_data_sources
+
+VISUALIZATIONS_DIR = Path(__file__).parent.parent.parent / 'visualizations'
+
+
+def legacy_extract(content):
+    """The regex extractor analyze_d3_data.extract_data used before the tokenizer."""
+    data_sources = {}
+    url_matches = re.findall(r'dataUrl\s*=\s*[\'"]([^\'"]+)[\'"]', content)
+    if url_matches:
+        data_sources['dataUrl'] = url_matches[0]
+    inline_matches = re.findall(r'data\d*\s*=\s*(\[[\s\S]*?\])', content)
+    for idx, match in enumerate(inline_matches, 1):
+        try:
+            cleaned_data = re.sub(r'(\w+):', r'"\1":', match)
+            cleaned_data = re.sub(r'([^\\]|^)\'', r'\1"', cleaned_data)
+            data_sources[f'data{idx}'] = json.loads(cleaned_data)
+        except json.JSONDecodeError:
+            pass
+    return data_sources
+
+
+# Fixtures with known answers covering the cases the regexes get wrong.
+ACCURACY_CASES = [
+    ("flat array", "const data = [1, 2, 3];", {'data1': [1, 2, 3]}),
+    ("nested arrays", "const data = [[1, 2], [3, [4, 5]]];", {'data1': [[1, 2], [3, [4, 5]]]}),
+    ("objects with bare keys", "const data = [{name: 'a', value: 1}, {name: 'b', value: 2}];",
+     {'data1': [{'name': 'a', 'value': 1}, {'name': 'b', 'value': 2}]}),
+    ("string containing colon", "const data = [{label: 'ratio: 1:2', time: '10:30'}];",
+     {'data1': [{'label': 'ratio: 1:2', 'time': '10:30'}]}),
+    ("trailing commas", "const data = [\n  {x: 1, y: 2,},\n  {x: 3, y: 4,},\n];",
+     {'data1': [{'x': 1, 'y': 2}, {'x': 3, 'y': 4}]}),
+    ("comments inside literal", "const data = [\n  // first\n  {x: 1}, /* second */ {x: 2}\n];",
+     {'data1': [{'x': 1}, {'x': 2}]}),
+    ("template strings", "const data = [{name: `alpha`}, {name: `beta`}];",
+     {'data1': [{'name': 'alpha'}, {'name': 'beta'}]}),
+    ("escaped quotes", "const data = [{name: 'O\\'Brien'}];", {'data1': [{'name': "O'Brien"}]}),
+    ("dataUrl assignment", "const dataUrl = 'https://example.org/a.csv';",
+     {'dataUrl': 'https://example.org/a.csv'}),
+    ("d3 loader call", "d3.csv('https://example.org/b.csv').then(draw);",
+     {'dataUrl': 'https://example.org/b.csv'}),
+    ("fetch call", "fetch('https://example.org/c.json').then(r => r.json());",
+     {'dataUrl': 'https://example.org/c.json'}),
+    ("object literal", "const data = {nodes: [{id: 1}], links: []};",
+     {'data1': {'nodes': [{'id': 1}], 'links': []}}),
+]
+
+
+def _same(a, b):
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
+
+
+def accuracy(extractor):
+    passed = []
+    for name, source, expected in ACCURACY_CASES:
+        try:
+            result = extractor(source)
+        except Exception:
+            result = None
+        passed.append((name, result is not None and _same(result, expected)))
+    return passed
+
+
+def synthetic_minified(rows, json_keys=False):
+    """A large single-line bundle with a big inline dataset and lots of unrelated code."""
+    q = '"' if json_keys else ''
+    records = ','.join(f'{{{q}id{q}:{i},{q}label{q}:"item {i}: {i % 7}",{q}value{q}:{i * 0.5}}}' for i in range(rows))
+    filler = ';'.join(f'function f{i}(a,b){{return a/b>{i}?[a,b]:{{k:"v:{i}"}}}}' for i in range(rows // 10))
+    return f'{filler};const data=[{records}];{filler};const dataUrl="https://example.org/big.csv";'
+
+
+def throughput(extractor, sources, repeat):
+    total_bytes = sum(len(content) for content in sources) * repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for content in sources:
+            extractor(content)
+    elapsed = time.perf_counter() - start
+    return total_bytes / elapsed / 1024 ** 2, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the tokenizer extractor with the legacy regexes')
+    parser.add_argument('--dir', '-d', default=str(VISUALIZATIONS_DIR), help='Directory of JS examples to scan recursively')
+    parser.add_argument('--repeat', type=int, default=20, help='Passes over the example files (default: 20)')
+    parser.add_argument('--minified-rows', type=int, default=20000, help='Rows in the synthetic minified bundle (default: 20000)')
+    args = parser.parse_args()
+
+    tokenizer = lambda content: find_data_sources(content)
+
+    print("Extraction accuracy on fixtures")
+    print("=" * 50)
+    legacy_acc = dict(accuracy(legacy_extract))
+    new_acc = dict(accuracy(tokenizer))
+    for name, _, _ in ACCURACY_CASES:
+        print(f"{name:<28} legacy: {'ok' if legacy_acc[name] else 'WRONG':<6} tokenizer: {'ok' if new_acc[name] else 'WRONG'}")
+    print(f"{'Total':<28} legacy: {sum(legacy_acc.values())}/{len(ACCURACY_CASES):<4} "
+          f"tokenizer: {sum(new_acc.values())}/{len(ACCURACY_CASES)}")
+
+    files = sorted(Path(args.dir).rglob('*.js'))
+    sources = [path.read_text() for path in files]
+    print(f"\nGallery examples ({len(files)} files from {args.dir})")
+    print("=" * 50)
+    for path, content in zip(files, sources):
+        legacy_keys = sorted(legacy_extract(content))
+        new_keys = sorted(tokenizer(content))
+        print(f"{path.name:<32} legacy: {', '.join(legacy_keys) or '-':<20} tokenizer: {', '.join(new_keys) or '-'}")
+    if sources:
+        for label, extractor in (('legacy', legacy_extract), ('tokenizer', tokenizer)):
+            rate, elapsed = throughput(extractor, sources, args.repeat)
+            print(f"{label:<10} {rate:8.2f} MB/s ({elapsed:.3f}s for {args.repeat} passes)")
+
+    for json_keys in (False, True):
+        bundle = synthetic_minified(args.minified_rows, json_keys=json_keys)
+        kind = 'JSON' if json_keys else 'JS object'
+        print(f"\nSynthetic minified bundle with {kind} literal ({len(bundle) / 1024 ** 2:.2f} MB)")
+        print("=" * 50)
+        for label, extractor in (('legacy', legacy_extract), ('tokenizer', tokenizer)):
+            rate, elapsed = throughput(extractor, [bundle], 1)
+            found = extractor(bundle)
+            rows = len(found.get('data1', [])) if isinstance(found.get('data1'), list) else 0
+            print(f"{label:<10} {rate:8.2f} MB/s ({elapsed:.3f}s), rows extracted: {rows:,}/{args.minified_rows:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.d3_features import FeatureIndex, build_index, format_summary
+
+# One characteristic snippet per chart type, mixed into shared boilerplate.
+CHARTS = {
+    'bar': "const x = d3.scaleBand().domain(data.map(d => d.{field})).range([0, width]).padding(0.1);\n"
+           "svg.selectAll('rect').data(data).join('rect').attr('x', d => x(d.{field}));",
+    'line': "const line = d3.line().x(d => x(d.date)).y(d => y(d.{field})).curve(d3.curveMonotoneX);\n"
+            "svg.append('path').datum(data).attr('d', line);",
+    'area': "const area = d3.area().y0(y(0)).y1(d => y(d.{field}));\nsvg.append('path').attr('d', area(data));",
+    'scatter': "svg.selectAll('circle').data(data).join('circle').attr('cx', d => x(d.{field})).attr('r', 3);",
+    'pie': "const arcs = d3.pie().value(d => d.{field})(data);\nconst arc = d3.arc().innerRadius(0).outerRadius(r);",
+    'network': "const sim = d3.forceSimulation(nodes).force('link', d3.forceLink(links))"
+               ".force('charge', d3.forceManyBody());",
+    'hierarchy': "const root = d3.hierarchy(data).sum(d => d.{field});\nd3.treemap().size([width, height])(root);",
+    'map': "const projection = d3.geoMercator().fitSize([width, height], land);\n"
+           "svg.append('path').attr('d', d3.geoPath(projection)(topojson.feature(world, world.objects.land)));",
+    'contour': "const contours = d3.contours().size([n, m])(values);\n"
+               "svg.selectAll('path').data(contours).join('path').attr('d', d3.geoPath());",
+}
+BOILERPLATE = [
+    "const y = d3.scaleLinear().domain([0, d3.max(data, d => d.{field})]).nice().range([height, 0]);",
+    "svg.append('g').attr('transform', `translate(0,${{height}})`).call(d3.axisBottom(x));",
+    "svg.append('g').call(d3.axisLeft(y).ticks({num}));",
+    "const color = d3.scaleOrdinal(d3.schemeTableau10);",
+    "svg.selectAll('text').data(data).join('text').text(d => d.{field});",
+    "node.transition().duration({num}).attr('opacity', 1);",
+    "function helper{num}(a, b) {{ return a.{field} > b.{field} ? a : b; }}",
+]
+
+
+def synthetic_gallery(root, files, seed=0, lines=120):
+    """Write ``files`` visualizations (one JS file each) with skewed chart-type frequencies."""
+    rng = random.Random(seed)
+    kinds = list(CHARTS)
+    weights = [2 ** (len(kinds) - position) for position in range(len(kinds))]
+    for number in range(files):
+        kind = rng.choices(kinds, weights)[0]
+        body = [rng.choice(BOILERPLATE) for _ in range(lines)]
+        body.insert(rng.randrange(len(body)), CHARTS[kind])
+        field = f"f{rng.randrange(50)}"
+        code = '\n'.join(line.format(field=field, num=rng.randint(1, 999)) for line in body)
+        directory = Path(root) / f"viz_{number:05d}"
+        directory.mkdir()
+        (directory / 'chart.js').write_text(f"d3.csv('data_{number}.csv').then(data => {{\n{code}\n}});\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the D3 feature scan and stratified sampling on a synthetic gallery')
+    parser.add_argument('--files', type=int, default=10000, help='Synthetic visualizations (default: 10000)')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}),
+                        help='Worker counts to time (default: 1 and one per CPU)')
+    parser.add_argument('--sample', type=int, default=500, help='Stratified sample size (default: 500)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        synthetic_gallery(tmp, args.files)
+        total_mb = sum(path.stat().st_size for path in Path(tmp).rglob('*.js')) / 1024 ** 2
+        print(f"Wrote {args.files:,} files ({total_mb:.1f} MB) in {time.perf_counter() - start:.1f}s")
+
+        index = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            index, scanned = build_index(tmp, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"Full scan, {workers:>2} workers: {elapsed:6.2f}s ({scanned / elapsed:,.0f} files/s, "
+                  f"{total_mb / elapsed:.1f} MB/s)")
+
+        start = time.perf_counter()
+        _, scanned = build_index(tmp, index, workers=args.workers[-1])
+        print(f"Unchanged rescan:     {time.perf_counter() - start:6.2f}s ({scanned} files scanned)")
+
+        path = Path(tmp) / 'index.npz'
+        start = time.perf_counter()
+        index.save(path)
+        saved = time.perf_counter() - start
+        start = time.perf_counter()
+        index = FeatureIndex.load(path)
+        print(f"Save / load:          {saved:6.2f}s / {time.perf_counter() - start:.2f}s "
+              f"({path.stat().st_size / 1024:.0f} KB)")
+
+        start = time.perf_counter()
+        rows = index.sample(args.sample)
+        elapsed = time.perf_counter() - start
+        print(f"Sample of {args.sample}:        {elapsed * 1000:6.1f}ms\n")
+        print(format_summary(index))
+        print(f"\nSampled {len(rows)} files, by chart type:")
+        for label, total in sorted(index.take(rows).counts().items()):
+            print(f"{label:<20} {total:>8,}")
+
+
+if __name__ == "__main__":
+    main()
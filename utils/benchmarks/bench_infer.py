@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.openai_infer import D3DataInferer
+from utils.benchmarks.mock_servers import CompletionsServer
+
+SYNTHETIC_JS = """export default function createVisualization(container) {{
+  const svg = d3.select(container).append('svg').attr('width', 640).attr('height', 400);
+  // chart {i}
+  svg.selectAll('rect').data(data).join('rect')
+    .attr('x', (d, i) => i * 20).attr('height', d => d.value).attr('fill', 'steelblue');
+}}
+"""
+
+
+def write_gallery(root, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(root, f"chart_{i}.js")
+        with open(path, 'w') as f:
+            f.write(SYNTHETIC_JS.format(i=i))
+        paths.append(path)
+    return paths
+
+
+async def first_results(inferer, paths, concurrency):
+    """Seconds until the first result arrives and until all have arrived."""
+    start = time.perf_counter()
+    first = None
+    errors = 0
+    async for _, _, error in inferer.infer_many(paths, concurrency=concurrency):
+        first = first or time.perf_counter() - start
+        errors += error is not None
+    return first, time.perf_counter() - start, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sequential and concurrent inference against a mock completions server')
+    parser.add_argument('--files', type=int, default=64, help='Number of synthetic visualizations (default: 64)')
+    parser.add_argument('--latency', type=float, default=0.25, help='Mock server latency per request in seconds (default: 0.25)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 16, 64], help='Concurrency levels to measure')
+    parser.add_argument('--sequential', type=int, default=16, help='Files timed for the sequential baseline (default: 16)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='infer_bench_') as tmp, \
+            CompletionsServer(latency=args.latency) as server:
+        paths = write_gallery(tmp, args.files)
+        inferer = D3DataInferer(api_key='mock-key', base_url=server.api_base)
+
+        print(f"{args.files} files, {args.latency * 1000:.0f} ms mock latency")
+        print("=" * 70)
+        sample = paths[:args.sequential]
+        start = time.perf_counter()
+        for path in sample:
+            inferer.infer_data_structure(path)
+        sequential = (time.perf_counter() - start) / len(sample) * len(paths)
+        print(f"{'sequential':<16} {sequential:>8.2f}s (extrapolated from {len(sample)} files)")
+
+        for concurrency in args.concurrency:
+            server.max_in_flight = 0
+            first, elapsed, errors = asyncio.run(first_results(inferer, paths, concurrency))
+            print(f"{'concurrency ' + str(concurrency):<16} {elapsed:>8.2f}s  speedup {sequential / elapsed:5.1f}x  "
+                  f"first result {first:.2f}s  peak in flight {server.max_in_flight}  errors {errors}")
+
+
+if __name__ == "__main__":
+    main()
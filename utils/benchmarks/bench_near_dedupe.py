@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.near_dedupe import find_near_duplicates, format_report
+from utils.jsonl_io import write_records
+
+STATEMENTS = [
+    "const x = d3.scaleBand().domain(data.map(d => d.{field})).range([0, width]).padding({num});",
+    "const y = d3.scaleLinear().domain([0, d3.max(data, d => d.{field})]).nice().range([height, 0]);",
+    "svg.append('g').attr('transform', `translate(0,${{height}})`).call(d3.axisBottom(x).ticks({num}));",
+    "svg.append('g').call(d3.axisLeft(y).tickFormat(d3.format('{fmt}')));",
+    "const color = d3.scaleOrdinal().domain(keys).range(['{color}', '#69b3a2', '#404080']);",
+    "svg.selectAll('circle').data(data).join('circle').attr('cx', d => x(d.{field})).attr('r', {num});",
+    "const line = d3.line().x(d => x(d.date)).y(d => y(d.{field})).curve(d3.curve{curve});",
+    "svg.append('path').datum(data).attr('fill', 'none').attr('stroke', '{color}').attr('d', line);",
+    "const pie = d3.pie().value(d => d.{field}).sort(null); const arc = d3.arc().innerRadius({num});",
+    "const sim = d3.forceSimulation(nodes).force('charge', d3.forceManyBody().strength(-{num}));",
+    "const zoom = d3.zoom().scaleExtent([1, {num}]).on('zoom', event => g.attr('transform', event.transform));",
+    "const tooltip = d3.select('body').append('div').style('opacity', 0).attr('class', '{field}-tip');",
+    "d3.{loader}('https://example.com/{field}_{num}.{loader}').then(rows => render(rows));",
+    "const stack = d3.stack().keys(keys)(data); const area = d3.area().y0(d => y(d[0])).y1(d => y(d[1]));",
+    "svg.selectAll('text').data(data).join('text').text(d => d.{field}).attr('font-size', {num});",
+]
+PHRASINGS = [
+    "{verb} {subject} so I can compare them at a glance",
+    "I need a chart of {subject}; highlight the largest values",
+    "How do {subject} change? Make it interactive",
+    "Build a visualization for {subject} with a legend and tooltips",
+    "Can you draw {subject} and label each item clearly",
+    "Give me an overview of {subject} for a report",
+    "Create something that shows the trend in {subject}",
+]
+VERBS = ['Show', 'Plot', 'Visualize', 'Display', 'Chart']
+SUBJECTS = ['sales by region', 'temperature over time', 'population by country', 'scores per team',
+            'prices across stores', 'traffic by hour', 'votes per party', 'rainfall by month']
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'po', 'qu', 'da']
+
+
+def word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def base_chart(rng, size):
+    """Statements plus the field names a chart uses; field names stay fixed across its forks."""
+    return [(rng.choice(STATEMENTS), word(rng)) for _ in range(size)]
+
+
+def render(body, rng):
+    """Re-roll every literal, as forks that restyle a chart do."""
+    lines = [statement.format(field=field, num=rng.randint(1, 500), fmt=rng.choice(['.2f', '~s', '%']),
+                              color=f"#{rng.randrange(0xFFFFFF):06x}", curve=rng.choice(['Basis', 'Linear', 'Step']),
+                              loader=rng.choice(['csv', 'json']))
+             for statement, field in body]
+    return "export default function createVisualization(container) {\n  " + "\n  ".join(lines) + "\n}\n"
+
+
+def synthetic_examples(families, forks, queries, seed=0):
+    """Fork families: each fork re-rolls every literal and sometimes adds a statement.
+
+    About a fifth of the queries are repeated with trivial punctuation changes.
+    Returns the examples and each one's family.
+    """
+    rng = random.Random(seed)
+    examples, truth = [], []
+    for family in range(families):
+        body = base_chart(rng, rng.randint(30, 60))
+        subject = f"{rng.choice(SUBJECTS)} in {word(rng).title()}"
+        for _ in range(rng.randint(1, forks)):
+            variant = list(body)
+            if rng.random() < 0.5:
+                variant.insert(rng.randrange(len(variant)), (rng.choice(STATEMENTS), word(rng)))
+            code = render(variant, rng)
+            for phrasing in rng.sample(PHRASINGS, min(queries, len(PHRASINGS))):
+                query = phrasing.format(verb=rng.choice(VERBS), subject=subject)
+                examples.append({'input': query, 'instruct': '', 'output': code})
+                truth.append(family)
+                if rng.random() < 0.2:
+                    examples.append({'input': query.upper() + '!', 'instruct': '', 'output': code})
+                    truth.append(family)
+    return examples, truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time near-duplicate clustering on a synthetic gallery of forked charts')
+    parser.add_argument('--families', type=int, default=2000, help='Distinct charts (default: 2000)')
+    parser.add_argument('--forks', type=int, default=4, help='Maximum forks per chart (default: 4)')
+    parser.add_argument('--queries', type=int, default=5, help='Queries per fork (default: 5)')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1, help='Signature processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    examples, truth = synthetic_examples(args.families, args.forks, args.queries)
+    with tempfile.TemporaryDirectory(prefix='near_dedupe_bench_') as tmp:
+        path = os.path.join(tmp, 'examples.jsonl')
+        write_records(path, examples)
+        print(f"{len(examples)} examples from {args.families} chart families, "
+              f"{os.path.getsize(path) / 1024 ** 2:.0f} MB, {args.workers} workers")
+        start = time.perf_counter()
+        report = find_near_duplicates(path, workers=args.workers)
+        elapsed = time.perf_counter() - start
+
+    print(format_report(report))
+    # Every surviving source should belong to a different family.
+    kept_families = [truth[index] for index in report['kept']]
+    families_kept = len(set(kept_families))
+    print("=" * 78)
+    print(f"{elapsed:.1f}s total ({len(examples) / elapsed:,.0f} examples/s), "
+          f"{report['comparisons']:,} code comparisons for {report['sources']:,} sources")
+    print(f"families surviving: {families_kept}/{args.families}; "
+          f"kept examples: {len(report['kept'])} (ideal {args.families * args.queries})")
+
+
+if __name__ == "__main__":
+    main()
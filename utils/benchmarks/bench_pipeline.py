@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from pathlib import Path
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.benchmarks.bench_stream_profile import generate_csv
+from utils.benchmarks.mock_servers import CompletionsServer, DataServer
+
+STAGES = ('extract', 'analyze', 'queries', 'training', 'refine')
+# Per-item latency comes from these spans: the stage's own unit of work, or
+# for the concurrent LLM stages each API call.
+LATENCY_SPANS = {'extract': 'extract', 'analyze': 'analyze', 'queries': 'API call',
+                 'training': 'example', 'refine': 'API call'}
+UNITS = {'extract': 'files', 'analyze': 'dirs', 'queries': 'dirs', 'training': 'examples', 'refine': 'examples'}
+# Baseline metrics where bigger is better; the rest are costs.
+HIGHER_IS_BETTER = {'throughput'}
+
+
+def synthetic_js(index, js_bytes, inline_rows, data_url=None, rng=None):
+    """A visualization module of roughly ``js_bytes`` with either a dataUrl or an inline data literal."""
+    rng = rng or random.Random(index)
+    if data_url is not None:
+        data = f'const dataUrl = "{data_url}";\n'
+        load = "  d3.csv(dataUrl).then(rows => draw(svg, rows));\n"
+    else:
+        rows = ',\n'.join(f"  {{name: 'item {i}', group: '{chr(97 + i % 6)}', value: {rng.uniform(0, 500):.2f}}}"
+                          for i in range(inline_rows))
+        data = f"const data = [\n{rows}\n];\n"
+        load = "  draw(svg, data);\n"
+    body = (f"// chart {index}\n{data}"
+            "export default function createVisualization(container) {\n"
+            "  const svg = d3.select(container).append('svg').attr('width', 640).attr('height', 400);\n"
+            f"{load}}}\n")
+    helpers = []
+    size = len(body)
+    while size < js_bytes:
+        n = len(helpers)
+        helper = (f"function helper{n}(svg, rows) {{\n"
+                  f"  const x = d3.scaleBand().domain(rows.map(d => d.name)).range([0, {600 + n % 40}]);\n"
+                  f"  svg.selectAll('.h{n}').data(rows).join('rect').attr('class', 'h{n}')"
+                  f".attr('x', d => x(d.name)).attr('height', d => d.value / {n % 7 + 1});\n}}\n")
+        helpers.append(helper)
+        size += len(helper)
+    return body + ''.join(helpers)
+
+
+def write_gallery(root, count, js_kb, inline_rows, url_share, data_server, data_file, seed=0):
+    """Write ``count`` visualization directories; ``url_share`` of them load their data from ``data_server``."""
+    rng = random.Random(seed)
+    viz_dirs = []
+    for i in range(count):
+        viz_dir = Path(root) / f"viz_{i:05d}"
+        viz_dir.mkdir(parents=True)
+        data_url = None
+        if rng.random() < url_share:
+            data_url = data_server.add_file(f"data/{i}.csv", data_file)
+        (viz_dir / 'chart.js').write_text(synthetic_js(i, js_kb * 1024, inline_rows, data_url, rng))
+        viz_dirs.append(viz_dir)
+    return viz_dirs
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of ``values`` (0 < q <= 100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+# Each stage's setup (imports, clients) returns the work to time, which returns the items processed.
+
+def _extract_stage(gallery, options):
+    from utils.analyze_d3_data import extract_data
+    from utils.instrumentation import span
+    files = sorted(Path(gallery).glob('*/*.js'))
+
+    def run():
+        for js_file in files:
+            with span('extract'):
+                extract_data(js_file)
+        return len(files)
+    return run
+
+
+def _analyze_stage(gallery, options):
+    from utils.analyze_d3_data import process_visualization
+    from utils.http_client import StreamingDownloader
+    from utils.instrumentation import span
+    downloader = StreamingDownloader()
+    viz_dirs = sorted(path for path in Path(gallery).iterdir() if path.is_dir())
+
+    def run():
+        with redirect_stdout(io.StringIO()):
+            for viz_dir in viz_dirs:
+                with span('analyze'):
+                    process_visualization(viz_dir, downloader=downloader)
+        return len(viz_dirs)
+    return run
+
+
+def _queries_stage(gallery, options):
+    from utils.generate_training_queries import TrainingDataGenerator
+    generator = TrainingDataGenerator(api_key='mock-key', base_url=options['api_base'])
+    viz_dirs = sorted(path for path in Path(gallery).iterdir() if path.is_dir())
+
+    async def generate():
+        statuses = []
+        async for _, status, _ in generator.generate_all(viz_dirs, concurrency=options['concurrency'], force=True):
+            statuses.append(status)
+        return statuses
+
+    def run():
+        statuses = asyncio.run(generate())
+        if statuses.count('generated') != len(viz_dirs):
+            raise RuntimeError(f"queries generated for {statuses.count('generated')} of {len(viz_dirs)} directories")
+        return len(viz_dirs)
+    return run
+
+
+def _training_stage(gallery, options):
+    from utils.generate_training_data import iter_training_examples
+    from utils.instrumentation import span
+    from utils.jsonl_io import RecordWriter
+
+    def run():
+        examples = iter_training_examples(gallery)
+        with RecordWriter(options['training_file']) as writer:
+            while True:
+                with span('example'):
+                    example = next(examples, None)
+                    if example is not None:
+                        writer.write(example)
+                if example is None:
+                    return writer.count
+    return run
+
+
+def _refine_stage(gallery, options):
+    from utils.refine_training_data import BatchProcessor
+    from utils.jsonl_io import count_records
+    processor = BatchProcessor(api_key='mock-key', base_url=options['api_base'])
+    output = os.path.join(options['workdir'], 'refined.jsonl')
+
+    def run():
+        processor.process_in_batches(options['training_file'], output, concurrency=options['concurrency'])
+        return count_records(options['training_file'])
+    return run
+
+
+STAGE_SETUP = {'extract': _extract_stage, 'analyze': _analyze_stage, 'queries': _queries_stage,
+               'training': _training_stage, 'refine': _refine_stage}
+
+
+def run_stage(stage, gallery, options):
+    """Run one stage in this (fresh) process; returns its measurements."""
+    os.environ['TQDM_DISABLE'] = '1'
+    logging.disable(logging.ERROR)
+    from utils.instrumentation import get_instrumentation
+    instrumentation = get_instrumentation()
+    work = STAGE_SETUP[stage](gallery, options)
+    start = time.perf_counter()
+    items = work()
+    elapsed = time.perf_counter() - start
+    latencies = [event['dur'] / 1e3 for event in instrumentation.events
+                 if event['ph'] == 'X' and event['name'] == LATENCY_SPANS[stage]]
+    return {
+        'items': items,
+        'elapsed': elapsed,
+        'throughput': items / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print each metric against the baseline; returns the regressions beyond ``tolerance``."""
+    regressions = []
+    print(f"\nAgainst baseline (tolerance {tolerance:.0%}):")
+    for stage, metrics in results.items():
+        before = baseline.get('stages', {}).get(stage)
+        if before is None:
+            print(f"{stage:<10} not in baseline")
+            continue
+        parts = []
+        for metric in ('throughput', 'p50_ms', 'p99_ms', 'peak_rss_mb'):
+            new, old = metrics.get(metric), before.get(metric)
+            if not new or not old:
+                continue
+            change = new / old - 1
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ''
+            if worse > tolerance:
+                flag = ' REGRESSION'
+                regressions.append((stage, metric, old, new))
+            parts.append(f"{metric} {change:+.0%}{flag}")
+        print(f"{stage:<10} " + ', '.join(parts))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark each data-preparation stage on a synthetic gallery '
+                                                 'against local mock data and completions servers')
+    parser.add_argument('--dirs', type=int, default=200, help='Synthetic visualization directories (default: 200)')
+    parser.add_argument('--js-kb', type=float, default=8, help='Approximate size of each JS file in KB (default: 8)')
+    parser.add_argument('--inline-rows', type=int, default=50, help='Rows in each inline data literal (default: 50)')
+    parser.add_argument('--url-share', type=float, default=0.3,
+                        help='Fraction of visualizations loading a dataUrl instead of inline data (default: 0.3)')
+    parser.add_argument('--data-kb', type=float, default=256, help='Size of each served CSV in KB (default: 256)')
+    parser.add_argument('--data-latency', type=float, default=0.0, help='Mock data server latency in seconds')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Mock completions latency in seconds (default: 0.05)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrency of the LLM stages (default: 16)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                        help='Stages to run, in pipeline order (default: all); later stages need earlier outputs')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic gallery (default: 0)')
+    parser.add_argument('--save-baseline', metavar='JSON', help='Write the results to JSON as a baseline')
+    parser.add_argument('--baseline', metavar='JSON', help='Compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative change counted as a regression (default: 0.2)')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='Exit with status 1 when any metric regresses beyond the tolerance')
+    args = parser.parse_args()
+
+    config = {name: getattr(args, name) for name in ('dirs', 'js_kb', 'inline_rows', 'url_share', 'data_kb',
+                                                     'data_latency', 'latency', 'concurrency', 'seed')}
+    stages = [stage for stage in STAGES if stage in args.stages]
+    results = {}
+    spawn = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory(prefix='pipeline_bench_') as tmp, \
+            DataServer(latency=args.data_latency) as data_server, \
+            CompletionsServer(latency=args.latency) as completions:
+        data_file = os.path.join(tmp, 'data.csv')
+        generate_csv(data_file, int(args.data_kb * 1024))
+        gallery = os.path.join(tmp, 'gallery')
+        write_gallery(gallery, args.dirs, args.js_kb, args.inline_rows, args.url_share, data_server, data_file,
+                      seed=args.seed)
+        options = {'api_base': completions.api_base, 'concurrency': args.concurrency, 'workdir': tmp,
+                   'training_file': os.path.join(tmp, 'training.jsonl')}
+
+        print(f"{args.dirs} directories, ~{args.js_kb:g} KB JS, {args.inline_rows} inline rows, "
+              f"{args.url_share:.0%} dataUrl ({args.data_kb:g} KB CSV), {args.latency * 1000:.0f} ms completions latency")
+        print("=" * 78)
+        print(f"{'stage':<10} {'items':>8} {'elapsed':>9} {'throughput':>16} {'p50':>9} {'p99':>9} {'peak RSS':>10}")
+        for stage in stages:
+            # A fresh interpreter per stage so peak RSS is the stage's own.
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                result = pool.submit(run_stage, stage, gallery, options).result()
+            results[stage] = result
+            print(f"{stage:<10} {result['items']:>8} {result['elapsed']:>8.2f}s "
+                  f"{result['throughput']:>8.1f} {UNITS[stage] + '/s':<10}"
+                  f"{result['p50_ms'] or 0:>6.1f}ms {result['p99_ms'] or 0:>6.1f}ms {result['peak_rss_mb']:>7.1f} MB")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'config': config, 'stages': results}, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config:
+            changed = sorted(name for name in config if baseline.get('config', {}).get(name) != config[name])
+            print(f"\nWarning: baseline was recorded with different settings ({', '.join(changed)})")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
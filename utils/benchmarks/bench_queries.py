@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.generate_training_queries import TrainingDataGenerator
+from utils.instrumentation import Instrumentation
+from utils.benchmarks.bench_infer import SYNTHETIC_JS
+from utils.benchmarks.mock_servers import CompletionsServer
+
+
+def write_gallery(root, count):
+    viz_dirs = []
+    for i in range(count):
+        viz_dir = Path(root) / f"viz_{i:04d}"
+        viz_dir.mkdir()
+        (viz_dir / 'chart.js').write_text(SYNTHETIC_JS.format(i=i))
+        (viz_dir / 'data_report.txt').write_text(f"Columns: name (string), value (number); {i * 7} rows\n")
+        (viz_dir / 'explanation.txt').write_text("A bar chart comparing values across categories.\n")
+        viz_dirs.append(viz_dir)
+    return viz_dirs
+
+
+async def run_pipeline(generator, viz_dirs, concurrency, force=True):
+    timer = Instrumentation()
+    statuses = {}
+    first = None
+    async for _, status, _ in generator.generate_all(viz_dirs, concurrency=concurrency, force=force, timer=timer):
+        first = first or time.perf_counter() - timer.started
+        statuses[status] = statuses.get(status, 0) + 1
+    return time.perf_counter() - timer.started, first, statuses, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare serial and async query generation against a mock completions server')
+    parser.add_argument('--dirs', type=int, default=64, help='Synthetic visualization directories (default: 64)')
+    parser.add_argument('--latency', type=float, default=0.25, help='Mock latency per request in seconds (default: 0.25)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32], help='Concurrency levels to measure')
+    parser.add_argument('--sequential', type=int, default=16, help='Directories timed for the serial baseline (default: 16)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='queries_bench_') as tmp, \
+            CompletionsServer(latency=args.latency) as server:
+        viz_dirs = write_gallery(tmp, args.dirs)
+        generator = TrainingDataGenerator(api_key='mock-key', base_url=server.api_base)
+
+        print(f"{args.dirs} directories, {args.latency * 1000:.0f} ms mock latency")
+        print("=" * 70)
+        sample = viz_dirs[:args.sequential]
+        start = time.perf_counter()
+        for viz_dir in sample:
+            result = generator.generate_queries(generator.get_visualization_context(viz_dir))
+            generator.save_queries(result, viz_dir)
+        serial = (time.perf_counter() - start) / len(sample) * len(viz_dirs)
+        print(f"{'serial':<16} {serial:>8.2f}s (extrapolated from {len(sample)} directories)")
+
+        timer = None
+        for concurrency in args.concurrency:
+            elapsed, first, statuses, timer = asyncio.run(run_pipeline(generator, viz_dirs, concurrency))
+            print(f"{'concurrency ' + str(concurrency):<16} {elapsed:>8.2f}s  speedup {serial / elapsed:5.1f}x  "
+                  f"first result {first:.2f}s  {statuses}")
+
+        elapsed, _, statuses, _ = asyncio.run(run_pipeline(generator, viz_dirs, args.concurrency[-1], force=False))
+        print(f"{'re-run':<16} {elapsed:>8.2f}s  {statuses}")
+        print()
+        print(f"Stages at concurrency {args.concurrency[-1]}:")
+        print(timer.format_report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+import aiohttp
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.refine_training_data import BatchProcessor
+from utils.rate_limit import AsyncRateLimiter
+from utils.benchmarks.mock_servers import CompletionsServer
+
+
+def synthetic_examples(count):
+    return [{'input': f"Create a bar chart of dataset {i}",
+             'output': "```javascript\nexport default function createVisualization() {}\n```"} for i in range(count)]
+
+
+async def lockstep(processor, examples, batch_size=5):
+    """The scheduler process_all replaced: fixed batches, gather, then a one second pause."""
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=batch_size)) as session:
+        results = []
+        for i in range(0, len(examples), batch_size):
+            results += await asyncio.gather(*(processor.process_example(session, example)
+                                              for example in examples[i:i + batch_size]))
+            if i + batch_size < len(examples):
+                await asyncio.sleep(1)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare lock-step batches with the sliding-window refinement scheduler')
+    parser.add_argument('--examples', type=int, default=200, help='Synthetic examples to refine (default: 200)')
+    parser.add_argument('--median-latency', type=float, default=0.3, help='Median mock latency in seconds (default: 0.3)')
+    parser.add_argument('--tail', type=float, default=1.0, help='Lognormal sigma of the latency; higher is a longer tail (default: 1.0)')
+    parser.add_argument('--requests-per-minute', type=int, default=1200, help='Rate limit the mock server enforces (default: 1200)')
+    parser.add_argument('--concurrency', type=int, default=32, help='Sliding window size (default: 32)')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='Fraction of mock responses that are HTTP 500 (default: 0.02)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    latency = lambda: min(30.0, args.median_latency * rng.lognormvariate(0, args.tail))
+    examples = synthetic_examples(args.examples)
+    # The server's bucket starts full, so only requests beyond one minute's burst are paced.
+    rate_bound = max(0, args.examples - args.requests_per_minute) / (args.requests_per_minute / 60)
+
+    print(f"{args.examples} examples, median latency {args.median_latency}s (sigma {args.tail}), "
+          f"{args.requests_per_minute} RPM limit => rate-limit floor {rate_bound:.1f}s")
+    print("=" * 78)
+    for label in ('lock-step', 'sliding window'):
+        with CompletionsServer(latency=latency, requests_per_minute=args.requests_per_minute,
+                               error_rate=args.error_rate) as server, \
+                tempfile.TemporaryDirectory(prefix='refine_bench_') as tmp:
+            processor = BatchProcessor(api_key='mock-key', base_url=server.api_base)
+            start = time.perf_counter()
+            if label == 'lock-step':
+                results = asyncio.run(lockstep(processor, examples))
+                failures = sum('error' in result for result in results)
+            else:
+                output = os.path.join(tmp, 'refined.json')
+                processor.limiter = AsyncRateLimiter()
+                asyncio.run(processor.process_all(examples, output, args.concurrency))
+                with open(output) as f:
+                    failures = args.examples - len(json.load(f))
+            elapsed = time.perf_counter() - start
+            print(f"{label:<16} {elapsed:>8.1f}s  {args.examples / elapsed:>6.1f} ex/s  failures {failures}  "
+                  f"peak in flight {server.max_in_flight}  statuses {dict(sorted(server.status_counts.items()))}")
+
+
+if __name__ == "__main__":
+    main()
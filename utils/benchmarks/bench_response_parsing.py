@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import zlib
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+from collections import Counter
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.llm_response import REFINE_SCHEMA, format_stats, parse_json
+from utils.refine_training_data import BatchProcessor
+from utils.jsonl_io import iter_records, write_records
+from utils.benchmarks.bench_dedupe import CHART_JS
+from utils.benchmarks.mock_servers import CompletionsServer, refine_responder
+
+# How the defective replies are distributed, by fraction of all replies.
+DEFECTS = (
+    ('raw newlines', 0.10),
+    ('trailing comma', 0.05),
+    ('prose around fence', 0.05),
+    ('truncated', 0.03),
+    ('not json', 0.02),
+)
+
+
+def defective(reply, defect):
+    """Corrupt a clean JSON reply the way models typically do."""
+    if defect == 'raw newlines':
+        # Code pasted into the string with literal newlines instead of \n escapes.
+        return reply.replace('\\n', '\n')
+    if defect == 'trailing comma':
+        return reply[:-1] + ',\n}'
+    if defect == 'prose around fence':
+        return f"Here is the refined example:\n```json\n{reply}\n```\nLet me know if you need changes."
+    if defect == 'truncated':
+        return reply[:len(reply) * 2 // 3]
+    if defect == 'not json':
+        return "I'm sorry, I can't help with that visualization."
+    return reply
+
+
+def pick_defect(seed, attempt=0):
+    """Deterministic defect for a prompt (a re-request draws again)."""
+    roll = zlib.crc32(f"{seed}:{attempt}".encode()) / 2 ** 32
+    for defect, share in DEFECTS:
+        if roll < share:
+            return defect
+        roll -= share
+    return None
+
+
+def legacy_parse(content):
+    """What refine_training_data.py did before llm_response: strip a json fence and json.loads."""
+    cleaned = content.strip()
+    if cleaned.startswith('```json'):
+        cleaned = cleaned[7:]
+    if cleaned.endswith('```'):
+        cleaned = cleaned[:-3]
+    parsed = json.loads(cleaned.strip())
+    if not isinstance(parsed, dict) or any(field not in parsed for field in ('input', 'output')):
+        raise ValueError("Response missing required fields")
+    return parsed
+
+
+def make_responder():
+    attempts = Counter()
+
+    def responder(request):
+        prompt = request['messages'][-1]['content']
+        attempts[prompt] += 1
+        return defective(refine_responder(request), pick_defect(prompt, attempts[prompt] - 1))
+    return responder
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how many defective model replies parsing repair salvages')
+    parser.add_argument('--examples', type=int, default=2000, help='Synthetic examples (default: 2000)')
+    args = parser.parse_args()
+    logging.getLogger('utils.refine_training_data').setLevel(logging.CRITICAL)
+
+    requests = [{'model': 'gpt-4o', 'messages': [{'role': 'user', 'content':
+                f"Original Request: Show chart {i}\n\nOriginal D3.js Implementation:\n{CHART_JS.format(i=i)}"
+                f"\n\nProvide your response"}]} for i in range(args.examples)]
+    replies = [defective(refine_responder(request), pick_defect(request['messages'][0]['content']))
+               for request in requests]
+
+    print(f"{args.examples} replies: " + ", ".join(
+        f"{defect} {share:.0%}" for defect, share in DEFECTS))
+    print("=" * 78)
+    for label, parse in (('legacy json.loads', legacy_parse),
+                         ('parse_json', lambda content: parse_json(content, REFINE_SCHEMA, allow_truncated=False))):
+        start = time.perf_counter()
+        failed = 0
+        for reply in replies:
+            try:
+                parse(reply)
+            except ValueError:
+                failed += 1
+        elapsed = time.perf_counter() - start
+        print(f"{label:<18} {failed:>5} unusable replies ({failed / len(replies):.1%})  "
+              f"{elapsed / len(replies) * 1e6:>6.1f} us/reply")
+
+    clean = [refine_responder(request) for request in requests[:500]]
+    start = time.perf_counter()
+    for reply in clean:
+        json.loads(reply)
+    baseline = time.perf_counter() - start
+    start = time.perf_counter()
+    for reply in clean:
+        parse_json(reply, REFINE_SCHEMA)
+    print(f"clean replies: json.loads {baseline / len(clean) * 1e6:.1f} us, "
+          f"parse_json {(time.perf_counter() - start) / len(clean) * 1e6:.1f} us")
+    print("=" * 78)
+
+    with tempfile.TemporaryDirectory(prefix='parse_bench_') as tmp:
+        training = os.path.join(tmp, 'training.jsonl')
+        write_records(training, ({'input': f"Show chart {i}", 'instruct': '', 'output': CHART_JS.format(i=i)}
+                                 for i in range(min(args.examples, 500))))
+        with CompletionsServer(responder=make_responder()) as server:
+            processor = BatchProcessor(api_key='mock-key', base_url=server.api_base)
+            output = os.path.join(tmp, 'refined.jsonl')
+            processor.process_in_batches(training, output, concurrency=16)
+            refined = sum(1 for _ in iter_records(output))
+        failed_file = os.path.join(tmp, 'failed_queries.json')
+        failed = sum(1 for _ in iter_records(failed_file)) if os.path.exists(failed_file) else 0
+        print(f"refine run: {len(server.request_log)} requests for {refined + failed} examples, "
+              f"{refined} refined, {failed} left for --retry-failed")
+        print(format_stats(processor.parse_stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import http.client
+from pathlib import Path
+from urllib.parse import quote
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.retrieval_index import Retriever, build_index, make_server, save_index
+
+KINDS = ['bar chart', 'line chart', 'scatter plot', 'choropleth map', 'treemap', 'force-directed network',
+         'sankey diagram', 'heatmap', 'histogram', 'pie chart', 'area chart', 'stacked bar chart', 'box plot',
+         'sunburst', 'chord diagram', 'bubble chart', 'streamgraph', 'calendar heatmap']
+TOPICS = ['population', 'unemployment rate', 'stock prices', 'temperature', 'rainfall', 'election results', 'GDP',
+          'life expectancy', 'CO2 emissions', 'flight delays', 'movie ratings', 'covid cases', 'housing prices',
+          'energy consumption', 'package dependencies', 'migration flows', 'sales revenue', 'website traffic',
+          'wildfire area', 'earthquake magnitudes', 'olympic medals', 'bike rentals', 'coffee exports', 'obesity']
+PLACES = ['France', 'Germany', 'Japan', 'Brazil', 'India', 'Canada', 'Kenya', 'Mexico', 'Norway', 'Chile', 'Peru',
+          'Spain', 'Italy', 'Egypt', 'Vietnam', 'Texas', 'California', 'Ohio', 'New York', 'London', 'Paris', 'Tokyo',
+          'Seattle', 'Chicago', 'Boston', 'Lagos', 'Sydney', 'Toronto', 'Berlin', 'Madrid', 'Iceland', 'Nepal']
+QUERIES = [
+    "Show me a {kind} of {topic} in {place}",
+    "How has {topic} in {place} changed since {year}?",
+    "Compare {topic} across regions of {place} with a {kind}",
+    "Which parts of {place} had the highest {topic} in {year}?",
+    "Visualize {topic} for {place} from {year} to {end}",
+    "Create an interactive {kind} with tooltips for {place} {topic}",
+]
+# Phrasings not used in the gallery, looked up in the benchmark.
+REQUESTS = [
+    "{kind} {topic} {place} {year}",
+    "I need to see {topic} trends for {place} around {year}",
+    "{place}: {topic} as a {kind}",
+]
+
+
+def synthetic_gallery(root, dirs, seed=0):
+    """Write ``dirs`` visualizations with queries.json and explanation.txt; returns one request per visualization."""
+    rng = random.Random(seed)
+    requests = []
+    for number in range(dirs):
+        spec = {'kind': rng.choice(KINDS), 'topic': rng.choice(TOPICS), 'place': rng.choice(PLACES),
+                'year': rng.randint(1950, 2020)}
+        spec['end'] = spec['year'] + rng.randint(1, 10)
+        viz_dir = Path(root) / f"viz_{number:05d}"
+        viz_dir.mkdir()
+        queries = [{'query': template.format(**spec)} for template in rng.sample(QUERIES, 5)]
+        (viz_dir / 'queries.json').write_text(json.dumps({'queries': queries}))
+        (viz_dir / 'explanation.txt').write_text(
+            f"A {spec['kind']} of {spec['topic']} in {spec['place']} between {spec['year']} and {spec['end']}.\n")
+        requests.append((viz_dir.name, rng.choice(REQUESTS).format(**spec)))
+    return requests
+
+
+def misspell(request, rng):
+    """``request`` with two adjacent letters of one of its longer words swapped."""
+    words = request.split()
+    candidates = [i for i, word in enumerate(words) if len(word) > 4 and word.isalpha()]
+    if candidates:
+        i = rng.choice(candidates)
+        j = rng.randrange(1, len(words[i]) - 2)
+        word = words[i]
+        words[i] = word[:j] + word[j + 1] + word[j] + word[j + 2:]
+    return ' '.join(words)
+
+
+def percentiles(seconds):
+    values = np.array(seconds) * 1e6
+    return f"p50 {np.percentile(values, 50):7.1f}us  p99 {np.percentile(values, 99):7.1f}us"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time retrieval index builds and lookups on a synthetic gallery')
+    parser.add_argument('--dirs', type=int, default=3000, help='Visualizations, 5 queries each (default: 3000)')
+    parser.add_argument('--requests', type=int, default=2000, help='Distinct requests to look up (default: 2000)')
+    parser.add_argument('--ngrams', action='store_true', help='Also index hashed trigram vectors')
+    parser.add_argument('--typos', action='store_true', help='Misspell a word of every request')
+    parser.add_argument('-k', type=int, default=10, help='Results per request (default: 10)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='retrieval_bench_') as tmp:
+        requests = synthetic_gallery(tmp, args.dirs)
+        start = time.perf_counter()
+        arrays, names = build_index(tmp, with_ngrams=args.ngrams)
+        path = Path(tmp) / 'index.idx'
+        save_index(path, arrays, names, tmp)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        retriever = Retriever(path, cache_size=0)
+        print(f"{len(names):,} visualizations, {args.dirs * 5:,} queries indexed"
+              f"{' with trigram vectors' if args.ngrams else ''}")
+        print(f"Build {built:.2f}s, index {path.stat().st_size / 1024:.0f} KB, "
+              f"load {(time.perf_counter() - start) * 1000:.1f} ms")
+        print("=" * 78)
+
+        rng = random.Random(1)
+        sample = rng.sample(requests, min(args.requests, len(requests)))
+        if args.typos:
+            sample = [(name, misspell(request, rng)) for name, request in sample]
+        timings = []
+        hits = first = 0
+        for name, request in sample:
+            start = time.perf_counter()
+            results = retriever.search(request, args.k)
+            timings.append(time.perf_counter() - start)
+            hits += any(result == name for result, _ in results)
+            first += bool(results) and results[0][0] == name
+        print(f"Uncached lookups:  {percentiles(timings)}  top-1 {first / len(sample):.1%}, "
+              f"recall@{args.k} {hits / len(sample):.1%}")
+
+        cached = Retriever(path)
+        for _, request in sample:
+            cached.search(request, args.k)
+        timings = []
+        for _, request in sample:
+            start = time.perf_counter()
+            cached.search(request, args.k)
+            timings.append(time.perf_counter() - start)
+        print(f"Cached lookups:    {percentiles(timings)}  ({cached.cache_info().hits:,} hits)")
+
+        server = make_server(cached, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+        timings = []
+        for _, request in sample:
+            start = time.perf_counter()
+            connection.request('GET', f"/search?q={quote(request)}&k={args.k}")
+            json.loads(connection.getresponse().read())
+            timings.append(time.perf_counter() - start)
+        connection.close()
+        server.shutdown()
+        server.server_close()
+        print(f"HTTP round trips:  {percentiles(timings)}  (keep-alive, cached)")
+
+
+if __name__ == "__main__":
+    main()
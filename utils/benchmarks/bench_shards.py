@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent.parent
+sys.path.append(str(ROOT))
+from utils.export_shards import DEFAULT_ENCODING, export_shards
+from utils.jsonl_io import iter_records, write_records
+from utils.benchmarks.bench_validate import corpus
+
+# Trainer start-up: what it takes before the first batch, and the memory held for the corpus.
+JSON_START = """
+import json, sys
+sys.path.append(%r)
+from utils.export_shards import Tokenizer
+tokenizer = Tokenizer(%r)
+with open(%r) as f:
+    examples = json.load(f)
+corpus = [(tokenizer.encode(e['input']), tokenizer.encode(e['output'])) for e in examples]
+print(open('/proc/self/status').read().split('RssAnon:')[1].split()[0])
+"""
+SHARD_START = """
+import random, sys
+sys.path.append(%r)
+from utils.export_shards import TokenShards
+shards = TokenShards(%r)
+rng = random.Random(0)
+for _ in range(1000):
+    tokens, prompt_length = shards[rng.randrange(len(shards))]
+    int(tokens.sum())
+print(open('/proc/self/status').read().split('RssAnon:')[1].split()[0])
+"""
+# Interpreter with the modules loaded. Memory is the process's own (RssAnon): mapped shard pages are
+# page cache the kernel can drop, and ru_maxrss would carry over the benchmark's own through fork.
+BASELINE = """
+import sys
+sys.path.append(%r)
+import utils.export_shards
+print(open('/proc/self/status').read().split('RssAnon:')[1].split()[0])
+"""
+
+
+def in_child(code):
+    """Run ``code`` in a fresh interpreter; returns (seconds, anonymous memory MB at the end)."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return elapsed, int(result.stdout.split()[-1]) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time exporting training data to token shards and opening them')
+    parser.add_argument('--examples', type=int, default=50000, help='Training examples (default: 50000)')
+    parser.add_argument('--encoding', default=DEFAULT_ENCODING, help=f'Token encoding (default: {DEFAULT_ENCODING})')
+    parser.add_argument('--shard-tokens', type=int, default=1 << 20, help='Target tokens per shard (default: 1M)')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}),
+                        help='Worker counts to time (default: 1 and one per CPU)')
+    parser.add_argument('--edits', type=int, default=5, help='Examples changed before the incremental re-export')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='shards_bench_') as tmp:
+        data = Path(tmp) / 'refined.json'
+        write_records(data, (record for record, _ in corpus(args.examples, 0)))
+        print(f"{args.examples:,} examples, pretty-printed JSON of {data.stat().st_size / 1024 ** 2:.1f} MB, "
+              f"{args.encoding} tokens")
+        print("=" * 78)
+        out = Path(tmp) / 'shards'
+        for workers in args.workers:
+            for path in out.glob('*'):
+                path.unlink()
+            start = time.perf_counter()
+            stats = export_shards(data, out, encoding=args.encoding, shard_tokens=args.shard_tokens, workers=workers)
+            print(f"Export, {workers:>2} workers:     {time.perf_counter() - start:6.2f}s  "
+                  f"{stats['shards written']} shards, {stats['train tokens'] + stats['validation tokens']:,} tokens")
+
+        start = time.perf_counter()
+        stats = export_shards(data, out, encoding=args.encoding, shard_tokens=args.shard_tokens,
+                              workers=args.workers[-1])
+        print(f"Unchanged re-export:    {time.perf_counter() - start:6.2f}s  "
+              f"{stats['shards written']} written, {stats['shards reused']} reused")
+
+        records = list(iter_records(data))
+        for index in random.Random(1).sample(range(len(records)), min(args.edits, len(records))):
+            records[index]['input'] += ' (revised)'
+        write_records(data, records)
+        start = time.perf_counter()
+        stats = export_shards(data, out, encoding=args.encoding, shard_tokens=args.shard_tokens,
+                              workers=args.workers[-1])
+        print(f"{args.edits} examples changed:   {time.perf_counter() - start:6.2f}s  "
+              f"{stats['shards written']} written, {stats['shards reused']} reused")
+
+        _, base_rss = in_child(BASELINE % str(ROOT))
+        json_time, json_rss = in_child(JSON_START % (str(ROOT), args.encoding, str(data)))
+        shard_time, shard_rss = in_child(SHARD_START % (str(ROOT), str(out)))
+        print(f"\nTrainer start (fresh process, memory above an idle one):")
+        print(f"  parse JSON + tokenize:  {json_time:6.2f}s  {json_rss - base_rss:7.1f} MB")
+        print(f"  open shards + 1000 reads: {shard_time:4.2f}s  {shard_rss - base_rss:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
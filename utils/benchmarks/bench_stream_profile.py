@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent.parent
+sys.path.append(str(ROOT))
+
+CSV_ROW = "{i},{cat},{value:.4f},2021-{month:02d}-{day:02d},label {label}\n"
+
+
+def generate_csv(path, size_bytes):
+    """Write a CSV of roughly ``size_bytes`` without holding it in memory."""
+    with open(path, 'w') as f:
+        f.write("id,category,value,date,label\n")
+        i = 0
+        written = 0
+        while written < size_bytes:
+            block = ''.join(CSV_ROW.format(i=j, cat=j % 50, value=(j * 7919 % 10007) / 3.0,
+                                           month=j % 12 + 1, day=j % 28 + 1, label=j % 5000)
+                            for j in range(i, i + 10000))
+            f.write(block)
+            written += len(block)
+            i += 10000
+
+
+def generate_geojson(path, size_bytes):
+    """Write a GeoJSON FeatureCollection of roughly ``size_bytes``."""
+    with open(path, 'w') as f:
+        f.write('{"type": "FeatureCollection", "name": "synthetic", "features": [\n')
+        i = 0
+        written = 0
+        while written < size_bytes:
+            features = []
+            for j in range(i, i + 5000):
+                features.append(json.dumps({
+                    'type': 'Feature',
+                    'geometry': {'type': 'Polygon', 'coordinates': [[[j % 360 - 180, j % 180 - 90],
+                                                                     [j % 360 - 179, j % 180 - 90],
+                                                                     [j % 360 - 179, j % 180 - 89],
+                                                                     [j % 360 - 180, j % 180 - 90]]]},
+                    'properties': {'id': j, 'region': f"r{j % 200}", 'population': j * 13 % 100000},
+                }))
+            block = (',\n' if i else '') + ',\n'.join(features)
+            f.write(block)
+            written += len(block)
+            i += 5000
+        f.write('\n]}\n')
+
+
+def profile_in_child(path, stream):
+    """Profile ``path`` in a fresh interpreter and return (seconds, peak RSS MB, report head)."""
+    code = (
+        "import sys, resource; sys.path.append(%r)\n"
+        "from utils.data_profiler import profile_file\n"
+        "report = profile_file(%r, stream=%r)\n"
+        "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n"
+        "print(report)\n"
+    ) % (str(ROOT), path, stream)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    peak_kb, report = result.stdout.split('\n', 1)
+    return elapsed, int(peak_kb) / 1024, '\n'.join(report.splitlines()[:4])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure peak memory of streaming vs in-memory profiling')
+    parser.add_argument('--size-mb', type=float, default=1024, help='Size of each generated file in MB (default: 1024)')
+    parser.add_argument('--format', choices=['csv', 'geojson', 'both'], default='both', help='Which files to generate')
+    parser.add_argument('--compare-mb', type=float, default=64,
+                        help='Also profile a file of this size fully in memory for comparison (0 to skip, default: 64)')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated files')
+    args = parser.parse_args()
+
+    formats = ['csv', 'geojson'] if args.format == 'both' else [args.format]
+    tmp = tempfile.mkdtemp(prefix='stream_profile_bench_')
+    try:
+        for fmt in formats:
+            generate = generate_csv if fmt == 'csv' else generate_geojson
+            ext = '.csv' if fmt == 'csv' else '.json'
+            runs = []
+            if args.compare_mb:
+                runs.append((args.compare_mb, False))
+                runs.append((args.compare_mb, True))
+            runs.append((args.size_mb, True))
+
+            print(f"\n{fmt.upper()} profiling")
+            print("=" * 70)
+            print(f"{'mode':<10} {'size':>10} {'time':>10} {'MB/s':>10} {'peak RSS':>12}")
+            for size_mb, stream in runs:
+                path = os.path.join(tmp, f"synthetic_{int(size_mb)}{ext}")
+                if not os.path.exists(path):
+                    generate(path, int(size_mb * 1024 ** 2))
+                actual_mb = os.path.getsize(path) / 1024 ** 2
+                elapsed, peak_mb, _ = profile_in_child(path, stream)
+                mode = 'streaming' if stream else 'in-memory'
+                print(f"{mode:<10} {actual_mb:>8.0f}MB {elapsed:>9.1f}s {actual_mb / elapsed:>10.1f} {peak_mb:>10.0f}MB")
+    finally:
+        if not args.keep:
+            for name in os.listdir(tmp):
+                os.unlink(os.path.join(tmp, name))
+            os.rmdir(tmp)
+        else:
+            print(f"Generated files kept in {tmp}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.js_validate import validate_file
+from utils.jsonl_io import write_records, iter_records
+
+TEMPLATE = """import * as d3 from 'd3';
+
+/**
+ * Creates a {kind} chart using D3
+ */
+export default function createVisualization({{ containerId = '{field}_chart', width = {width}, height = 400 }} = {{}}) {{
+  const container = d3.select(`#${{containerId}}`);
+  if (container.empty()) {{
+    throw new Error(`Container #${{containerId}} not found`);
+  }}
+  const svg = container.append('svg').attr('width', width).attr('height', height);
+  const x = d3.scaleBand().range([0, width]).padding(0.{pad});
+  const y = d3.scaleLinear().range([height, 0]);
+  d3.csv('https://example.com/{field}.csv', d3.autoType).then(data => {{
+    x.domain(data.map(d => d.{field}));
+    y.domain([0, d3.max(data, d => d.value)]).nice();
+    svg.selectAll('rect').data(data).join('rect')
+      .attr('x', d => x(d.{field}))
+      .attr('y', d => y(d.value))
+      .attr('height', d => height - y(d.value))
+      .attr('width', x.bandwidth())
+      .on('mouseover', (event, d) => tooltip.text(`${{d.{field}}}: ${{d.value}}`));
+    svg.append('g').attr('transform', `translate(0,${{height}})`).call(d3.axisBottom(x));
+    svg.append('g').call(d3.axisLeft(y).ticks({ticks}, '~s'));
+  }}).catch(error => console.error('Failed to load data', error));
+  const tooltip = container.append('div').attr('class', 'tooltip').style('opacity', 0);
+  return svg.node();
+}}"""
+
+
+def corpus(count, invalid_share, seed=0):
+    """Refined examples, ``invalid_share`` of them broken the ways model replies break; yields (record, is_valid)."""
+    rng = random.Random(seed)
+    defects = ('truncated', 'no export', 'unbalanced', 'prose only')
+    for number in range(count):
+        code = TEMPLATE.format(kind=rng.choice(['bar', 'column', 'histogram']), field=f"field{rng.randrange(99)}",
+                               width=rng.randint(300, 900), pad=rng.randint(1, 9), ticks=rng.randint(3, 12))
+        valid = rng.random() >= invalid_share
+        if not valid:
+            defect = rng.choice(defects)
+            if defect == 'truncated':
+                code = code[:rng.randrange(code.index('export'), code.rindex('}'))]
+            elif defect == 'no export':
+                code = code.replace('export default function', 'function')
+            elif defect == 'unbalanced':
+                code = code.replace('.nice();', '.nice(;', 1)
+        output = (f"Sure, here's the chart:\n\n```javascript\n{code}\n```" if valid or defect != 'prose only'
+                  else "I'm sorry, but I can't produce that visualization.")
+        if not valid and defect == 'truncated':
+            output = output[:output.rindex('\n```')]
+        yield {'input': f"Show {number}", 'output': output, 'original_output': 'const data = [];'}, valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the JavaScript validation gate on a synthetic refined corpus')
+    parser.add_argument('--examples', type=int, default=50000, help='Refined examples (default: 50000)')
+    parser.add_argument('--invalid', type=float, default=0.1, help='Share of broken examples (default: 0.1)')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}),
+                        help='Worker counts to time (default: 1 and one per CPU)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='validate_bench_') as tmp:
+        expected = []
+        input_file = Path(tmp) / 'refined.jsonl'
+
+        def records():
+            for record, valid in corpus(args.examples, args.invalid):
+                expected.append(valid)
+                yield record
+
+        write_records(input_file, records())
+        size_mb = input_file.stat().st_size / 1024 ** 2
+        print(f"{args.examples:,} refined examples ({size_mb:.1f} MB), {expected.count(False):,} broken")
+        print("=" * 78)
+        for workers in args.workers:
+            output_file = Path(tmp) / f'flagged_{workers}.jsonl'
+            start = time.perf_counter()
+            stats = validate_file(input_file, output_file, Path(tmp) / 'retry.jsonl', workers=workers, parser='tokens')
+            elapsed = time.perf_counter() - start
+            flags = [record['valid'] for record in iter_records(output_file)]
+            missed = sum(1 for flag, valid in zip(flags, expected) if flag and not valid)
+            rejected = sum(1 for flag, valid in zip(flags, expected) if valid and not flag)
+            print(f"{workers:>2} workers  {elapsed:6.2f}s  {args.examples / elapsed:>9,.0f} ex/s  "
+                  f"{size_mb / elapsed:6.1f} MB/s  invalid {stats['invalid']:,}  "
+                  f"missed {missed}  wrongly rejected {rejected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import threading
+import argparse
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+from utils.rate_limit import TokenBucket
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _BacklogHTTPServer(ThreadingHTTPServer):
+    # The default backlog of 5 turns bursts of concurrent connects into retries.
+    request_queue_size = 256
+
+
+class _LocalServer:
+    """Threaded HTTP server on a background thread, usable as a context manager."""
+
+    def __init__(self, host, port):
+        self.server = _BacklogHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, route):
+        return f"{self.base_url}/{route.lstrip('/')}"
+
+    def _make_handler(self):
+        raise NotImplementedError
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class DataServer(_LocalServer):
+    """Local stand-in for remote dataUrl hosts.
+
+    Serves files registered with ``add_file`` (or synthetic bodies registered
+    with ``add_generated``) with ETag/Last-Modified validators, optional latency
+    and a configurable number of leading 503 responses to exercise retries.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, fail_first=0):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.routes = {}
+        self.request_log = []
+        self._lock = threading.Lock()
+        self._failures = {}
+        super().__init__(host, port)
+
+    def add_file(self, route, path):
+        stat = os.stat(path)
+        etag = hashlib.md5(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+        self.routes['/' + route.lstrip('/')] = {
+            'path': path,
+            'size': stat.st_size,
+            'etag': f'"{etag}"',
+            'last_modified': formatdate(stat.st_mtime, usegmt=True),
+        }
+        return self.url(route)
+
+    def add_generated(self, route, size, line=b'a,b,c\n1,2,3\n'):
+        """Register a synthetic body of ``size`` bytes built from a repeated line."""
+        etag = hashlib.md5(f"{route}:{size}".encode()).hexdigest()
+        self.routes['/' + route.lstrip('/')] = {
+            'line': line,
+            'size': size,
+            'etag': f'"{etag}"',
+            'last_modified': formatdate(time.time(), usegmt=True),
+        }
+        return self.url(route)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(_QuietHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.request_log.append((self.path, dict(self.headers)))
+                    failures = server._failures.get(self.path, 0)
+                    if failures < server.fail_first:
+                        server._failures[self.path] = failures + 1
+                        fail = True
+                    else:
+                        fail = False
+
+                if server.latency:
+                    time.sleep(server.latency)
+
+                route = server.routes.get(self.path)
+                if fail or route is None:
+                    self.send_response(503 if fail else 404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                if self.headers.get('If-None-Match') == route['etag']:
+                    self.send_response(304)
+                    self.send_header('ETag', route['etag'])
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Length', str(route['size']))
+                self.send_header('ETag', route['etag'])
+                self.send_header('Last-Modified', route['last_modified'])
+                self.end_headers()
+                try:
+                    self._write_body(route)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Clients abort oversized bodies mid-stream.
+                    pass
+
+            def _write_body(self, route):
+                if 'path' in route:
+                    with open(route['path'], 'rb') as f:
+                        while True:
+                            chunk = f.read(1024 * 1024)
+                            if not chunk:
+                                break
+                            self.wfile.write(chunk)
+                    return
+                line = route['line']
+                block = line * max(1, (1024 * 1024) // len(line))
+                remaining = route['size']
+                while remaining > 0:
+                    chunk = block[:remaining]
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+
+        return Handler
+
+
+def inference_responder(request):
+    """Canned reply in the shape D3DataInferer expects."""
+    return json.dumps({
+        'data_structure': 'Array of objects with name (string) and value (number)',
+        'sample_data': [{'name': 'A', 'value': 10}, {'name': 'B', 'value': 20}, {'name': 'C', 'value': 15}],
+        'explanation': 'Each object is one bar; name is the category and value its height.',
+    })
+
+
+def queries_responder(request):
+    """Canned reply in the shape TrainingDataGenerator.generate_queries expects."""
+    return json.dumps({'queries': [{'query': f"Show how the values compare across categories ({i})"}
+                                   for i in range(1, 6)]})
+
+
+def refine_responder(request):
+    """Reply in the shape BatchProcessor.process_example (or process_group) expects.
+
+    The original implementation is echoed back as the "refined" code, wrapped
+    in the createVisualization export the system prompt asks for, so
+    completion sizes track the code being refined.
+    """
+    prompt = request['messages'][-1]['content']
+    code = prompt.split('Original D3.js Implementation:\n', 1)[-1].split('\n\nProvide your response', 1)[0]
+    code = code.strip()
+    if code.startswith('```'):
+        code = code.split('\n', 1)[-1].rsplit('```', 1)[0]
+    if 'export default function createVisualization' not in code:
+        lines = code.splitlines()
+        imports = [line for line in lines if line.startswith('import ')]
+        body = [re.sub(r'^export (default )?', '', line) for line in lines if not line.startswith('import ')]
+        code = '\n'.join(imports + ['', 'export default function createVisualization(config = {}) {']
+                          + [f"  {line}" for line in body] + ['}'])
+    output = f"Here's the chart:\n\n```javascript\n{code}\n```"
+    if 'Original Requests:' in prompt:
+        requests = prompt.split('Original Requests:\n', 1)[1].split('\n\n', 1)[0].splitlines()
+        return json.dumps({'inputs': [f"{line.split('. ', 1)[-1]} (refined)" for line in requests],
+                           'output': output})
+    original = prompt.split('Original Request:', 1)[-1].split('\n', 1)[0].strip()
+    return json.dumps({'input': f"{original} (refined)", 'output': output})
+
+
+def pipeline_responder(request):
+    """Pick the canned reply matching whichever pipeline script sent the prompt."""
+    prompt = request['messages'][-1]['content']
+    if 'natural language queries' in prompt:
+        return queries_responder(request)
+    if 'refined version' in prompt:
+        return refine_responder(request)
+    return inference_responder(request)
+
+
+class CompletionsServer(_LocalServer):
+    """Local stand-in for an OpenAI-compatible chat completions endpoint.
+
+    Every POST to ``/v1/chat/completions`` waits ``latency`` seconds (a number,
+    or a callable returning one per request to model tail latency) and answers
+    with ``responder(request_json)`` as the assistant message.
+
+    Failure injection: the first ``fail_first`` requests get 429s, and a random
+    ``error_rate`` fraction get 500s. With ``requests_per_minute`` and/or
+    ``tokens_per_minute`` the server enforces those limits like the real API:
+    x-ratelimit-* headers on every response and 429s with retry-after-ms when
+    a limit is exceeded. ``max_in_flight`` records peak concurrency.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, responder=pipeline_responder, fail_first=0,
+                 error_rate=0.0, requests_per_minute=None, tokens_per_minute=None):
+        self.latency = latency
+        self.responder = responder
+        self.fail_first = fail_first
+        self.error_rate = error_rate
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.request_log = []
+        self.status_counts = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        super().__init__(host, port)
+
+    @property
+    def api_base(self):
+        """Value for the OpenAI client's ``base_url``."""
+        return f"{self.base_url}/v1"
+
+    def _admit(self, request):
+        """Charge the rate limits; returns (status, headers) for this request."""
+        prompt_tokens = self._prompt_tokens(request)
+        headers = {}
+        status = 200
+        with self._lock:
+            for name, bucket, amount in (('requests', self.request_bucket, 1),
+                                         ('tokens', self.token_bucket, prompt_tokens)):
+                if bucket is None:
+                    continue
+                wait = bucket.wait_time(amount)
+                if wait > 0:
+                    status = 429
+                    headers['retry-after-ms'] = str(int(wait * 1000) + 1)
+                headers[f'x-ratelimit-limit-{name}'] = str(int(bucket.capacity))
+                headers[f'x-ratelimit-reset-{name}'] = f"{(bucket.capacity - bucket.available) / bucket.rate:.3f}s"
+            if status == 200:
+                for name, bucket, amount in (('requests', self.request_bucket, 1),
+                                             ('tokens', self.token_bucket, prompt_tokens)):
+                    if bucket is not None:
+                        bucket.take(amount)
+            for name, bucket in (('requests', self.request_bucket), ('tokens', self.token_bucket)):
+                if bucket is not None:
+                    headers[f'x-ratelimit-remaining-{name}'] = str(max(0, int(bucket.available)))
+        return status, headers
+
+    @staticmethod
+    def _prompt_tokens(request):
+        return max(1, sum(len(message.get('content') or '') for message in request.get('messages', [])) // 4)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(_QuietHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                with server._lock:
+                    server.request_log.append((self.path, request))
+                    fail = len(server.request_log) <= server.fail_first
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    status, headers = server._admit(request)
+                    if status == 200 and not fail:
+                        latency = server.latency() if callable(server.latency) else server.latency
+                        if latency:
+                            time.sleep(latency)
+                    if not self.path.rstrip('/').endswith('/chat/completions'):
+                        self._send_json(404, {'error': {'message': f"Unknown route {self.path}"}})
+                    elif fail or status == 429:
+                        headers.setdefault('retry-after-ms', '0')
+                        self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}},
+                                        headers)
+                    elif server.error_rate and random.random() < server.error_rate:
+                        self._send_json(500, {'error': {'message': 'Internal server error', 'type': 'server_error'}},
+                                        headers)
+                    else:
+                        self._send_json(200, server.completion(request), headers)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _send_json(self, status, body, headers=None):
+                with server._lock:
+                    server.status_counts[status] = server.status_counts.get(status, 0) + 1
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def completion(self, request):
+        content = self.responder(request)
+        prompt_tokens = self._prompt_tokens(request)
+        completion_tokens = max(1, len(content) // 4)
+        return {
+            'id': f"chatcmpl-mock-{len(self.request_log)}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run local stand-in servers for pipeline benchmarks')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on (default: 8765)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of latency added to every response')
+    parser.add_argument('--serve-dir', help='Serve every file in this directory under its file name')
+    parser.add_argument('--completions', action='store_true',
+                        help='Serve a mock OpenAI chat completions endpoint instead of data files')
+    parser.add_argument('--requests-per-minute', type=int, help='Rate limit enforced by the completions endpoint')
+    parser.add_argument('--tokens-per-minute', type=int, help='Token rate limit enforced by the completions endpoint')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of completions answered with HTTP 500')
+    args = parser.parse_args()
+
+    if args.completions:
+        server = CompletionsServer(port=args.port, latency=args.latency, requests_per_minute=args.requests_per_minute,
+                                   tokens_per_minute=args.tokens_per_minute, error_rate=args.error_rate)
+        print(f"Mock completions endpoint at {server.api_base} (set OPENAI_BASE_URL to use it)")
+        try:
+            server.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    server = DataServer(port=args.port, latency=args.latency)
+    if args.serve_dir:
+        for name in sorted(os.listdir(args.serve_dir)):
+            path = os.path.join(args.serve_dir, name)
+            if os.path.isfile(path):
+                print(server.add_file(name, path))
+    print(f"Data server listening on {server.base_url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
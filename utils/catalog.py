@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.js_extract import EXTRACTOR_VERSION, find_data_sources
+
+CATALOG_NAME = '.gallery_catalog.sqlite'
+# Files besides the JS that the pipeline stages write into a visualization directory.
+ARTIFACT_NAMES = ('queries.json', 'data_report.txt', 'inferred_data_report.txt', 'explanation.txt',
+                  'inferred_sample_data.json', 'failed_to_parse.txt')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS visualizations (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER NOT NULL,
+    primary_js TEXT,
+    changed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS js_files (
+    id INTEGER PRIMARY KEY,
+    viz_id INTEGER NOT NULL REFERENCES visualizations (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    sources TEXT NOT NULL,
+    UNIQUE (viz_id, name)
+);
+CREATE INDEX IF NOT EXISTS js_files_sha256 ON js_files (sha256);
+CREATE TABLE IF NOT EXISTS data_sources (
+    js_id INTEGER NOT NULL REFERENCES js_files (id) ON DELETE CASCADE,
+    viz_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    format TEXT,
+    location TEXT
+);
+CREATE INDEX IF NOT EXISTS data_sources_kind ON data_sources (kind, format, viz_id);
+CREATE INDEX IF NOT EXISTS data_sources_js ON data_sources (js_id);
+CREATE TABLE IF NOT EXISTS artifacts (
+    viz_id INTEGER NOT NULL REFERENCES visualizations (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (viz_id, name)
+);
+CREATE INDEX IF NOT EXISTS artifacts_name ON artifacts (name, viz_id);
+"""
+
+
+def source_rows(data_sources):
+    """(name, kind, format, location) for each data source find_data_sources() returned.
+
+    ``kind`` is remote, local or inline; ``format`` is the file extension of a
+    remote or local source (csv, tsv, json, ...).
+    """
+    rows = []
+    for name, data in data_sources.items():
+        if name.startswith('dataUrl') and isinstance(data, str):
+            kind = 'remote' if data.startswith('http') else 'local'
+            suffix = Path(urlparse(data).path).suffix.lower().lstrip('.')
+            rows.append((name, kind, suffix or None, data))
+        else:
+            rows.append((name, 'inline', None, None))
+    return rows
+
+
+def pick_primary(js_files):
+    """The JS file that stands for a visualization: one with data sources, then the largest, then by name.
+
+    ``js_files`` holds (name, size, has_sources) tuples.
+    """
+    if not js_files:
+        return None
+    return min(js_files, key=lambda item: (not item[2], -item[1], item[0]))[0]
+
+
+class GalleryCatalog:
+    """SQLite index of a gallery's visualization directories.
+
+    Records each directory's JS files (size, mtime, content hash and the data
+    sources js_extract found in them) and the artifacts the pipeline wrote
+    beside them (queries, reports, explanations) with their stat data.
+    ``refresh()`` brings it up to date with one scandir/stat pass; only JS
+    files whose size or mtime moved are read and parsed again. Stages then
+    list and filter visualizations with indexed queries instead of walking
+    the tree. Each thread (and each worker process) opens its own connection.
+    """
+
+    def __init__(self, gallery_root, path=None):
+        self.gallery_root = Path(gallery_root)
+        self.path = str(path or self.gallery_root / CATALOG_NAME)
+        self._init_state()
+        conn = self._connect()
+        with conn:
+            conn.executescript(_SCHEMA)
+        version = conn.execute("SELECT value FROM meta WHERE key = 'extractor_version'").fetchone()
+        if version is None or int(version[0]) != EXTRACTOR_VERSION:
+            # Extracted sources are stale under a different extractor; re-parse every file.
+            with conn:
+                conn.execute('DELETE FROM visualizations')
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('extractor_version', ?)",
+                             (str(EXTRACTOR_VERSION),))
+
+    def _init_state(self):
+        self._local = threading.local()
+        self.stats = {'dirs': 0, 'parsed': 0, 'removed': 0}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_local', 'stats'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    def refresh(self, warn=None):
+        """Sync the catalog with the gallery on disk; returns the stats of this pass."""
+        self.stats = {'dirs': 0, 'parsed': 0, 'removed': 0}
+        conn = self._connect()
+        known = {name: (viz_id, mtime_ns, primary_js) for viz_id, name, mtime_ns, primary_js
+                 in conn.execute('SELECT id, name, mtime_ns, primary_js FROM visualizations')}
+        # viz_id -> {file name: stat data} for JS files and artifacts.
+        js_state = {}
+        for js_id, viz_id, name, size, mtime_ns, has_sources in conn.execute(
+                "SELECT id, viz_id, name, size, mtime_ns, sources != '{}' FROM js_files"):
+            js_state.setdefault(viz_id, {})[name] = (js_id, size, mtime_ns, bool(has_sources))
+        artifact_state = {}
+        for viz_id, name, size, mtime_ns in conn.execute('SELECT viz_id, name, size, mtime_ns FROM artifacts'):
+            artifact_state.setdefault(viz_id, {})[name] = (size, mtime_ns)
+
+        seen = set()
+        now = time.time()
+        with conn:
+            with os.scandir(self.gallery_root) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.') or not entry.is_dir():
+                        continue
+                    seen.add(entry.name)
+                    self.stats['dirs'] += 1
+                    self._refresh_dir(conn, entry, known, js_state, artifact_state, now, warn)
+            for name in set(known) - seen:
+                conn.execute('DELETE FROM visualizations WHERE id = ?', (known[name][0],))
+                self.stats['removed'] += 1
+        return self.stats
+
+    def _refresh_dir(self, conn, entry, known, js_state, artifact_state, now, warn):
+        viz_id, mtime_ns, primary_js = known.get(entry.name, (None, None, None))
+        if viz_id is None:
+            viz_id = conn.execute('INSERT INTO visualizations (name, mtime_ns, changed) VALUES (?, ?, ?)',
+                                  (entry.name, entry.stat().st_mtime_ns, now)).lastrowid
+        known_js = js_state.get(viz_id, {})
+        known_artifacts = artifact_state.get(viz_id, {})
+        js_files = []
+        artifacts = set()
+        with os.scandir(entry.path) as files:
+            for item in files:
+                if not item.is_file():
+                    continue
+                if item.name.endswith('.js'):
+                    stat = item.stat()
+                    previous = known_js.get(item.name)
+                    if previous is not None and previous[1:3] == (stat.st_size, stat.st_mtime_ns):
+                        has_sources = previous[3]
+                    else:
+                        has_sources = self._store_js(conn, viz_id, item, stat, warn)
+                    js_files.append((item.name, stat.st_size, has_sources))
+                elif item.name in ARTIFACT_NAMES:
+                    stat = item.stat()
+                    artifacts.add(item.name)
+                    if known_artifacts.get(item.name) != (stat.st_size, stat.st_mtime_ns):
+                        conn.execute('INSERT OR REPLACE INTO artifacts (viz_id, name, size, mtime_ns) '
+                                     'VALUES (?, ?, ?, ?)', (viz_id, item.name, stat.st_size, stat.st_mtime_ns))
+
+        names = {name for name, _, _ in js_files}
+        for name, (js_id, _, _, _) in known_js.items():
+            if name not in names:
+                conn.execute('DELETE FROM js_files WHERE id = ?', (js_id,))
+        for name in known_artifacts:
+            if name not in artifacts:
+                conn.execute('DELETE FROM artifacts WHERE viz_id = ? AND name = ?', (viz_id, name))
+        primary = pick_primary(js_files)
+        if (mtime_ns, primary_js) != (entry.stat().st_mtime_ns, primary):
+            conn.execute('UPDATE visualizations SET mtime_ns = ?, primary_js = ?, changed = ? WHERE id = ?',
+                         (entry.stat().st_mtime_ns, primary, now, viz_id))
+
+    def _store_js(self, conn, viz_id, item, stat, warn):
+        """Hash and parse one new or changed JS file; returns whether it has data sources."""
+        with open(item.path, 'rb') as f:
+            raw = f.read()
+        content = raw.decode('utf-8', errors='replace')
+        data_sources = find_data_sources(content, warn=warn and (lambda msg: warn(f"{msg} in {item.path}")))
+        self.stats['parsed'] += 1
+        conn.execute('DELETE FROM js_files WHERE viz_id = ? AND name = ?', (viz_id, item.name))
+        js_id = conn.execute('INSERT INTO js_files (viz_id, name, size, mtime_ns, sha256, sources) '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             (viz_id, item.name, stat.st_size, stat.st_mtime_ns, hashlib.sha256(raw).hexdigest(),
+                              json.dumps(data_sources))).lastrowid
+        conn.executemany('INSERT INTO data_sources (js_id, viz_id, name, kind, format, location) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         [(js_id, viz_id, *row) for row in source_rows(data_sources)])
+        return bool(data_sources)
+
+    def viz_dir(self, name):
+        return self.gallery_root / name
+
+    def find(self, remote=None, local=None, inline=None, data=None, has=(), missing=()):
+        """Visualization directories matching every given filter, by name.
+
+        ``remote``/``local`` require a data source of that kind; pass a format
+        such as 'csv' to require that format too, or True for any. ``inline``
+        and ``data`` True/False require or exclude inline data and any data
+        source at all. ``has``/``missing`` name artifacts (e.g. 'queries.json')
+        that must or must not exist.
+        """
+        clauses = []
+        params = []
+        if data is not None:
+            clauses.append(f"{'' if data else 'NOT '}EXISTS (SELECT 1 FROM data_sources s WHERE s.viz_id = v.id)")
+        for kind, wanted in (('remote', remote), ('local', local)):
+            if wanted:
+                clause = "EXISTS (SELECT 1 FROM data_sources s WHERE s.kind = ? AND s.viz_id = v.id"
+                params.append(kind)
+                if wanted is not True:
+                    clause += " AND s.format = ?"
+                    params.append(wanted)
+                clauses.append(clause + ")")
+        if inline is not None:
+            clauses.append(f"{'' if inline else 'NOT '}EXISTS "
+                           f"(SELECT 1 FROM data_sources s WHERE s.kind = 'inline' AND s.viz_id = v.id)")
+        for names, negate in ((has, ''), (missing, 'NOT ')):
+            for name in names:
+                clauses.append(f"{negate}EXISTS (SELECT 1 FROM artifacts a WHERE a.name = ? AND a.viz_id = v.id)")
+                params.append(name)
+        sql = 'SELECT v.name FROM visualizations v'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY v.name'
+        return [self.viz_dir(name) for name, in self._connect().execute(sql, params)]
+
+    def visualizations(self):
+        """Every visualization directory, sorted by name."""
+        return self.find()
+
+    def js_files(self, viz_dir):
+        """Paths of a visualization's JS files, primary first."""
+        rows = self._connect().execute(
+            'SELECT j.name, v.primary_js FROM js_files j JOIN visualizations v ON v.id = j.viz_id '
+            'WHERE v.name = ? ORDER BY j.name != v.primary_js, j.name', (Path(viz_dir).name,)).fetchall()
+        return [Path(viz_dir) / name for name, _ in rows]
+
+    def primary_js(self, viz_dir):
+        row = self._connect().execute('SELECT primary_js FROM visualizations WHERE name = ?',
+                                      (Path(viz_dir).name,)).fetchone()
+        return Path(viz_dir) / row[0] if row and row[0] else None
+
+    def data_sources(self, js_file):
+        """The data sources extracted from ``js_file`` when it was catalogued, or None if it is not."""
+        js_file = Path(js_file)
+        row = self._connect().execute(
+            'SELECT j.sources FROM js_files j JOIN visualizations v ON v.id = j.viz_id '
+            'WHERE v.name = ? AND j.name = ?', (js_file.parent.name, js_file.name)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def artifacts(self, viz_dir):
+        """{artifact name: mtime_ns} for one visualization."""
+        return dict(self._connect().execute(
+            'SELECT a.name, a.mtime_ns FROM artifacts a JOIN visualizations v ON v.id = a.viz_id WHERE v.name = ?',
+            (Path(viz_dir).name,)))
+
+    def is_current(self, viz_dir, artifact, inputs=()):
+        """True when ``artifact`` is at least as new as every JS file and ``inputs`` artifact, as of the last refresh."""
+        name = Path(viz_dir).name
+        placeholders = ','.join('?' * len(inputs)) or "''"
+        row = self._connect().execute(
+            f'SELECT a.mtime_ns, (SELECT MAX(mtime_ns) FROM ('
+            f'SELECT j.mtime_ns FROM js_files j WHERE j.viz_id = v.id UNION ALL '
+            f'SELECT i.mtime_ns FROM artifacts i WHERE i.viz_id = v.id AND i.name IN ({placeholders}))) '
+            f'FROM visualizations v JOIN artifacts a ON a.viz_id = v.id AND a.name = ? WHERE v.name = ?',
+            (*inputs, artifact, name)).fetchone()
+        return row is not None and (row[1] is None or row[0] >= row[1])
+
+    def counts(self):
+        conn = self._connect()
+        counts = {
+            'visualizations': conn.execute('SELECT COUNT(*) FROM visualizations').fetchone()[0],
+            'js files': conn.execute('SELECT COUNT(*) FROM js_files').fetchone()[0],
+            'unique sources': conn.execute('SELECT COUNT(DISTINCT sha256) FROM js_files').fetchone()[0],
+        }
+        for kind, fmt, count in conn.execute('SELECT kind, format, COUNT(DISTINCT viz_id) FROM data_sources '
+                                             'GROUP BY kind, format ORDER BY kind, format'):
+            counts[f"{kind} {fmt} data" if fmt else f"{kind} data"] = count
+        for name, count in conn.execute('SELECT name, COUNT(*) FROM artifacts GROUP BY name ORDER BY name'):
+            counts[name] = count
+        return counts
+
+
+def add_catalog_arguments(parser):
+    """Register the --catalog flag shared by the gallery scripts."""
+    group = parser.add_argument_group('Gallery catalog')
+    group.add_argument('--catalog', nargs='?', const='', metavar='DB',
+                       help=f'List visualizations from an SQLite catalog refreshed incrementally at startup instead '
+                            f'of walking the gallery (default DB: GALLERY_DIR/{CATALOG_NAME})')
+    return group
+
+
+def catalog_from_args(args, gallery_root, report=print):
+    """Open and refresh the catalog requested by --catalog, or return None."""
+    if getattr(args, 'catalog', None) is None:
+        return None
+    catalog = GalleryCatalog(gallery_root, args.catalog or None)
+    start = time.perf_counter()
+    stats = catalog.refresh(warn=lambda msg: report(f"Warning: {msg}"))
+    report(f"Catalog {catalog.path}: {stats['dirs']} visualizations, {stats['parsed']} JS files parsed, "
+           f"{stats['removed']} removed ({time.perf_counter() - start:.2f}s)")
+    return catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the gallery catalog')
+    parser.add_argument('gallery_dir', help='Directory containing D3 visualizations')
+    parser.add_argument('--db', help=f'Catalog database (default: GALLERY_DIR/{CATALOG_NAME})')
+    parser.add_argument('--no-refresh', action='store_true', help='Query the catalog as it is, without a stat pass')
+    parser.add_argument('--remote', nargs='?', const=True, metavar='FORMAT',
+                        help='Only visualizations with a remote data source (of FORMAT, e.g. csv)')
+    parser.add_argument('--local', nargs='?', const=True, metavar='FORMAT',
+                        help='Only visualizations with a local data file (of FORMAT)')
+    parser.add_argument('--inline', action='store_true', help='Only visualizations with inline data')
+    parser.add_argument('--no-data', action='store_true', help='Only visualizations without any data source')
+    parser.add_argument('--has', nargs='+', default=[], metavar='ARTIFACT', help='Require these artifacts')
+    parser.add_argument('--missing', nargs='+', default=[], metavar='ARTIFACT',
+                        help='Require these artifacts to be absent, e.g. queries.json')
+    args = parser.parse_args()
+
+    catalog = GalleryCatalog(args.gallery_dir, args.db)
+    if not args.no_refresh:
+        start = time.perf_counter()
+        stats = catalog.refresh()
+        print(f"Refreshed {stats['dirs']} visualizations ({stats['parsed']} JS files parsed, "
+              f"{stats['removed']} removed) in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+    filters = (args.remote, args.local, args.inline, args.no_data, args.has, args.missing)
+    if not any(filters):
+        for name, count in catalog.counts().items():
+            print(f"{name:<28} {count:>10,}")
+        return
+
+    start = time.perf_counter()
+    matches = catalog.find(remote=args.remote, local=args.local, inline=True if args.inline else None,
+                           data=False if args.no_data else None, has=args.has, missing=args.missing)
+    for viz_dir in matches:
+        print(viz_dir)
+    print(f"{len(matches)} visualizations ({(time.perf_counter() - start) * 1000:.1f} ms)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.source_store import source_id
+
+FEATURES_VERSION = 1
+INDEX_NAME = '.d3_features.npz'
+SKIP_DIRS = {'node_modules', '__pycache__'}
+
+# D3 API members (``d3.x``, or ``x`` imported from a d3 module) counted towards each feature.
+MEMBER_FEATURES = {
+    'scale_linear': ('scaleLinear', 'scaleIdentity', 'scaleRadial'),
+    'scale_log': ('scaleLog', 'scalePow', 'scaleSqrt', 'scaleSymlog'),
+    'scale_time': ('scaleTime', 'scaleUtc'),
+    'scale_band': ('scaleBand', 'scalePoint'),
+    'scale_ordinal': ('scaleOrdinal',),
+    'scale_quantize': ('scaleQuantize', 'scaleQuantile', 'scaleThreshold'),
+    'axis': ('axisTop', 'axisRight', 'axisBottom', 'axisLeft'),
+    'geo_path': ('geoPath',),
+    'contours': ('contours', 'contourDensity'),
+    'hierarchy': ('hierarchy', 'stratify'),
+    'tree': ('tree', 'cluster'),
+    'treemap': ('treemap',),
+    'pack': ('pack', 'packSiblings', 'packEnclose'),
+    'partition': ('partition',),
+    'chord': ('chord', 'chordDirected', 'chordTranspose', 'ribbon', 'ribbonArrow'),
+    'sankey': ('sankey', 'sankeyLinkHorizontal'),
+    'voronoi': ('Delaunay', 'Voronoi', 'voronoi'),
+    'line': ('line', 'lineRadial'),
+    'area': ('area', 'areaRadial'),
+    'arc': ('arc',),
+    'pie': ('pie',),
+    'stack': ('stack',),
+    'link': ('link', 'linkHorizontal', 'linkVertical', 'linkRadial'),
+    'bin': ('bin', 'histogram'),
+    'brush': ('brush', 'brushX', 'brushY'),
+    'zoom': ('zoom',),
+    'drag': ('drag',),
+    'transition': ('transition',),
+    'load_csv': ('csv', 'tsv', 'dsv', 'csvParse', 'tsvParse', 'dsvFormat', 'autoType'),
+    'load_json': ('json', 'text', 'xml', 'html', 'image', 'buffer', 'blob'),
+}
+# Families too large to list, matched by prefix after the names above.
+PREFIX_FEATURES = (
+    ('scaleSequential', 'scale_sequential'),
+    ('scaleDiverging', 'scale_sequential'),
+    ('force', 'force'),
+    ('geo', 'geo_projection'),
+    ('curve', 'curve'),
+    ('symbol', 'symbol'),
+    ('interpolate', 'interpolate'),
+    ('scheme', 'color_scheme'),
+)
+# SVG elements appended or joined, e.g. ``.append('rect')``.
+MARK_FEATURES = {'rect': 'mark_rect', 'circle': 'mark_circle', 'path': 'mark_path', 'line': 'mark_line',
+                 'text': 'mark_text', 'polygon': 'mark_path', 'ellipse': 'mark_circle'}
+OTHER_FEATURES = ('topojson', 'fetch')
+
+FEATURE_NAMES = tuple(dict.fromkeys((*MEMBER_FEATURES, *(feature for _, feature in PREFIX_FEATURES),
+                                     *MARK_FEATURES.values(), *OTHER_FEATURES)))
+_FEATURE_COLUMN = {name: column for column, name in enumerate(FEATURE_NAMES)}
+_MEMBER_COLUMN = {member: _FEATURE_COLUMN[feature] for feature, members in MEMBER_FEATURES.items()
+                  for member in members}
+
+# Chart types in priority order: the first whose features a file uses at all is its type.
+CHART_TYPES = (
+    ('contour', ('contours',)),
+    ('map', ('geo_path', 'geo_projection', 'topojson')),
+    ('network', ('force',)),
+    ('hierarchy', ('tree', 'treemap', 'pack', 'partition', 'hierarchy')),
+    ('flow', ('chord', 'sankey')),
+    ('pie', ('pie', 'arc')),
+    ('histogram', ('bin',)),
+    ('area', ('area', 'stack')),
+    ('line', ('line',)),
+    ('bar', ('scale_band', 'mark_rect')),
+    ('scatter', ('mark_circle',)),
+)
+OTHER_CHART_TYPE = 'other'
+STRATA = ('chart_type', 'folder', 'directory')
+
+# Lookbehinds come after the literal so the scan only checks them where the literal occurs.
+_D3_MEMBER = re.compile(r'd3(?<![\w$.]d3)\s*\.\s*([A-Za-z_$][\w$]*)')
+_METHOD_TRANSITION = re.compile(r'\.\s*transition\s*\(')
+_MARK = re.compile(r'''\.\s*(?:append|join|insert)\s*\(\s*["'](?:svg:)?(\w+)["']''')
+_TOPOJSON = re.compile(r'topojson(?<![\w$.]topojson)\s*\.\s*(?:feature|mesh|merge|neighbors)\b')
+_FETCH = re.compile(r'fetch(?<![\w$.]fetch)\s*\(')
+_D3_IMPORT = re.compile(r'''import\s*\{([^}]*)\}\s*from\s*["']d3(?:-[\w-]+)?["']''')
+_IMPORT_NAME = re.compile(r'([A-Za-z_$][\w$]*)(?:\s+as\s+([A-Za-z_$][\w$]*))?')
+
+
+def member_column(member):
+    """Feature column a D3 API member counts towards, or None."""
+    column = _MEMBER_COLUMN.get(member)
+    if column is None:
+        for prefix, feature in PREFIX_FEATURES:
+            if member.startswith(prefix):
+                return _FEATURE_COLUMN[feature]
+    return column
+
+
+def scan_features(content):
+    """Count the D3 features a JS source uses; returns a uint32 vector over FEATURE_NAMES.
+
+    A few regexes over the raw text rather than a full parse: ``d3.member``
+    calls, names imported from d3 modules, ``.transition()`` chains, the SVG
+    elements appended, topojson and fetch. Code in comments counts too, which
+    is rare enough not to matter for selection.
+    """
+    counts = np.zeros(len(FEATURE_NAMES), dtype=np.uint32)
+    for member in _D3_MEMBER.findall(content):
+        column = member_column(member)
+        if column is not None:
+            counts[column] += 1
+    imports = {}
+    for names in _D3_IMPORT.findall(content):
+        for name, alias in _IMPORT_NAME.findall(names):
+            column = member_column(name)
+            if column is not None:
+                imports[alias or name] = column
+    if imports:
+        pattern = re.compile(r'(?<![\w$.])(' + '|'.join(map(re.escape, imports)) + r')\s*\(')
+        for name in pattern.findall(content):
+            counts[imports[name]] += 1
+    counts[_FEATURE_COLUMN['transition']] += len(_METHOD_TRANSITION.findall(content))
+    for element in _MARK.findall(content):
+        feature = MARK_FEATURES.get(element)
+        if feature is not None:
+            counts[_FEATURE_COLUMN[feature]] += 1
+    counts[_FEATURE_COLUMN['topojson']] += len(_TOPOJSON.findall(content))
+    counts[_FEATURE_COLUMN['fetch']] += len(_FETCH.findall(content))
+    return counts
+
+
+def chart_type(counts):
+    """Chart type implied by a feature vector (see CHART_TYPES)."""
+    for name, features in CHART_TYPES:
+        if any(counts[_FEATURE_COLUMN[feature]] for feature in features):
+            return name
+    return OTHER_CHART_TYPE
+
+
+def scan_file(path):
+    """(source_id, feature vector) of one JS file; run in pool workers."""
+    with open(path, encoding='utf-8', errors='replace') as f:
+        content = f.read()
+    return source_id(content), scan_features(content)
+
+
+def iter_js_files(root):
+    """Yield (relative path, size, mtime_ns) of every JS file under ``root``, skipping hidden and build dirs."""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if entry.name not in SKIP_DIRS:
+                        stack.append(entry.path)
+                elif entry.name.endswith('.js') and entry.is_file():
+                    stat = entry.stat()
+                    yield os.path.relpath(entry.path, root).replace(os.sep, '/'), stat.st_size, stat.st_mtime_ns
+
+
+class FeatureIndex:
+    """Columnar D3 feature index of a gallery, one row per JS file.
+
+    Columns are NumPy arrays: ``path`` (relative to the gallery root),
+    ``directory``, ``source_id`` (the content hash used by source_store),
+    ``size``, ``mtime_ns`` and ``chart_type``, plus ``features``, a uint32
+    matrix of per-feature counts over ``feature_names``. Saved as ``.npz``
+    (NumPy) or ``.parquet`` (one column per feature; needs pyarrow).
+    """
+
+    COLUMNS = ('path', 'directory', 'source_id', 'size', 'mtime_ns', 'chart_type')
+
+    def __init__(self, columns=None, features=None, feature_names=FEATURE_NAMES):
+        columns = columns or {}
+        self.path = np.asarray(columns.get('path', []), dtype=str)
+        self.directory = np.asarray(columns.get('directory', []), dtype=str)
+        self.source_id = np.asarray(columns.get('source_id', []), dtype=str)
+        self.size = np.asarray(columns.get('size', []), dtype=np.int64)
+        self.mtime_ns = np.asarray(columns.get('mtime_ns', []), dtype=np.int64)
+        self.chart_type = np.asarray(columns.get('chart_type', []), dtype=str)
+        self.feature_names = tuple(feature_names)
+        self.features = (np.asarray(features, dtype=np.uint32) if features is not None
+                         else np.zeros((0, len(self.feature_names)), dtype=np.uint32))
+
+    def __len__(self):
+        return len(self.path)
+
+    def column(self, name):
+        return getattr(self, name)
+
+    def feature(self, name):
+        """Counts of one feature across every file."""
+        return self.features[:, self.feature_names.index(name)]
+
+    def strata(self, by='chart_type'):
+        """Per-row stratum labels: chart type, top-level folder, or the file's directory."""
+        if by == 'chart_type':
+            return self.chart_type
+        if by == 'folder':
+            return np.array([path.split('/', 1)[0] if '/' in path else '' for path in self.path], dtype=str)
+        if by == 'directory':
+            return self.directory
+        raise ValueError(f"Unknown stratum {by!r}; expected one of {', '.join(STRATA)}")
+
+    def counts(self, by='chart_type', mask=None):
+        labels = self.strata(by)
+        return Counter((labels if mask is None else labels[mask]).tolist())
+
+    def first_per(self, column='directory', mask=None):
+        """Mask selecting one row (the first by path) per distinct value of ``column`` among ``mask``."""
+        candidates = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        selected = np.zeros(len(self), dtype=bool)
+        if len(candidates):
+            _, first = np.unique(self.column(column)[candidates], return_index=True)
+            selected[candidates[first]] = True
+        return selected
+
+    def has_source(self, source_ids):
+        """Mask of rows whose content hash is in ``source_ids``."""
+        return np.isin(self.source_id, list(source_ids))
+
+    def with_file(self, root, name):
+        """Mask of rows whose directory under ``root`` also holds ``name`` (e.g. queries.json)."""
+        root = Path(root)
+        exists = {directory: (root / directory / name).exists() for directory in np.unique(self.directory).tolist()}
+        return np.array([exists[directory] for directory in self.directory.tolist()], dtype=bool)
+
+    def sample(self, n, by='chart_type', seed=0, mask=None):
+        """Row indices of a stratified, balanced sample of up to ``n`` rows, sorted.
+
+        Each stratum gets an equal share; strata smaller than their share are
+        taken whole and the rest is spread over the larger ones. ``mask``
+        restricts the candidate rows.
+        """
+        candidates = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        if n >= len(candidates):
+            return candidates
+        labels, inverse = np.unique(self.strata(by)[candidates], return_inverse=True)
+        groups = [candidates[inverse == label] for label in range(len(labels))]
+        rng = np.random.default_rng(seed)
+        chosen = []
+        remaining = n
+        groups.sort(key=len)
+        for position, group in enumerate(groups):
+            take = min(len(group), remaining // (len(groups) - position))
+            chosen.append(rng.choice(group, take, replace=False))
+            remaining -= take
+        return np.sort(np.concatenate(chosen)) if chosen else candidates[:0]
+
+    def take(self, rows):
+        """A new index holding only ``rows``."""
+        return FeatureIndex({name: self.column(name)[rows] for name in self.COLUMNS},
+                            self.features[rows], self.feature_names)
+
+    def save(self, path):
+        path = str(path)
+        tmp = f"{path}.tmp"
+        if path.endswith('.parquet'):
+            if pq is None:
+                raise ImportError("Writing a Parquet feature index needs pyarrow (pip install pyarrow)")
+            table = pa.table({**{name: self.column(name).tolist() for name in self.COLUMNS},
+                              **{name: self.features[:, column] for column, name in enumerate(self.feature_names)}})
+            table = table.replace_schema_metadata({'features_version': str(FEATURES_VERSION),
+                                                   'feature_names': json.dumps(self.feature_names)})
+            pq.write_table(table, tmp)
+        else:
+            with open(tmp, 'wb') as f:
+                np.savez_compressed(f, version=FEATURES_VERSION, feature_names=np.array(self.feature_names),
+                                    features=self.features, **{name: self.column(name) for name in self.COLUMNS})
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved index; returns None when it was built by another FEATURES_VERSION."""
+        path = str(path)
+        if path.endswith('.parquet'):
+            if pq is None:
+                raise ImportError("Reading a Parquet feature index needs pyarrow (pip install pyarrow)")
+            table = pq.read_table(path)
+            metadata = table.schema.metadata or {}
+            if int(metadata.get(b'features_version', 0)) != FEATURES_VERSION:
+                return None
+            feature_names = json.loads(metadata[b'feature_names'])
+            features = np.column_stack([table.column(name).to_numpy() for name in feature_names]) \
+                if len(table) else None
+            return cls({name: table.column(name).to_numpy() for name in cls.COLUMNS}, features, feature_names)
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != FEATURES_VERSION:
+                return None
+            return cls({name: data[name] for name in cls.COLUMNS}, data['features'],
+                       data['feature_names'].tolist())
+
+
+def build_index(root, previous=None, workers=1):
+    """Scan every JS file under ``root``; returns (FeatureIndex, number of files scanned).
+
+    Rows of ``previous`` whose file has the same size and mtime are reused, so
+    only new and changed files are read. The rest are scanned over
+    ``workers`` processes.
+    """
+    known = {}
+    if previous is not None and previous.feature_names == FEATURE_NAMES:
+        known = {path: row for row, path in enumerate(previous.path.tolist())}
+    files = sorted(iter_js_files(root))
+    rows = np.full(len(files), -1, dtype=np.int64)
+    stale = []
+    for position, (path, size, mtime_ns) in enumerate(files):
+        row = known.get(path)
+        if row is not None and previous.size[row] == size and previous.mtime_ns[row] == mtime_ns:
+            rows[position] = row
+        else:
+            stale.append(position)
+
+    features = np.zeros((len(files), len(FEATURE_NAMES)), dtype=np.uint32)
+    ids = np.empty(len(files), dtype=object)
+    reused = np.flatnonzero(rows >= 0)
+    if len(reused):
+        features[reused] = previous.features[rows[reused]]
+        ids[reused] = previous.source_id[rows[reused]]
+
+    paths = [os.path.join(root, files[position][0]) for position in stale]
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = pool.map(scan_file, paths, chunksize=max(1, min(256, len(paths) // (workers * 4))))
+            for position, (key, counts) in zip(stale, results):
+                ids[position], features[position] = key, counts
+    else:
+        for position, path in zip(stale, paths):
+            ids[position], features[position] = scan_file(path)
+
+    columns = {
+        'path': [path for path, _, _ in files],
+        'directory': [os.path.dirname(path) for path, _, _ in files],
+        'source_id': ids.astype(str) if len(files) else [],
+        'size': [size for _, size, _ in files],
+        'mtime_ns': [mtime_ns for _, _, mtime_ns in files],
+        'chart_type': [chart_type(counts) for counts in features],
+    }
+    return FeatureIndex(columns, features), len(stale)
+
+
+def index_path_for(gallery_root):
+    return Path(gallery_root) / INDEX_NAME
+
+
+def update_index(root, path=None, workers=1):
+    """Build or refresh the index saved at ``path`` (default: GALLERY/.d3_features.npz); returns (index, scanned)."""
+    path = path or index_path_for(root)
+    previous = FeatureIndex.load(path) if os.path.exists(path) else None
+    index, scanned = build_index(root, previous, workers)
+    index.save(path)
+    return index, scanned
+
+
+def add_sample_arguments(parser, default_index_help=None):
+    """Register the stratified-sampling flags shared by the training-data scripts."""
+    group = parser.add_argument_group('Stratified sampling')
+    group.add_argument('--features', metavar='INDEX',
+                       help='Feature index built by utils/d3_features.py'
+                            + (f' (default: {default_index_help})' if default_index_help else ''))
+    group.add_argument('--sample', type=int, metavar='N',
+                       help='Only use a stratified, balanced sample of N visualizations from the feature index')
+    group.add_argument('--stratify-by', choices=STRATA, default='chart_type',
+                       help='Strata balanced by --sample (default: chart_type)')
+    group.add_argument('--sample-seed', type=int, default=0, help='Random seed for --sample (default: 0)')
+    return group
+
+
+def index_from_args(args, default_path=None):
+    """Load the index --sample draws from, or return None when no sample was asked for."""
+    if getattr(args, 'sample', None) is None:
+        return None
+    path = args.features or default_path
+    if path is None:
+        sys.exit("--sample needs --features INDEX")
+    if not os.path.exists(path):
+        sys.exit(f"Feature index {path} not found; build it with utils/d3_features.py")
+    index = FeatureIndex.load(path)
+    if index is None:
+        sys.exit(f"Feature index {path} was built by another version; rebuild it with utils/d3_features.py")
+    return index
+
+
+def sample_from_args(args, index, mask=None, report=print):
+    """Rows of the stratified sample --sample asks for; reports how it splits over the strata."""
+    rows = index.sample(args.sample, by=args.stratify_by, seed=args.sample_seed, mask=mask)
+    candidates = len(index) if mask is None else int(mask.sum())
+    counts = index.take(rows).counts(args.stratify_by)
+    split = ', '.join(f"{label or '(root)'} {total}" for label, total in sorted(counts.items()))
+    report(f"Sampled {len(rows)} of {candidates} by {args.stratify_by}: {split}")
+    return rows
+
+
+def format_summary(index, by='chart_type', top=None):
+    lines = [f"{by:<20} {'files':>8}"]
+    for label, total in index.counts(by).most_common(top):
+        lines.append(f"{label or '(root)':<20} {total:>8,}")
+    if len(index):
+        used = (index.features > 0).mean(axis=0)
+        ranked = sorted(zip(index.feature_names, used), key=lambda item: -item[1])
+        lines.append("\nFiles using each feature:")
+        lines.extend(f"{name:<20} {share:>8.1%}" for name, share in ranked if share)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a D3 feature index of a gallery for stratified sampling')
+    parser.add_argument('gallery_dir', help='Directory of visualizations, scanned recursively for JS files')
+    parser.add_argument('--output', '-o', help=f'Index file, .npz or .parquet (default: GALLERY_DIR/{INDEX_NAME})')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1,
+                        help='Processes scanning JS files (default: one per CPU)')
+    parser.add_argument('--by', choices=STRATA, default='chart_type', help='Strata to summarize and sample by')
+    parser.add_argument('--sample', type=int, metavar='N', help='Print a stratified, balanced sample of N files')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for --sample (default: 0)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        index, scanned = update_index(args.gallery_dir, args.output, args.workers)
+    except ImportError as e:
+        sys.exit(str(e))
+    print(f"Indexed {len(index):,} JS files ({scanned:,} scanned) in {time.perf_counter() - start:.2f}s "
+          f"to {args.output or index_path_for(args.gallery_dir)}")
+    print(format_summary(index, args.by))
+    if args.sample is not None:
+        rows = index.sample(args.sample, by=args.by, seed=args.seed)
+        print(f"\nSample of {len(rows)} files:")
+        labels = index.strata(args.by)
+        for row in rows:
+            print(f"{labels[row]:<12} {index.path[row]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import csv
+import sys
+import json
+import argparse
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+# Bump when report contents change so incremental runs re-analyze.
+PROFILER_VERSION = 'profiler-1'
+
+# Files larger than this are profiled with the bounded-memory streaming profiler.
+STREAMING_THRESHOLD_BYTES = 64 * 1024 ** 2
+
+MAX_SAMPLE_ROWS = 3
+MAX_ARRAY_ITEMS = 3
+MAX_STRUCTURE_DEPTH = 6
+
+_NUMBER_RE = re.compile(r'\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?\s*$')
+_INT_RE = re.compile(r'\s*[-+]?\d+\s*$')
+_DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}$')
+_DATETIME_RE = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?$')
+_NULL_STRINGS = {'', 'null', 'NULL', 'NaN', 'nan', 'NA', 'N/A', 'None'}
+
+
+def _string_kind(value):
+    if _INT_RE.match(value):
+        return 'int'
+    if _NUMBER_RE.match(value):
+        return 'float'
+    if _DATE_RE.match(value):
+        return 'date'
+    if _DATETIME_RE.match(value):
+        return 'datetime'
+    if value.lower() in ('true', 'false'):
+        return 'bool'
+    return 'str'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    text = repr(value) if isinstance(value, str) else str(value)
+    return text if len(text) <= 40 else text[:37] + '...'
+
+
+def profile_string_column(values):
+    """Profile a column of raw strings (CSV/TSV cells)."""
+    column = np.asarray(values, dtype=object)
+    total = len(column)
+    is_null = np.isin(column, list(_NULL_STRINGS))
+    present = column[~is_null].astype(str)
+    profile = {'count': total, 'nulls': int(is_null.sum())}
+    if not len(present):
+        profile.update(type='empty', distinct=0)
+        return profile
+
+    uniques, counts = np.unique(present, return_counts=True)
+    profile['distinct'] = len(uniques)
+    profile['top'] = [(str(uniques[i]), int(counts[i])) for i in np.argsort(-counts, kind='stable')[:3]]
+
+    # Fast path: the whole column converts to float in one vectorized call.
+    try:
+        numbers = present.astype(np.float64)
+        has_fraction = (np.char.find(uniques, '.') >= 0) | (np.char.find(np.char.lower(uniques), 'e') >= 0)
+        kinds = {'float'} if has_fraction.any() else {'int'}
+    except ValueError:
+        numbers = None
+        # Classify distinct values only; gallery columns are highly repetitive.
+        kind_per_unique = np.array([_string_kind(value) for value in uniques], dtype=object)
+        kinds = set(kind_per_unique)
+        numeric_mask = np.isin(kind_per_unique, ['int', 'float'])
+        if numeric_mask.any():
+            numeric_values = np.repeat(uniques[numeric_mask].astype(np.float64), counts[numeric_mask])
+            profile.update(_numeric_stats(numeric_values))
+
+    if numbers is not None:
+        profile.update(_numeric_stats(numbers))
+    elif 'min' not in profile:
+        profile['min'] = str(uniques[0])
+        profile['max'] = str(uniques[-1])
+
+    profile['type'] = next(iter(kinds)) if len(kinds) == 1 else f"mixed ({', '.join(sorted(kinds))})"
+    return profile
+
+
+def _numeric_stats(numbers):
+    finite = numbers[np.isfinite(numbers)]
+    if not len(finite):
+        return {}
+    return {
+        'min': float(finite.min()),
+        'max': float(finite.max()),
+        'mean': float(finite.mean()),
+        'std': float(finite.std()),
+    }
+
+
+def _python_kind(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'null' if value != value else 'float'
+    if isinstance(value, str):
+        return 'str'
+    if isinstance(value, dict):
+        return 'object'
+    if isinstance(value, list):
+        return 'array'
+    return type(value).__name__
+
+
+def profile_value_column(values):
+    """Profile a column of parsed JSON values."""
+    total = len(values)
+    kinds = np.array([_python_kind(value) for value in values], dtype=object)
+    is_null = kinds == 'null'
+    profile = {'count': total, 'nulls': int(is_null.sum())}
+    present_kinds = set(kinds[~is_null])
+    if not present_kinds:
+        profile.update(type='empty', distinct=0)
+        return profile
+
+    if present_kinds <= {'str'}:
+        strings = [value for value, kind in zip(values, kinds) if kind == 'str']
+        profile.update({key: value for key, value in profile_string_column(strings).items()
+                        if key not in ('count', 'nulls')})
+        # Strings that merely look numeric are still strings in JSON.
+        if profile['type'] in ('int', 'float'):
+            profile['type'] = f"str ({profile['type']}-like)"
+        return profile
+
+    numeric_mask = np.isin(kinds, ['int', 'float'])
+    if numeric_mask.any():
+        numbers = np.array([values[i] for i in np.flatnonzero(numeric_mask)], dtype=np.float64)
+        profile.update(_numeric_stats(numbers))
+
+    hashable = [value for value, kind in zip(values, kinds) if kind not in ('null', 'object', 'array')]
+    if hashable and len(hashable) == total - profile['nulls']:
+        # Keyed by kind too: 1, 1.0 and True are equal (and hash alike) in Python but distinct in JSON.
+        counter = Counter((kind, value) for value, kind in zip(values, kinds)
+                          if kind not in ('null', 'object', 'array'))
+        profile['distinct'] = len(counter)
+        profile['top'] = [(_format_value(value), count) for (_, value), count in counter.most_common(3)]
+    else:
+        profile['distinct'] = 'n/a'
+
+    profile['type'] = next(iter(present_kinds)) if len(present_kinds) == 1 \
+        else f"mixed ({', '.join(sorted(present_kinds))})"
+    return profile
+
+
+def records_to_columns(records):
+    """Turn a list of objects into ordered columns, filling missing keys with None."""
+    columns = {}
+    for record in records:
+        for key in record:
+            if key not in columns:
+                columns[key] = None
+    return {key: [record.get(key) for record in records] for key in columns}
+
+
+def describe_structure(data, indent=0, depth=0):
+    """Outline nested JSON the way report_data does, sampling a few array items."""
+    prefix = ' ' * indent
+    if depth >= MAX_STRUCTURE_DEPTH:
+        return f"{prefix}...\n"
+    if isinstance(data, dict):
+        lines = f"{prefix}Object ({len(data)} keys)\n"
+        for key, value in data.items():
+            lines += f"{prefix}  {key}:\n"
+            lines += describe_structure(value, indent + 4, depth + 1)
+        return lines
+    if isinstance(data, list):
+        lines = f"{prefix}Array (length: {len(data)})\n"
+        for i, item in enumerate(data[:MAX_ARRAY_ITEMS]):
+            lines += f"{prefix}  Item {i}:\n"
+            lines += describe_structure(item, indent + 4, depth + 1)
+        if len(data) > MAX_ARRAY_ITEMS:
+            lines += f"{prefix}  ... ({len(data) - MAX_ARRAY_ITEMS} more items)\n"
+        return lines
+    sample = f" (example: {data!r})" if isinstance(data, (str, int, float, bool)) else ""
+    return f"{prefix}{type(data).__name__}{sample}\n"
+
+
+def format_columns(columns, profiles):
+    lines = [f"Number of Columns: {len(columns)}", f"Column Names: {', '.join(map(str, columns))}",
+             "", "Field Summary:", "-" * 50]
+    for name, profile in zip(columns, profiles):
+        parts = [f"type={profile['type']}", f"nulls={profile['nulls']:,}", f"distinct={profile['distinct']}"]
+        if 'min' in profile:
+            parts.append(f"min={_format_value(profile['min'])}")
+            parts.append(f"max={_format_value(profile['max'])}")
+        if 'mean' in profile:
+            parts.append(f"mean={profile['mean']:.6g}")
+        if profile.get('top') and profile['type'] not in ('int', 'float'):
+            parts.append("top=" + ', '.join(f"{value} ({count})" for value, count in profile['top']))
+        lines.append(f"{name}: {'; '.join(parts)}")
+    return lines
+
+
+def profile_table(header, rows, title):
+    """Profile header + string rows from a delimited file."""
+    width = len(header)
+    columns = [[row[i] if i < len(row) else '' for row in rows] for i in range(width)]
+    profiles = [profile_string_column(column) for column in columns]
+    lines = [title, "=" * 50, f"Number of Rows (excluding headers): {len(rows):,}"]
+    lines += format_columns(header, profiles)
+    lines += ["", "Sample Rows:", "-" * 50]
+    lines += [f"Row {i}: {row}" for i, row in enumerate(rows[:MAX_SAMPLE_ROWS])]
+    return '\n'.join(lines)
+
+
+def _record_table_lines(records):
+    columns = records_to_columns(records)
+    profiles = [profile_value_column(values) for values in columns.values()]
+    lines = [f"Number of Records: {len(records):,}"]
+    lines += format_columns(list(columns), profiles)
+    lines += ["", "Sample Rows:", "-" * 50]
+    lines += [f"Row {i}: {json.dumps(record, default=str)[:200]}" for i, record in enumerate(records[:MAX_SAMPLE_ROWS])]
+    return lines
+
+
+def profile_records(data, title="Inline Data Analysis"):
+    """Profile already-parsed JSON-like data (inline literals, inferred samples, loaded files)."""
+    lines = [title, "=" * 50]
+
+    if isinstance(data, list):
+        lines.append(f"Root Array Length: {len(data)}")
+        if data and all(isinstance(item, dict) for item in data):
+            lines += _record_table_lines(data)
+        elif data and not any(isinstance(item, (dict, list)) for item in data):
+            profile = profile_value_column(data)
+            lines += format_columns(['value'], [profile])
+    elif isinstance(data, dict):
+        lines.append(f"Root Keys: {', '.join(map(str, data.keys()))}")
+        if data.get('type') == 'FeatureCollection' and isinstance(data.get('features'), list):
+            features = data['features']
+            geometry_types = Counter((feature.get('geometry') or {}).get('type') for feature in features
+                                     if isinstance(feature, dict))
+            lines.append(f"GeoJSON Features: {len(features):,}")
+            lines.append("Geometry Types: " + ', '.join(f"{kind} ({count})" for kind, count in geometry_types.most_common()))
+            properties = [feature.get('properties') or {} for feature in features if isinstance(feature, dict)]
+            if properties:
+                lines += ["", "Feature Properties:"]
+                lines += _record_table_lines(properties)
+        else:
+            for key, value in data.items():
+                if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+                    lines += ["", f"Records under '{key}':"]
+                    lines += _record_table_lines(value)
+
+    lines += ["", "Detailed Structure:", "-" * 50, describe_structure(data)]
+    return '\n'.join(lines)
+
+
+def profile_file(path, stream=None):
+    """Profile a JSON, CSV or TSV file on disk.
+
+    ``stream`` forces (True) or disables (False) the streaming profiler; by
+    default it is used for files above STREAMING_THRESHOLD_BYTES.
+    """
+    name = os.path.basename(path)
+    ext = os.path.splitext(path)[1].lower()
+    size = os.path.getsize(path)
+
+    if stream or (stream is None and size > STREAMING_THRESHOLD_BYTES):
+        # Imported lazily: stream_profiler builds on this module's helpers.
+        from utils.stream_profiler import stream_profile_file
+        return stream_profile_file(path)
+
+    if ext in ('.csv', '.tsv'):
+        delimiter = '\t' if ext == '.tsv' else ','
+        with open(path, 'r', newline='') as f:
+            # Blank lines are not rows, as with csv.DictReader.
+            reader = (row for row in csv.reader(f, delimiter=delimiter) if row)
+            header = next(reader, None) or []
+            rows = list(reader)
+        kind = 'TSV' if delimiter == '\t' else 'CSV'
+        report = profile_table(header, rows, f"{kind} File Analysis: {name}")
+    else:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        report = profile_records(data, f"JSON File Analysis: {name}")
+
+    title, rule, rest = report.split('\n', 2)
+    return '\n'.join([title, rule, f"File Size: {size:,} bytes", rest])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile JSON, CSV or TSV data files in-process')
+    parser.add_argument('input_files', nargs='+', help='Files to profile')
+    parser.add_argument('--stream', action='store_true', default=None, help='Always use the bounded-memory streaming profiler')
+    args = parser.parse_args()
+    for path in args.input_files:
+        print(profile_file(path, stream=args.stream))
+        print()
+
+
+if __name__ == "__main__":
+    main()
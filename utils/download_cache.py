@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import hashlib
+import threading
+import tempfile
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.http_client import get_downloader
+from utils.analysis_manifest import sha256_file
+from utils.instrumentation import count
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "d3_gallery_downloads")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+UNCACHED_SUFFIX = '.uncached'
+
+
+def guess_extension(url):
+    """Pick the file extension report tooling expects for a data URL."""
+    return '.csv' if 'csv' in url.lower() else '.json'
+
+
+class DownloadCache:
+    """Persistent on-disk cache for remote data sources, keyed by URL.
+
+    Entries are revalidated with ETag/Last-Modified at most once per run (or, with
+    ``revalidate_after``, only once they were last validated that many seconds
+    ago), evicted least-recently-used first once the cache grows past
+    ``max_bytes``, and served without touching the network at all in offline mode.
+
+    Paths returned by fetch() are leased: eviction leaves them alone until the
+    caller hands them back with release(). A body larger than ``max_bytes`` is
+    not cached; it is returned as a temporary file that release() deletes.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, offline=False, downloader=None,
+                 revalidate_after=None):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.revalidate_after = revalidate_after
+        self.downloader = downloader or get_downloader()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._init_locks()
+
+    def _init_locks(self):
+        self._lock = threading.Lock()
+        self._url_locks = {}
+        self._fresh = set()  # URLs already validated during this run
+        self._leases = {}  # body path -> callers that have not released it yet
+        self._uncached = {}  # URL -> temporary body too large to cache
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'evicted': 0}
+
+    def __getstate__(self):
+        # Locks cannot cross process boundaries; each worker gets its own.
+        state = self.__dict__.copy()
+        for key in ('_lock', '_url_locks', '_fresh', '_leases', '_uncached', 'stats'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_locks()
+
+    def key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def body_path(self, url):
+        return self.cache_dir / f"{self.key(url)}{guess_extension(url)}"
+
+    def meta_path(self, url):
+        return self.cache_dir / f"{self.key(url)}.meta.json"
+
+    def _url_lock(self, url):
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def _read_meta(self, url):
+        try:
+            with open(self.meta_path(url), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, url, meta):
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.meta_path(url))
+
+    def _validated_recently(self, meta):
+        if self.revalidate_after is None:
+            return False
+        validated = meta.get('validated_at') or meta.get('fetched_at') or 0
+        return time.time() - validated < self.revalidate_after
+
+    def _touch(self, path):
+        """Record an access so LRU eviction keeps recently used entries."""
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _lease(self, path):
+        path = str(path)
+        with self._lock:
+            self._leases[path] = self._leases.get(path, 0) + 1
+        return path
+
+    def release(self, path):
+        """Hand back a path returned by fetch() so eviction may remove it again."""
+        path = str(path)
+        with self._lock:
+            remaining = self._leases.get(path, 0) - 1
+            if remaining > 0:
+                self._leases[path] = remaining
+                return
+            self._leases.pop(path, None)
+            for url, uncached in list(self._uncached.items()):
+                if uncached == path:
+                    del self._uncached[url]
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+
+    def _count(self, stat):
+        self.stats[stat] += 1
+        count(f"download cache {stat}")
+
+    def fetch(self, url):
+        """Return a local path holding the body of ``url``, downloading only if needed.
+
+        Pass the path to release() once it has been read.
+        """
+        with self._url_lock(url):
+            if url in self._uncached:
+                self._count('hits')
+                return self._lease(self._uncached[url])
+            body = self.body_path(url)
+            meta = self._read_meta(url)
+            # Leased while checked, so a concurrent evict() cannot remove it before it is returned.
+            with self._lock:
+                cached = body.exists() and meta is not None
+                if cached:
+                    self._leases[str(body)] = self._leases.get(str(body), 0) + 1
+
+            if cached and (self.offline or url in self._fresh or self._validated_recently(meta)):
+                self._count('hits')
+                self._touch(body)
+                return str(body)
+
+            if self.offline:
+                print(f"Offline mode: {url} is not cached")
+                self._count('misses')
+                return None
+
+            headers = {}
+            if cached:
+                if meta.get('etag'):
+                    headers['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'):
+                    headers['If-Modified-Since'] = meta['last_modified']
+
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            os.close(fd)
+            try:
+                response = self.downloader.download(url, tmp, headers=headers)
+            except Exception as e:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                if cached:
+                    print(f"Could not revalidate {url}, using cached copy: {str(e)}")
+                    self._count('hits')
+                    return str(body)
+                raise
+
+            if response.status_code == 304:
+                os.unlink(tmp)
+                self._write_meta(url, dict(meta, validated_at=time.time()))
+                self._count('revalidated')
+                self._touch(body)
+                self._fresh.add(url)
+                return str(body)
+
+            size = os.path.getsize(tmp)
+            if self.max_bytes and size > self.max_bytes:
+                # Caching it would evict everything else and then itself.
+                if cached:
+                    self.release(body)
+                with self._lock:
+                    # Another caller may still be reading the old body.
+                    stale = [self.meta_path(url)] + ([body] if str(body) not in self._leases else [])
+                for path in stale:
+                    try:
+                        path.unlink()
+                    except OSError:
+                        pass
+                print(f"{url} is {size:,} bytes, over the {self.max_bytes:,} byte cache limit; not caching it")
+                # Keep the extension report tooling picks the format by.
+                fd, uncached = tempfile.mkstemp(dir=self.cache_dir, suffix=UNCACHED_SUFFIX + guess_extension(url))
+                os.close(fd)
+                os.replace(tmp, uncached)
+                self._uncached[url] = uncached
+                self._count('misses')
+                return self._lease(uncached)
+
+            if not cached:
+                self._lease(body)
+            os.replace(tmp, body)
+            self._write_meta(url, {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'size': size,
+                'sha256': sha256_file(body),
+                'fetched_at': time.time(),
+            })
+            self._count('misses')
+            self._fresh.add(url)
+
+        self.evict()
+        return str(body)
+
+    def content_hash(self, url):
+        """sha256 of the body of ``url``, or None when it cannot be fetched.
+
+        A cached entry's recorded hash is trusted without a network round trip
+        unless ``revalidate_after`` is set and has passed since it was last
+        validated; then, and for URLs not cached, the body is fetched first.
+        """
+        meta = self._read_meta(url)
+        if (meta and meta.get('sha256') and url not in self._uncached and self.body_path(url).exists()
+                and (self.revalidate_after is None or self.offline or url in self._fresh
+                     or self._validated_recently(meta))):
+            return meta['sha256']
+        try:
+            path = self.fetch(url)
+        except Exception:
+            return None
+        if path is None:
+            return None
+        try:
+            meta = self._read_meta(url) if url not in self._uncached else None
+            return (meta or {}).get('sha256') or sha256_file(path)
+        finally:
+            self.release(path)
+
+    def entries(self):
+        """List cached bodies as (path, size, last_access) tuples."""
+        entries = []
+        for path in self.cache_dir.iterdir():
+            if path.suffix in ('.tmp',) or path.name.endswith('.meta.json') or UNCACHED_SUFFIX in path.suffixes:
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Drop least-recently-used entries until the cache fits in ``max_bytes``.
+
+        Leased bodies are kept, even if that leaves the cache over the limit for now.
+        """
+        if not self.max_bytes:
+            return
+        with self._lock:
+            entries = sorted(self.entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                if str(path) in self._leases:
+                    continue
+                meta = path.with_name(path.name[:64] + '.meta.json')
+                for victim in (path, meta):
+                    try:
+                        victim.unlink()
+                    except OSError:
+                        pass
+                total -= size
+                self._count('evicted')
+
+    def clear(self):
+        for path in self.cache_dir.iterdir():
+            path.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or manage the dataUrl download cache')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Cache directory')
+    parser.add_argument('--clear', action='store_true', help='Remove every cached download')
+    parser.add_argument('--max-mb', type=float, help='Evict entries until the cache fits in this many MB')
+    args = parser.parse_args()
+
+    cache = DownloadCache(args.cache_dir, max_bytes=int(args.max_mb * 1024 ** 2) if args.max_mb else None)
+    if args.clear:
+        cache.clear()
+    elif args.max_mb:
+        cache.evict()
+
+    entries = cache.entries()
+    print(f"Cache directory: {cache.cache_dir}")
+    print(f"Entries: {len(entries)}")
+    print(f"Total size: {sum(size for _, size, _ in entries):,} bytes")
+
+
+if __name__ == "__main__":
+    main()
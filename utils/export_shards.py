@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import time
+import bisect
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to byte-level tokens
+    tiktoken = None
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.jsonl_io import iter_records
+from utils.rate_limit import estimate_tokens
+from utils.source_store import example_source, load_sources, source_id, sources_path_for
+
+SHARDS_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+SPLITS = ('train', 'validation')
+BYTE_ENCODING = 'bytes'
+DEFAULT_ENCODING = 'o200k_base' if tiktoken is not None else BYTE_ENCODING
+# Target tokens per shard; shards end between half and twice this.
+SHARD_TOKENS = 1 << 24
+VAL_FRACTION = 0.05
+
+_SHARD_FILE = re.compile(r'(?:train|validation)-[0-9a-f]{16}\.(?:tokens|index)\.npy$')
+
+
+class Tokenizer:
+    """Text to token IDs with a tiktoken encoding, or UTF-8 bytes for ``'bytes'``.
+
+    Every sequence ends with ``eos``; byte-level IDs put it just past the
+    256 byte values.
+    """
+
+    def __init__(self, name=DEFAULT_ENCODING):
+        self.name = name
+        if name == BYTE_ENCODING:
+            self._encoding = None
+            self.eos = 256
+            self.vocab_size = 257
+        else:
+            if tiktoken is None:
+                raise ImportError(f"The {name} encoding needs tiktoken (pip install tiktoken); "
+                                  f"use --encoding {BYTE_ENCODING} without it")
+            self._encoding = tiktoken.get_encoding(name)
+            self.eos = self._encoding.eot_token
+            self.vocab_size = self._encoding.n_vocab
+        self.dtype = np.dtype(np.uint16 if self.vocab_size <= 1 << 16 else np.uint32)
+
+    def estimate(self, text):
+        """Cheap token count, used to size shards without tokenizing."""
+        return len(text) if self._encoding is None else estimate_tokens(text)
+
+    def encode(self, text):
+        if self._encoding is None:
+            return np.frombuffer(text.encode('utf-8'), dtype=np.uint8).astype(self.dtype)
+        return np.array(self._encoding.encode_ordinary(text), dtype=self.dtype)
+
+
+def example_key(prompt, completion):
+    """Content hash of one training example."""
+    digest = hashlib.sha256(prompt.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(completion.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def split_group(record):
+    """Source ID an example's split is decided by.
+
+    Refined records carry the refined reply as ``output`` next to the
+    original source (``source_id``, or its code as ``original_output``);
+    every refinement of one source must land in the same split, so the
+    reply is only hashed for unrefined inline data.
+    """
+    if record.get('source_id'):
+        return record['source_id']
+    if 'original_output' in record:
+        return source_id(record['original_output'])
+    return source_id(record.get('output', ''))
+
+
+def split_of(group, val_fraction, seed=0):
+    """Split for every example of ``group`` (a source ID): the same on every export, whatever else changes."""
+    if not val_fraction:
+        return 'train'
+    draw = int(hashlib.sha256(f"{seed}:{group}".encode('utf-8')).hexdigest()[:15], 16) / 16 ** 15
+    return 'validation' if draw < val_fraction else 'train'
+
+
+def pack_rows(lengths, pack_length):
+    """Assign sequences to rows of ``pack_length`` tokens (best fit, longest first); returns each one's row."""
+    rows = np.empty(len(lengths), dtype=np.int64)
+    free = []   # sorted (space left, row)
+    count = 0
+    for index in sorted(range(len(lengths)), key=lambda i: (-lengths[i], i)):
+        length = lengths[index]
+        position = bisect.bisect_left(free, (length, -1))
+        if position < len(free):
+            space, row = free.pop(position)
+        else:
+            space, row = pack_length, count
+            count += 1
+        rows[index] = row
+        if space - length:
+            bisect.insort(free, (space - length, row))
+    return rows
+
+
+_tokenizer = None
+
+
+def _write_shard(directory, name, examples, encoding, pack_length):
+    """Tokenize ``examples`` ((prompt, completion) pairs) and write a shard's two arrays.
+
+    ``NAME.tokens.npy`` holds the token IDs end to end, or ``rows x
+    pack_length`` padded with EOS when packing. ``NAME.index.npy`` holds a
+    (start, prompt end, end) row of token offsets per example, in token
+    order; tokens from prompt end to end are the completion and its EOS.
+    Examples longer than ``pack_length`` are cut to fit.
+    """
+    global _tokenizer
+    if _tokenizer is None or _tokenizer.name != encoding:
+        _tokenizer = Tokenizer(encoding)
+    eos = np.array([_tokenizer.eos], dtype=_tokenizer.dtype)
+    sequences = []
+    prompt_lengths = []
+    truncated = 0
+    for prompt, completion in examples:
+        prompt_tokens = _tokenizer.encode(prompt)
+        sequence = np.concatenate([prompt_tokens, _tokenizer.encode(completion), eos])
+        if pack_length and len(sequence) > pack_length:
+            sequence = sequence[:pack_length]
+            truncated += 1
+        sequences.append(sequence)
+        prompt_lengths.append(min(len(prompt_tokens), len(sequence)))
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+
+    if pack_length:
+        rows = pack_rows(lengths.tolist(), pack_length)
+        order = np.lexsort((np.arange(len(rows)), rows))
+        tokens = np.full((int(rows.max()) + 1 if len(rows) else 0, pack_length), _tokenizer.eos,
+                         dtype=_tokenizer.dtype)
+        starts = np.empty(len(order), dtype=np.int64)
+        filled = np.zeros(len(tokens), dtype=np.int64)
+        for position, index in enumerate(order):
+            row = rows[index]
+            tokens[row, filled[row]:filled[row] + lengths[index]] = sequences[index]
+            starts[position] = row * pack_length + filled[row]
+            filled[row] += lengths[index]
+    else:
+        order = np.arange(len(sequences))
+        tokens = np.concatenate(sequences) if sequences else np.empty(0, dtype=_tokenizer.dtype)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]) if len(lengths) else lengths
+    index = np.column_stack([starts, starts + np.array(prompt_lengths, dtype=np.int64)[order],
+                             starts + lengths[order]]).astype(np.int64)
+
+    for suffix, array in (('tokens', tokens), ('index', index)):
+        path = Path(directory) / f"{name}.{suffix}.npy"
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+    return {'tokens': int(lengths.sum()), 'rows': len(tokens) if pack_length else None, 'truncated': truncated}
+
+
+class _Chunker:
+    """Cuts one split's example stream into shards at content-defined boundaries.
+
+    Whether a shard ends after an example depends only on that example's key
+    and the size of the shard so far, so inserting or removing an example
+    moves the boundaries of its own shard and at most the next one; every
+    other shard keeps its examples and its name.
+    """
+
+    def __init__(self, split, shard_tokens, estimate):
+        self.split = split
+        self.estimate = estimate
+        self.shard_tokens = shard_tokens
+        self.examples = []
+        self.keys = []
+        self.size = 0
+
+    def add(self, key, prompt, completion):
+        """Add an example; returns True when the shard should end after it."""
+        size = self.estimate(prompt) + self.estimate(completion)
+        self.examples.append((prompt, completion))
+        self.keys.append(key)
+        self.size += size
+        if self.size >= 2 * self.shard_tokens:
+            return True
+        return self.size >= self.shard_tokens // 2 and int(key[:8], 16) / 16 ** 8 < 2 * size / self.shard_tokens
+
+    def take(self):
+        examples, keys = self.examples, self.keys
+        self.examples, self.keys, self.size = [], [], 0
+        return examples, keys
+
+
+def load_manifest(directory):
+    """The manifest of an export directory, or None when there is none of this SHARDS_VERSION."""
+    try:
+        with open(Path(directory) / MANIFEST_NAME) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('version') == SHARDS_VERSION else None
+
+
+def export_shards(input_file, output_dir, sources_file=None, encoding=DEFAULT_ENCODING, val_fraction=VAL_FRACTION,
+                  split_seed=0, shard_tokens=SHARD_TOKENS, pack_length=None, workers=1):
+    """Tokenize the training examples of ``input_file`` into memory-mapped shards under ``output_dir``.
+
+    Each example is a prompt (``input``) and completion (``output``, inline or
+    by ``source_id``); ones flagged ``valid: false`` by js_validate.py are
+    left out. Every source goes to the train or validation split as a whole,
+    by a hash of its ID and ``split_seed``. A shard is named after a hash of
+    its examples and the export settings, and one that already exists is kept
+    rather than tokenized again; the rest are tokenized over ``workers``
+    processes, and shards no longer listed are deleted. Returns a Counter of
+    examples, tokens and shards written, reused and removed.
+    """
+    tokenizer = Tokenizer(encoding)
+    directory = Path(output_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    previous = load_manifest(directory) or {'shards': []}
+    existing = {shard['name']: shard for shard in previous['shards']
+                if all((directory / f"{shard['name']}.{suffix}.npy").exists() for suffix in ('tokens', 'index'))}
+    settings = json.dumps([SHARDS_VERSION, encoding, pack_length]).encode('utf-8')
+    sources = load_sources(sources_file) if sources_file else None
+
+    stats = Counter()
+    shards = []
+    pending = {}
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+
+    def close(chunker):
+        examples, keys = chunker.take()
+        digest = hashlib.sha256(settings)
+        for key in keys:
+            digest.update(key.encode('ascii'))
+        name = f"{chunker.split}-{digest.hexdigest()[:16]}"
+        shard = {'name': name, 'split': chunker.split, 'examples': len(examples)}
+        shards.append(shard)
+        if name in existing:
+            shard.update((field, existing[name][field]) for field in ('tokens', 'rows', 'truncated'))
+            stats['shards reused'] += 1
+            return
+        stats['shards written'] += 1
+        if pool is None:
+            shard.update(_write_shard(directory, name, examples, encoding, pack_length))
+            return
+        while len(pending) >= 2 * workers:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future).update(future.result())
+        pending[pool.submit(_write_shard, directory, name, examples, encoding, pack_length)] = shard
+
+    try:
+        chunkers = {split: _Chunker(split, shard_tokens, tokenizer.estimate) for split in SPLITS}
+        for record in iter_records(input_file):
+            if record.get('valid') is False:
+                stats['invalid skipped'] += 1
+                continue
+            prompt = record.get('input') or ''
+            completion = example_source(record, sources)
+            if not prompt.strip() or not completion.strip():
+                stats['empty skipped'] += 1
+                continue
+            key = example_key(prompt, completion)
+            chunker = chunkers[split_of(split_group(record), val_fraction, split_seed)]
+            stats[f'{chunker.split} examples'] += 1
+            if chunker.add(key, prompt, completion):
+                close(chunker)
+        for chunker in chunkers.values():
+            if chunker.examples:
+                close(chunker)
+        for future in pending:
+            pending[future].update(future.result())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    for shard in shards:
+        stats[f"{shard['split']} tokens"] += shard['tokens']
+        stats['truncated'] += shard['truncated']
+    manifest = {'version': SHARDS_VERSION, 'encoding': encoding, 'eos': tokenizer.eos,
+                'vocab_size': tokenizer.vocab_size, 'dtype': tokenizer.dtype.name, 'pack_length': pack_length,
+                'val_fraction': val_fraction, 'split_seed': split_seed, 'shards': shards}
+    tmp = directory / f"{MANIFEST_NAME}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, directory / MANIFEST_NAME)
+
+    keep = {f"{shard['name']}.{suffix}.npy" for shard in shards for suffix in ('tokens', 'index')}
+    for path in directory.iterdir():
+        if _SHARD_FILE.match(path.name) and path.name not in keep:
+            path.unlink()
+            stats['files removed'] += 1
+    return stats
+
+
+class TokenShards:
+    """One split of an export, memory-mapped: opening it reads only the manifest.
+
+    ``shards[i]`` is ``(tokens, prompt_length)`` for example ``i``: the prompt
+    tokens, then the completion ending in EOS. Packed exports also expose
+    ``row(r)``, a ``pack_length`` window of tokens with a segment ID per
+    token (0 for padding, then 1, 2, ... per example in the row).
+    """
+
+    def __init__(self, directory, split='train'):
+        self.manifest = load_manifest(directory)
+        if self.manifest is None:
+            raise FileNotFoundError(f"No version {SHARDS_VERSION} export in {directory}")
+        self.pack_length = self.manifest['pack_length']
+        self.eos = self.manifest['eos']
+        self._tokens = []
+        self._index = []
+        for shard in self.manifest['shards']:
+            if shard['split'] == split and shard['examples']:
+                self._tokens.append(np.load(Path(directory) / f"{shard['name']}.tokens.npy", mmap_mode='r'))
+                self._index.append(np.load(Path(directory) / f"{shard['name']}.index.npy", mmap_mode='r'))
+        self._example_ends = np.cumsum([len(index) for index in self._index], dtype=np.int64)
+        self._row_ends = np.cumsum([len(tokens) for tokens in self._tokens], dtype=np.int64) \
+            if self.pack_length else None
+
+    def __len__(self):
+        return int(self._example_ends[-1]) if len(self._example_ends) else 0
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        i %= len(self)
+        shard = int(np.searchsorted(self._example_ends, i, side='right'))
+        start, prompt_end, end = self._index[shard][i - (self._example_ends[shard - 1] if shard else 0)]
+        return self._tokens[shard].reshape(-1)[start:end], int(prompt_end - start)
+
+    @property
+    def num_rows(self):
+        if not self.pack_length:
+            raise ValueError("The export is not packed (export with --pack LENGTH)")
+        return int(self._row_ends[-1]) if len(self._row_ends) else 0
+
+    def row(self, r):
+        """Tokens and segment IDs of packed row ``r``."""
+        if not 0 <= r < self.num_rows:
+            raise IndexError(r)
+        shard = int(np.searchsorted(self._row_ends, r, side='right'))
+        r -= int(self._row_ends[shard - 1]) if shard else 0
+        index = self._index[shard]
+        lo = int(np.searchsorted(index[:, 0], r * self.pack_length))
+        hi = int(np.searchsorted(index[:, 0], (r + 1) * self.pack_length))
+        segments = np.zeros(self.pack_length, dtype=np.int32)
+        for segment, (start, _, end) in enumerate(index[lo:hi], 1):
+            segments[start - r * self.pack_length:end - r * self.pack_length] = segment
+        return self._tokens[shard][r], segments
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tokenize training data into memory-mapped train/validation shards')
+    parser.add_argument('input', help='Training data (JSON array or JSON lines)')
+    parser.add_argument('output_dir', help='Directory for the shards and manifest.json (re-exports update it in place)')
+    parser.add_argument('--sources', help='Sources file for examples that reference code by source_id '
+                                          '(default: INPUT with a .sources suffix, if present)')
+    parser.add_argument('--encoding', default=DEFAULT_ENCODING,
+                        help=f"tiktoken encoding, or '{BYTE_ENCODING}' for UTF-8 byte tokens (default: {DEFAULT_ENCODING})")
+    parser.add_argument('--val-fraction', type=float, default=VAL_FRACTION,
+                        help=f'Share of sources held out for validation (default: {VAL_FRACTION})')
+    parser.add_argument('--split-seed', type=int, default=0, help='Seed of the train/validation split (default: 0)')
+    parser.add_argument('--shard-tokens', type=int, default=SHARD_TOKENS,
+                        help=f'Target tokens per shard (default: {SHARD_TOKENS:,})')
+    parser.add_argument('--pack', type=int, metavar='LENGTH',
+                        help='Pack examples into rows of LENGTH tokens, cutting longer ones to fit')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1,
+                        help='Processes tokenizing shards (default: one per CPU)')
+    args = parser.parse_args()
+
+    sources_file = args.sources
+    if sources_file is None and os.path.exists(sources_path_for(args.input)):
+        sources_file = sources_path_for(args.input)
+    start = time.perf_counter()
+    try:
+        stats = export_shards(args.input, args.output_dir, sources_file, args.encoding, args.val_fraction,
+                              args.split_seed, args.shard_tokens, args.pack, args.workers)
+    except (ImportError, ValueError) as e:
+        sys.exit(str(e))
+    print(f"Exported to {args.output_dir} in {time.perf_counter() - start:.2f}s "
+          f"({args.encoding} tokens{f', packed into rows of {args.pack}' if args.pack else ''})")
+    for split in SPLITS:
+        print(f"  {split:<12} {stats[f'{split} examples']:>10,} examples {stats[f'{split} tokens']:>14,} tokens")
+    print(f"  shards: {stats['shards written']} written, {stats['shards reused']} unchanged, "
+          f"{stats['files removed'] // 2} removed")
+    for name in ('invalid skipped', 'empty skipped', 'truncated'):
+        if stats[name]:
+            print(f"  {name}: {stats[name]:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,101 @@
 #!/usr/bin/env python
 
 import os
+import sys
 import json
+import argparse
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.jsonl_io import RecordWriter
+from utils.source_store import SourceWriter, sources_path_for
+from utils.catalog import add_catalog_arguments, catalog_from_args
+from utils.d3_features import add_sample_arguments, index_from_args, index_path_for, sample_from_args
+
 D3_GALLERY_PATH = "/home/juke/t5d3/root_resources/d3_gallery_downloads"
 OUTPUT_FILE = "./d3_training_data.json"
 
-def generate_training_data():
-    training_data = []
+def iter_visualizations(gallery_path=D3_GALLERY_PATH, catalog=None, selection=None):
+    """Yield (directory, JS file) for every visualization that has queries.json.
 
-    for subdir in Path(D3_GALLERY_PATH).iterdir():
+    ``selection``, a set of directories such as a stratified sample, limits
+    it to those, without listing the rest of the gallery.
+    """
+    if catalog is not None:
+        for subdir in catalog.find(has=['queries.json']):
+            js_file = catalog.primary_js(subdir) if selection is None or subdir in selection else None
+            if js_file is not None:
+                yield subdir, js_file
+        return
+    for subdir in sorted(selection) if selection is not None else Path(gallery_path).iterdir():
         if subdir.is_dir():
-            queries_file = subdir / 'queries.json'
             js_files = list(subdir.glob('*.js'))
-            if queries_file.exists() and js_files:
-                with open(queries_file, 'r') as qf:
-                    queries = json.load(qf).get('queries', [])
-                js_content = js_files[0].read_text()
+            if (subdir / 'queries.json').exists() and js_files:
+                yield subdir, js_files[0]
+
+def iter_training_examples(gallery_path=D3_GALLERY_PATH, sources=None, catalog=None, selection=None):
+    """Yield one training example per generated query, a visualization at a time.
+
+    With a SourceWriter as ``sources`` each distinct visualization source is
+    stored there once and examples carry its ``source_id`` instead of the code.
+    With a GalleryCatalog the visualizations come from it instead of a walk of
+    the gallery; ``selection`` restricts them as in iter_visualizations().
+    """
+    for subdir, js_file in iter_visualizations(gallery_path, catalog, selection):
+        with open(subdir / 'queries.json', 'r') as qf:
+            queries = json.load(qf).get('queries', [])
+        js_content = js_file.read_text()
+        reference = {"output": js_content}
+        if sources is not None and queries:
+            reference = {"source_id": sources.add(js_content, name=subdir.name)}
+
+        for query in queries:
+            yield {
+                "input": query['query'],
+                "instruct": "",
+                **reference
+            }
+
+def generate_training_data(gallery_path=D3_GALLERY_PATH, output_file=OUTPUT_FILE, sources_file=None, catalog=None,
+                           selection=None):
+    """Stream the training examples to ``output_file`` (a JSON array, or JSON lines for .jsonl).
+
+    With ``sources_file`` the code is deduplicated into that file and
+    examples reference it by ``source_id``.
+    """
+    if sources_file is None:
+        with RecordWriter(output_file) as writer:
+            return writer.write_all(iter_training_examples(gallery_path, catalog=catalog, selection=selection))
+    with SourceWriter(sources_file) as sources, RecordWriter(output_file) as writer:
+        count = writer.write_all(iter_training_examples(gallery_path, sources, catalog, selection))
+    print(f"Stored {sources.count} unique sources for {sources.references} visualizations in {sources_file}")
+    return count
 
-                for query in queries:
-                    training_data.append({
-                        "input": query['query'],
-                        "instruct": "",
-                        "output": js_content
-                    })
+def main():
+    parser = argparse.ArgumentParser(description='Pair generated queries with their visualization code')
+    parser.add_argument('--gallery-dir', '-d', default=D3_GALLERY_PATH, help='Directory containing D3 visualizations')
+    parser.add_argument('--output', '-o', default=OUTPUT_FILE,
+                        help=f'Training data file; .jsonl writes JSON lines (default: {OUTPUT_FILE})')
+    parser.add_argument('--dedupe-sources', nargs='?', const='', metavar='SOURCES',
+                        help='Store each visualization\'s code once in SOURCES (default: OUTPUT with a .sources '
+                             'suffix) and reference it from examples by source_id')
+    add_catalog_arguments(parser)
+    add_sample_arguments(parser, default_index_help='GALLERY_DIR/.d3_features.npz')
+    args = parser.parse_args()
 
-    with open(OUTPUT_FILE, 'w') as outfile:
-        json.dump(training_data, outfile, indent=2)
+    sources_file = None
+    if args.dedupe_sources is not None:
+        sources_file = args.dedupe_sources or sources_path_for(args.output)
+    catalog = catalog_from_args(args, args.gallery_dir)
+    selection = None
+    index = index_from_args(args, index_path_for(args.gallery_dir))
+    if index is not None:
+        # One row per visualization, among those that have queries to pair with.
+        mask = index.first_per('directory', index.with_file(args.gallery_dir, 'queries.json'))
+        rows = sample_from_args(args, index, mask)
+        selection = {Path(args.gallery_dir) / directory for directory in index.directory[rows].tolist()}
+    count = generate_training_data(args.gallery_dir, args.output, sources_file, catalog, selection)
+    print(f"Wrote {count} training examples to {args.output}")
 
 if __name__ == "__main__":
-    generate_training_data()
+    main()
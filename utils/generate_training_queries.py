@@ -1,22 +1,59 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import json
+import asyncio
 import argparse
+from collections import Counter
 from pathlib import Path
 import openai
 import logging
 
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.batch_jobs import BatchRun, add_batch_arguments, backend_from_args
+from utils.catalog import add_catalog_arguments, catalog_from_args
+from utils.instrumentation import (add_instrumentation_arguments, count, get_instrumentation, instrumented_run,
+                                   record_usage, span)
+from utils.jsonl_io import RecordWriter
+from utils.llm_cache import add_cache_arguments, cache_from_args
+from utils.llm_response import (PARSE_RETRIES, QUERIES_SCHEMA, ResponseFormatError, add_json_mode_argument,
+                                format_stats, parse_json, response_format)
+from utils.prompt_builder import add_prompt_arguments, builder_from_args
+from utils.rate_limit import AsyncRateLimiter, estimate_tokens
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Files besides the JS that feed the prompt; queries.json is stale once any of them changes.
+CONTEXT_FILES = ('data_report.txt', 'inferred_data_report.txt', 'explanation.txt')
+# Completion tokens budgeted per request when enforcing a tokens-per-minute limit.
+EXPECTED_COMPLETION_TOKENS = 300
+
+
 class TrainingDataGenerator:
-    def __init__(self, api_key=None):
-        """Initialize with OpenAI API key. If not provided, will try to get from environment."""
+    def __init__(self, api_key=None, cache=None, prompt_builder=None, base_url=None, json_mode=True, catalog=None):
+        """Initialize with OpenAI API key. If not provided, will try to get from environment.
+
+        ``cache`` is an optional LLMCache consulted before every request, and
+        ``prompt_builder`` an optional PromptBuilder that fits each prompt to a token budget.
+        ``base_url`` points the async client at an OpenAI-compatible endpoint
+        such as a local mock server (defaults to OPENAI_BASE_URL). ``json_mode``
+        asks the API for a JSON object reply. With a GalleryCatalog as
+        ``catalog`` the JS file and freshness checks come from it instead of the tree.
+        """
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OpenAI API key must be provided or set in OPENAI_API_KEY environment variable")
         openai.api_key = self.api_key
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        if base_url:
+            openai.base_url = base_url.rstrip('/') + '/'
+        self.cache = cache
+        self.prompt_builder = prompt_builder
+        self.json_mode = json_mode
+        self.catalog = catalog
+        self.parse_stats = Counter()
 
     def read_file_if_exists(self, file_path):
         """Read file content if it exists, return empty string otherwise."""
@@ -28,18 +65,21 @@ class TrainingDataGenerator:
 
     def get_visualization_context(self, viz_dir):
         """Gather context from a visualization directory."""
-        js_files = list(Path(viz_dir).glob('*.js'))
-        if not js_files:
-            return None
-
-        js_file = js_files[0]  # Take the first JS file
+        if self.catalog is not None:
+            js_file = self.catalog.primary_js(viz_dir)
+            if js_file is None:
+                return None
+        else:
+            js_files = list(Path(viz_dir).glob('*.js'))
+            if not js_files:
+                return None
+            js_file = js_files[0]  # Take the first JS file
         viz_name = viz_dir.name
 
         # Read various context files
         js_content = self.read_file_if_exists(js_file)
-        data_report = self.read_file_if_exists(viz_dir / 'data_report.txt')
-        inferred_report = self.read_file_if_exists(viz_dir / 'inferred_data_report.txt')
-        explanation = self.read_file_if_exists(viz_dir / 'explanation.txt')
+        data_report, inferred_report, explanation = (self.read_file_if_exists(viz_dir / name)
+                                                     for name in CONTEXT_FILES)
 
         # Use inferred report if no data report available
         report = data_report if data_report else inferred_report
@@ -51,8 +91,10 @@ class TrainingDataGenerator:
             'explanation': explanation
         }
 
-    def generate_queries(self, context, temperature=0):
-        """Generate natural language queries that would lead to this visualization."""
+    def build_messages(self, context):
+        """Chat messages asking for queries about the visualization in ``context``."""
+        if self.prompt_builder is not None:
+            context = self.prompt_builder.fit_context(context)
         prompt = f"""
 You are an expert in data visualization and D3.js. Your task is to generate 5 natural language queries that users might ask to create a visualization based on the provided context. The queries should reflect realistic goals a user might have when working with data and designing visualizations.
 
@@ -88,29 +130,235 @@ Respond in the following JSON format:
     ]
 }}"""
 
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an expert in data visualization and D3.js."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temperature
-        )
+        return [
+            {"role": "system", "content": "You are an expert in data visualization and D3.js."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def parse_queries(self, content, name, cache_key=None):
+        """Parse (and if need be repair) the model's reply.
 
+        Returns None, dropping the cached reply, when it still is not a valid
+        list of queries.
+        """
         try:
-            content = response.choices[0].message.content
-            # Handle potential markdown code blocks
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            return json.loads(content)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse response for {context['name']}: {str(e)}")
-            logger.error(f"Raw response: {response.choices[0].message.content}")
+            return parse_json(content, QUERIES_SCHEMA, stats=self.parse_stats)
+        except ResponseFormatError as e:
+            logger.error(f"Failed to parse response for {name}: {str(e)}")
+            logger.error(f"Raw response: {content}")
+            if cache_key is not None:
+                self.cache.discard(cache_key)
             return None
 
+    def generate_queries(self, context, temperature=0):
+        """Generate natural language queries that would lead to this visualization."""
+        messages = self.build_messages(context)
+        for attempt in range(PARSE_RETRIES + 1):
+            if attempt:
+                count('parse retries')
+            cache_key = None
+            if self.cache is not None:
+                content, cache_key = self.cache.complete(openai, "gpt-4o", messages, temperature=temperature,
+                                                         **response_format(self.json_mode))
+            else:
+                with span('API call'):
+                    response = openai.chat.completions.create(
+                        model="gpt-4o",
+                        messages=messages,
+                        temperature=temperature,
+                        **response_format(self.json_mode)
+                    )
+                record_usage(response.usage)
+                content = response.choices[0].message.content
+            with span('parse'):
+                result = self.parse_queries(content, context['name'], cache_key)
+            if result is not None:
+                return result
+        return None
+
+    async def generate_queries_async(self, context, temperature=0, client=None, limiter=None, timer=None):
+        """Async variant of generate_queries sharing ``client`` and ``limiter`` across calls."""
+        timer = timer or get_instrumentation()
+        with timer.span('build prompt'):
+            messages = self.build_messages(context)
+        for attempt in range(PARSE_RETRIES + 1):
+            if attempt:
+                timer.count('parse retries')
+            cache_key = None
+            content = None
+            if self.cache is not None:
+                cache_key = self.cache.key("gpt-4o", messages, temperature=temperature, **response_format(self.json_mode))
+                content = self.cache.get(cache_key)
+            if content is None:
+                if limiter is not None:
+                    with timer.span('rate limit wait'):
+                        await limiter.acquire(sum(estimate_tokens(message['content']) for message in messages)
+                                              + EXPECTED_COMPLETION_TOKENS)
+                with timer.span('API call', viz=context['name']):
+                    response = await client.chat.completions.create(
+                        model="gpt-4o",
+                        messages=messages,
+                        temperature=temperature,
+                        **response_format(self.json_mode)
+                    )
+                timer.record_usage(response.usage)
+                content = response.choices[0].message.content
+                if cache_key is not None:
+                    self.cache.put(cache_key, content, model="gpt-4o")
+            with timer.span('parse'):
+                result = self.parse_queries(content, context['name'], cache_key)
+            if result is not None:
+                return result
+        return None
+
+    def is_up_to_date(self, viz_dir):
+        """True when ``queries.json`` is newer than every file the queries are generated from."""
+        if self.catalog is not None:
+            return self.catalog.is_current(viz_dir, 'queries.json', CONTEXT_FILES)
+        try:
+            generated = (viz_dir / 'queries.json').stat().st_mtime
+        except OSError:
+            return False
+        inputs = list(Path(viz_dir).glob('*.js')) + [viz_dir / name for name in CONTEXT_FILES]
+        return all(generated >= path.stat().st_mtime for path in inputs if path.exists())
+
+    async def generate_all(self, viz_dirs, concurrency=8, temperature=0, requests_per_minute=None,
+                           tokens_per_minute=None, force=False, timer=None):
+        """Generate queries for many visualization directories concurrently.
+
+        A reader task prefetches each directory's context files (in a thread)
+        into a bounded queue while up to ``concurrency`` workers call the API
+        and write ``queries.json`` as soon as their response arrives.
+        Directories whose queries are newer than their inputs are skipped
+        unless ``force``. Yields ``(viz_dir, status, detail)`` in completion
+        order, where status is "generated" (detail: the queries), "skipped",
+        "empty" (no JS file) or "failed" (detail: the exception, or None for
+        an unparseable reply).
+        """
+        timer = timer or get_instrumentation()
+        concurrency = max(1, concurrency)
+        limiter = None
+        if requests_per_minute or tokens_per_minute:
+            limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+        contexts = asyncio.Queue(maxsize=concurrency * 2)
+        results = asyncio.Queue()
+        done = object()
+
+        async def read_contexts():
+            try:
+                for viz_dir in viz_dirs:
+                    with timer.span('read context'):
+                        if not force and await asyncio.to_thread(self.is_up_to_date, viz_dir):
+                            await results.put((viz_dir, 'skipped', None))
+                            continue
+                        context = await asyncio.to_thread(self.get_visualization_context, viz_dir)
+                    if context is None:
+                        await results.put((viz_dir, 'empty', None))
+                    else:
+                        await contexts.put((viz_dir, context))
+            finally:
+                for _ in range(concurrency):
+                    await contexts.put(done)
+
+        async def work(client):
+            while (item := await contexts.get()) is not done:
+                viz_dir, context = item
+                try:
+                    result = await self.generate_queries_async(context, temperature, client, limiter, timer)
+                    if result:
+                        with timer.span('write queries'):
+                            await asyncio.to_thread(self.save_queries, result, viz_dir)
+                        await results.put((viz_dir, 'generated', result))
+                    else:
+                        await results.put((viz_dir, 'failed', None))
+                except Exception as e:
+                    await results.put((viz_dir, 'failed', e))
+            await results.put(done)
+
+        async with openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url) as client:
+            tasks = [asyncio.ensure_future(read_contexts())]
+            tasks += [asyncio.ensure_future(work(client)) for _ in range(concurrency)]
+            try:
+                running = concurrency
+                while running:
+                    item = await results.get()
+                    if item is done:
+                        running -= 1
+                    else:
+                        yield item
+                await tasks[0]
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    def generate_all_batch(self, viz_dirs, backend, workdir, poll_interval=30.0, temperature=0, force=False):
+        """Generate queries through batch jobs instead of live requests.
+
+        Each visualization without cached or up-to-date queries becomes one
+        request (``custom_id`` is the directory name) in a batch job; replies
+        go through parse_queries() as in generate_queries(). If ``workdir``
+        already records submitted jobs, the run re-attaches to them rather
+        than submitting again. Yields ``(viz_dir, status, detail)`` like
+        generate_all().
+        """
+        run = BatchRun(backend, workdir, poll_interval)
+        outstanding = {}
+
+        def requests():
+            for viz_dir in viz_dirs:
+                if not force and self.is_up_to_date(viz_dir):
+                    yield viz_dir, 'skipped', None
+                    continue
+                context = self.get_visualization_context(viz_dir)
+                if context is None:
+                    yield viz_dir, 'empty', None
+                    continue
+                messages = self.build_messages(context)
+                cache_key = None
+                if self.cache is not None:
+                    cache_key = self.cache.key("gpt-4o", messages, temperature=temperature, **response_format(self.json_mode))
+                    content = self.cache.get(cache_key)
+                    if content is not None:
+                        yield viz_dir, 'cached', self.parse_queries(content, context['name'], cache_key)
+                        continue
+                outstanding[viz_dir.name] = (viz_dir, cache_key)
+                yield viz_dir, 'request', {"model": "gpt-4o", "messages": messages, "temperature": temperature,
+                                           **response_format(self.json_mode)}
+
+        def finished(viz_dir, result):
+            if not result:
+                return viz_dir, 'failed', None
+            self.save_queries(result, viz_dir)
+            return viz_dir, 'generated', result
+
+        queued = []
+        for viz_dir, status, detail in requests():
+            if status == 'request':
+                queued.append((viz_dir.name, detail))
+            elif status == 'cached':
+                yield finished(viz_dir, detail)
+            else:
+                yield viz_dir, status, detail
+        if run.exists():
+            run.load()
+        else:
+            run.prepare(queued)
+            logger.info(f"Queued {len(queued)} requests for batch processing")
+
+        for custom_id, content, error in run.results():
+            if custom_id not in outstanding:
+                continue
+            viz_dir, cache_key = outstanding.pop(custom_id)
+            if error is not None:
+                yield viz_dir, 'failed', error
+                continue
+            if cache_key is not None:
+                self.cache.put(cache_key, content, model="gpt-4o")
+            yield finished(viz_dir, self.parse_queries(content, viz_dir.name, cache_key))
+        for viz_dir, _ in outstanding.values():
+            yield viz_dir, 'failed', "No result in batch output"
+        run.cleanup()
+
     def save_queries(self, queries, viz_dir):
         """Save queries to a JSON file in the visualization directory."""
         output_path = viz_dir / 'queries.json'
@@ -127,43 +375,97 @@ def main():
     parser.add_argument('--temperature', '-t', type=float, default=0.0,
                        help='OpenAI temperature parameter (default: 0.7)')
     parser.add_argument('--api-key', help='OpenAI API key (optional, can use OPENAI_API_KEY env var)')
+    parser.add_argument('--output', '-o',
+                        help='Also stream every visualization\'s queries into this file as they are generated '
+                             '(JSON array, or JSON lines for .jsonl)')
+    parser.add_argument('--base-url', help='OpenAI-compatible API base URL (optional, can use OPENAI_BASE_URL env var)')
+    parser.add_argument('--concurrency', '-c', type=int, default=8,
+                        help='Visualizations whose queries are generated concurrently (default: 8)')
+    parser.add_argument('--requests-per-minute', type=int, help='Client-side request rate limit')
+    parser.add_argument('--tokens-per-minute', type=int, help='Client-side token rate limit')
+    parser.add_argument('--force', action='store_true',
+                        help='Regenerate queries.json even when it is newer than the visualization files')
+    add_json_mode_argument(parser)
+    add_batch_arguments(parser, default_dir_help='GALLERY_DIR.queries.batch')
+    add_cache_arguments(parser)
+    add_prompt_arguments(parser)
+    add_catalog_arguments(parser)
+    add_instrumentation_arguments(parser)
     
     args = parser.parse_args()
 
-    generator = TrainingDataGenerator(api_key=args.api_key)
+    cache = cache_from_args(args)
+    prompt_builder = builder_from_args(args)
+    gallery_path = Path(args.gallery_dir)
+    catalog = catalog_from_args(args, gallery_path, report=logger.info)
+    generator = TrainingDataGenerator(api_key=args.api_key, cache=cache, prompt_builder=prompt_builder,
+                                      base_url=args.base_url, json_mode=not args.no_json_mode, catalog=catalog)
     failed_generations = []
     successful_generations = []
+    skipped_generations = []
+    writer = RecordWriter(args.output) if args.output else None
 
-    # Process each visualization directory
-    gallery_path = Path(args.gallery_dir)
-    for viz_dir in sorted(gallery_path.iterdir()):
-        if not viz_dir.is_dir():
-            continue
+    if catalog is not None:
+        viz_dirs = catalog.visualizations()
+    else:
+        viz_dirs = [viz_dir for viz_dir in sorted(gallery_path.iterdir()) if viz_dir.is_dir()]
 
-        logger.info(f"Processing {viz_dir.name}...")
-        context = generator.get_visualization_context(viz_dir)
-        if not context:
+    def handle(viz_dir, status, detail):
+        if status == 'empty':
             logger.warning(f"Skipping {viz_dir.name}: No visualization files found")
-            continue
-
-        result = generator.generate_queries(context, temperature=args.temperature)
-        if result:
-            # Save queries to the visualization directory
-            output_path = generator.save_queries(result, viz_dir)
+            return
+        if status == 'failed':
+            failed_generations.append(viz_dir.name)
+            logger.error(f"Failed to generate queries for {viz_dir.name}" + (f": {detail}" if detail else ""))
+            return
+        if status == 'skipped':
+            skipped_generations.append(viz_dir.name)
+            logger.debug(f"Skipping {viz_dir.name}: queries.json is up to date")
+            if writer is not None:
+                detail = json.loads((viz_dir / 'queries.json').read_text())
+        else:
             successful_generations.append(viz_dir.name)
-            logger.info(f"Generated {len(result['queries'])} queries for {viz_dir.name}")
-            logger.info(f"Saved queries to {output_path}")
+            logger.info(f"Generated {len(detail['queries'])} queries for {viz_dir.name}")
+        if writer is not None:
+            writer.write({'name': viz_dir.name, 'queries': detail.get('queries', [])})
+
+    async def run():
+        async for item in generator.generate_all(
+                viz_dirs, concurrency=args.concurrency, temperature=args.temperature,
+                requests_per_minute=args.requests_per_minute, tokens_per_minute=args.tokens_per_minute,
+                force=args.force):
+            handle(*item)
+
+    with instrumented_run(args, report=logger.info):
+        if args.batch is not None:
+            batch_dir = args.batch_dir or f"{str(gallery_path).rstrip('/')}.queries.batch"
+            backend = backend_from_args(args, batch_dir, generator.api_key)
+            for item in generator.generate_all_batch(viz_dirs, backend, batch_dir, args.poll_interval,
+                                                     temperature=args.temperature, force=args.force):
+                handle(*item)
         else:
-            failed_generations.append(viz_dir.name)
-            logger.error(f"Failed to generate queries for {viz_dir.name}")
+            asyncio.run(run())
+
+    if writer is not None:
+        writer.close()
+        logger.info(f"Wrote queries for {writer.count} visualizations to {args.output}")
 
     # Print summary
     logger.info("\nGeneration Summary:")
     logger.info(f"Successfully generated queries for {len(successful_generations)} visualizations")
+    if skipped_generations:
+        logger.info(f"Skipped {len(skipped_generations)} visualizations whose queries.json is up to date "
+                    f"(use --force to regenerate)")
     if failed_generations:
         logger.info(f"Failed to generate queries for {len(failed_generations)} visualizations:")
         for viz_name in failed_generations:
             logger.info(f"  - {viz_name}")
+    if cache is not None:
+        logger.info(cache.summary())
+    if generator.parse_stats:
+        logger.info(format_stats(generator.parse_stats))
+    if prompt_builder is not None:
+        logger.info("Prompt tokens:\n%s", prompt_builder.format_report(only_trimmed=True))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import threading
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.instrumentation import count, span
+
+DEFAULT_TIMEOUT = (10, 60)  # (connect, read) seconds
+DEFAULT_MAX_BYTES = 1024 ** 3  # 1 GB
+CHUNK_SIZE = 1024 * 1024
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class DownloadTooLarge(ValueError):
+    """Raised when a response body exceeds the configured size guard."""
+
+
+class StreamingDownloader:
+    """Shared, connection-pooled HTTP session that streams bodies straight to disk.
+
+    Connections are kept alive per host (``pool_maxsize`` caps concurrent
+    connections to any single host), idempotent requests are retried with
+    exponential backoff, and bodies larger than ``max_bytes`` are rejected
+    without being buffered in memory.
+    """
+
+    def __init__(self, pool_maxsize=8, pool_connections=32, retries=3, backoff_factor=0.5,
+                 timeout=DEFAULT_TIMEOUT, max_bytes=DEFAULT_MAX_BYTES, chunk_size=CHUNK_SIZE):
+        self.pool_maxsize = pool_maxsize
+        self.pool_connections = pool_connections
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._session = None
+
+    def __getstate__(self):
+        # Sessions and locks are per process; workers rebuild them lazily.
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        state['_session'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                self._session = self.create_session()
+            return self._session
+
+    def create_session(self):
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=True,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def download(self, url, dest_path, headers=None):
+        """Stream ``url`` into ``dest_path`` and return the response.
+
+        Nothing is written for a 304 response. On any error the partial file is removed.
+        """
+        written = 0
+        try:
+            with span('download', url=url), \
+                    self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code == 304:
+                    return response
+                response.raise_for_status()
+
+                declared = response.headers.get('Content-Length')
+                if self.max_bytes and declared and declared.isdigit() and int(declared) > self.max_bytes:
+                    raise DownloadTooLarge(f"{url} is {int(declared):,} bytes (limit {self.max_bytes:,})")
+
+                with open(dest_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        written += len(chunk)
+                        if self.max_bytes and written > self.max_bytes:
+                            raise DownloadTooLarge(f"{url} exceeded the {self.max_bytes:,} byte limit")
+                        f.write(chunk)
+        except BaseException:
+            try:
+                os.unlink(dest_path)
+            except OSError:
+                pass
+            raise
+
+        response.bytes_written = written
+        count('bytes downloaded', written)
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+_default_downloader = None
+_default_lock = threading.Lock()
+
+
+def get_downloader():
+    """Return the process-wide default downloader."""
+    global _default_downloader
+    with _default_lock:
+        if _default_downloader is None:
+            _default_downloader = StreamingDownloader()
+        return _default_downloader
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import pstats
+import asyncio
+import argparse
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# Trace events kept per process; stage totals and counters are always complete.
+DEFAULT_MAX_EVENTS = 200_000
+DEFAULT_TRACE_PATH = 'trace.json'
+DEFAULT_PROFILE_PATH = 'profile.pstats'
+
+
+class Instrumentation:
+    """Per-stage spans and counters for one pipeline run.
+
+    ``span(name)`` times a stage; ``count(name, amount)`` adds to a counter
+    such as bytes transferred, tokens or cache hits. Totals feed
+    ``format_report()``; the individual spans (up to ``max_events``) feed
+    ``write_trace()``, a Chrome trace (chrome://tracing or ui.perfetto.dev)
+    with one track per thread or asyncio task. Safe to share between threads
+    and tasks; process-pool workers ``drain()`` theirs and the parent
+    ``merge()``s it.
+    """
+
+    def __init__(self, max_events=DEFAULT_MAX_EVENTS):
+        self.max_events = max_events
+        self.started = time.perf_counter()
+        self._init_state()
+
+    def _init_state(self):
+        self._lock = threading.Lock()
+        # name -> [count, total seconds, max seconds]
+        self.stages = {}
+        self.counters = Counter()
+        self.events = []
+        self.dropped = 0
+        self._tracks = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _track(self):
+        """Trace track for the caller: its asyncio task if it has one, else its thread."""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = (threading.get_ident(), id(task) if task is not None else None)
+        tid = self._tracks.get(key)
+        if tid is None:
+            tid = self._tracks[key] = len(self._tracks) + 1
+            label = task.get_name() if task is not None else threading.current_thread().name
+            self._add_event({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                             'args': {'name': label}})
+        return tid
+
+    def _add_event(self, event):
+        if len(self.events) < self.max_events:
+            self.events.append(event)
+        else:
+            self.dropped += 1
+
+    @contextmanager
+    def span(self, name, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            elapsed = end - start
+            with self._lock:
+                stage = self.stages.get(name)
+                if stage is None:
+                    stage = self.stages[name] = [0, 0.0, 0.0]
+                stage[0] += 1
+                stage[1] += elapsed
+                stage[2] = max(stage[2], elapsed)
+                event = {'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': elapsed * 1e6,
+                         'pid': os.getpid(), 'tid': self._track()}
+                if args:
+                    event['args'] = args
+                self._add_event(event)
+
+    def count(self, name, amount=1):
+        if not amount:
+            return
+        with self._lock:
+            self.counters[name] += amount
+            self._add_event({'name': name, 'ph': 'C', 'ts': time.perf_counter() * 1e6, 'pid': os.getpid(),
+                             'args': {'value': self.counters[name]}})
+
+    def record_usage(self, usage):
+        """Count prompt and completion tokens from a chat completion's ``usage`` (object or dict)."""
+        if usage is None:
+            return
+        get = usage.get if isinstance(usage, dict) else lambda name: getattr(usage, name, None)
+        self.count('tokens in', get('prompt_tokens') or 0)
+        self.count('tokens out', get('completion_tokens') or 0)
+
+    def drain(self):
+        """Return everything recorded so far and start afresh (for process-pool workers)."""
+        with self._lock:
+            snapshot = {'stages': self.stages, 'counters': self.counters, 'events': self.events,
+                        'dropped': self.dropped}
+            self.stages = {}
+            self.counters = Counter()
+            self.events = []
+            self.dropped = 0
+            # Thread-name events went out with this snapshot; the next one re-emits them.
+            self._tracks = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add a worker's ``drain()`` snapshot to this run."""
+        if not snapshot:
+            return
+        with self._lock:
+            for name, (count, total, longest) in snapshot['stages'].items():
+                stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+                stage[0] += count
+                stage[1] += total
+                stage[2] = max(stage[2], longest)
+            self.counters.update(snapshot['counters'])
+            room = max(0, self.max_events - len(self.events))
+            self.events.extend(snapshot['events'][:room])
+            self.dropped += snapshot['dropped'] + max(0, len(snapshot['events']) - room)
+
+    def format_report(self):
+        """Stage timing table followed by the counters.
+
+        Stages of concurrent tasks overlap, so their totals can add up to more
+        than the elapsed time; the difference is the time concurrency saved.
+        """
+        elapsed = time.perf_counter() - self.started
+        lines = [f"{'stage':<28} {'count':>7} {'total':>9} {'mean':>9} {'max':>9}"]
+        for name, (count, total, longest) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<28} {count:>7} {total:>8.2f}s {total / count * 1000:>7.1f}ms "
+                         f"{longest * 1000:>7.1f}ms")
+        lines.append(f"{'elapsed':<28} {'':>7} {elapsed:>8.2f}s")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<28} {value:>17,}")
+        return '\n'.join(lines)
+
+    def write_trace(self, path):
+        """Write the spans and counters as Chrome trace JSON; returns the number of events."""
+        with self._lock:
+            events = [dict(event) for event in self.events]
+            counters = dict(self.counters)
+        origin = self.started * 1e6
+        for event in events:
+            if 'ts' in event:
+                event['ts'] = round(event['ts'] - origin, 3)
+            if 'dur' in event:
+                event['dur'] = round(event['dur'], 3)
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms',
+                 'otherData': {'counters': counters, 'dropped_events': self.dropped}}
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(trace, f)
+        os.replace(tmp, path)
+        return len(events)
+
+
+_current = Instrumentation()
+
+
+def get_instrumentation():
+    """Return the process-wide instrumentation every script records into."""
+    return _current
+
+
+def span(name, **args):
+    return _current.span(name, **args)
+
+
+def count(name, amount=1):
+    _current.count(name, amount)
+
+
+def record_usage(usage):
+    _current.record_usage(usage)
+
+
+def add_instrumentation_arguments(parser):
+    """Register the --trace/--profile flags shared by the pipeline scripts."""
+    group = parser.add_argument_group('Instrumentation')
+    group.add_argument('--trace', nargs='?', const=DEFAULT_TRACE_PATH, metavar='TRACE_JSON',
+                       help=f'Write a Chrome trace of every stage to TRACE_JSON (default: {DEFAULT_TRACE_PATH}); '
+                            f'open it in chrome://tracing or ui.perfetto.dev')
+    group.add_argument('--profile', nargs='?', const=DEFAULT_PROFILE_PATH, metavar='PSTATS',
+                       help=f'Run under cProfile (main thread only), save the stats to PSTATS '
+                            f'(default: {DEFAULT_PROFILE_PATH}) and print the top functions')
+    return group
+
+
+@contextmanager
+def instrumented_run(args, report=print):
+    """Run the body of a script's main(); report timings (and write the trace/profile) when it ends."""
+    instrumentation = get_instrumentation()
+    profiler = None
+    if getattr(args, 'profile', None):
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield instrumentation
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            report(f"cProfile stats saved to {args.profile}; top functions by cumulative time:")
+            pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(20)
+        report("Timing:\n" + instrumentation.format_report())
+        if getattr(args, 'trace', None):
+            events = instrumentation.write_trace(args.trace)
+            dropped = f" ({instrumentation.dropped} dropped)" if instrumentation.dropped else ""
+            report(f"Wrote {events} trace events{dropped} to {args.trace}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a Chrome trace written with --trace')
+    parser.add_argument('trace', help='Trace JSON file')
+    parser.add_argument('--top', type=int, default=10, help='Slowest individual spans to list (default: 10)')
+    args = parser.parse_args()
+
+    with open(args.trace) as f:
+        trace = json.load(f)
+    instrumentation = Instrumentation()
+    spans = [event for event in trace['traceEvents'] if event.get('ph') == 'X']
+    for event in spans:
+        stage = instrumentation.stages.setdefault(event['name'], [0, 0.0, 0.0])
+        stage[0] += 1
+        stage[1] += event['dur'] / 1e6
+        stage[2] = max(stage[2], event['dur'] / 1e6)
+    instrumentation.counters.update(trace.get('otherData', {}).get('counters', {}))
+    end = max((event['ts'] + event['dur'] for event in spans), default=0)
+    instrumentation.started = time.perf_counter() - end / 1e6
+    print(instrumentation.format_report())
+    print("\nSlowest spans:")
+    for event in sorted(spans, key=lambda event: -event['dur'])[:args.top]:
+        detail = ' '.join(f"{key}={value}" for key, value in (event.get('args') or {}).items())
+        print(f"{event['dur'] / 1000:>10.1f}ms  {event['name']:<28} {detail}")
+
+
+if __name__ == "__main__":
+    main()
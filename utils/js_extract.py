@@ -0,0 +1,608 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+import json
+import argparse
+
+# Bump when extraction results change so incremental runs re-analyze.
+EXTRACTOR_VERSION = 2
+
+# Token kinds
+IDENT = 'ident'
+NUM = 'num'
+STR = 'str'
+TEMPLATE = 'template'
+REGEX = 'regex'
+PUNCT = 'punct'
+
+LOADER_FUNCTIONS = {'csv', 'tsv', 'json', 'dsv', 'text', 'xml'}
+INLINE_DATA_NAME = re.compile(r'data\d*$')
+
+_TOKEN_PATTERN = re.compile(r'''
+    (?P<skip>(?:\s+|//[^\n]*|/\*.*?(?:\*/|\Z))+)
+  | (?P<num>0[xX][0-9a-fA-F_]+n?|0[oO][0-7_]+n?|0[bB][01_]+n?
+        |(?:\d[\d_]*(?:\.[\d_]*)?|\.\d[\d_]*)(?:[eE][+-]?\d+)?n?)
+  | (?P<ident>[A-Za-z_$\u0080-\uffff][\w$\u0080-\uffff]*)
+  | (?P<str>"(?:[^"\\\n]|\\.|\\\n)*"|'(?:[^'\\\n]|\\.|\\\n)*')
+  | (?P<punct>>>>=|\.\.\.|===|!==|\*\*=|<<=|>>=|>>>|=>|==|!=|<=|>=|&&=|\|\|=|\?\?=|&&|\|\||\?\?|\?\.
+        |\+\+|--|\+=|-=|\*=|%=|&=|\|=|\^=|\*\*|<<|>>|[{}()\[\];,<>+\-*%&|^!~?:=.@\#])
+''', re.VERBOSE | re.DOTALL)
+
+_REGEX_PATTERN = re.compile(r'/(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[A-Za-z]*')
+_TEMPLATE_CHUNK = re.compile(r'(?:[^`\\$]|\\.|\$(?!\{))*', re.DOTALL)
+_ESCAPE_PATTERN = re.compile(r'\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|\r\n|[\s\S])')
+_SIMPLE_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v', '0': '\0',
+                   '\n': '', '\r\n': '', '\r': '', '\u2028': '', '\u2029': ''}
+
+# After these tokens a '/' starts a regular expression rather than a division.
+_REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+                   'throw', 'case', 'do', 'else', 'yield', 'await'}
+
+
+class JSTokenizeError(ValueError):
+    pass
+
+
+class NotALiteral(ValueError):
+    """Raised when a token run is not a JSON-like JavaScript literal."""
+
+
+def _unescape(body):
+    def replace(match):
+        esc = match.group(1)
+        if esc[0] == 'u':
+            return chr(int(esc[2:-1] if esc[1] == '{' else esc[1:], 16))
+        if esc[0] == 'x' and len(esc) == 3:
+            return chr(int(esc[1:], 16))
+        return _SIMPLE_ESCAPES.get(esc, esc)
+    return _ESCAPE_PATTERN.sub(replace, body) if '\\' in body else body
+
+
+def _regex_allowed(prev):
+    if prev is None:
+        return True
+    kind, value = prev[0], prev[1]
+    if kind == PUNCT:
+        return value not in (')', ']', '}')
+    if kind == IDENT:
+        return value in _REGEX_KEYWORDS
+    return False
+
+
+def _scan_template(content, pos):
+    """Scan a template literal starting at the backtick at ``pos``.
+
+    Returns (end, raw_text, has_substitutions). Substitutions may nest braces,
+    strings and further templates.
+    """
+    end = len(content)
+    i = pos + 1
+    has_subs = False
+    while i < end:
+        i = _TEMPLATE_CHUNK.match(content, i).end()
+        if i >= end:
+            break
+        ch = content[i]
+        if ch == '`':
+            return i + 1, content[pos + 1:i], has_subs
+        if ch == '\\':
+            # Dangling backslash at end of input
+            i += 2
+            continue
+        # ch == '$' followed by '{'
+        has_subs = True
+        depth = 1
+        i += 2
+        prev = (PUNCT, '{')
+        while i < end and depth:
+            token_end, token = _next_token(content, i, prev)
+            if token is not None:
+                if token[0] == PUNCT:
+                    if token[1] == '{':
+                        depth += 1
+                    elif token[1] == '}':
+                        depth -= 1
+                prev = token
+            i = token_end
+    raise JSTokenizeError(f"Unterminated template literal at offset {pos}")
+
+
+def _next_token(content, pos, prev):
+    """Return (end, token) for the token at ``pos``; token is None for whitespace/comments."""
+    ch = content[pos]
+    if ch == '`':
+        end, raw, has_subs = _scan_template(content, pos)
+        return end, (TEMPLATE, raw, pos, has_subs)
+    if ch == '/' and content[pos + 1:pos + 2] not in ('/', '*') and _regex_allowed(prev):
+        match = _REGEX_PATTERN.match(content, pos)
+        if match:
+            return match.end(), (REGEX, match.group(), pos)
+    if ch == '/':
+        if content.startswith('/=', pos) and not _regex_allowed(prev):
+            return pos + 2, (PUNCT, '/=', pos)
+        if content[pos + 1:pos + 2] not in ('/', '*'):
+            return pos + 1, (PUNCT, '/', pos)
+
+    match = _TOKEN_PATTERN.match(content, pos)
+    if not match:
+        # Unknown character (e.g. stray unicode punctuation); skip it.
+        return pos + 1, None
+    kind = match.lastgroup
+    if kind == 'skip':
+        return match.end(), None
+    return match.end(), (kind, match.group(), pos)
+
+
+def tokenize(content, strict=True):
+    """Tokenize JavaScript source in a single linear pass.
+
+    Whitespace and comments are dropped. Tokens are tuples of
+    ``(kind, text, offset)``; template tokens carry a fourth element telling
+    whether they contain ``${}`` substitutions. In strict mode unterminated
+    strings and templates and stray characters raise JSTokenizeError; with
+    ``strict=False`` stray characters are skipped and an unterminated
+    template ends tokenization.
+    """
+    tokens = []
+    append = tokens.append
+    match = _TOKEN_PATTERN.match
+    pos = 0
+    end = len(content)
+    prev = None
+    while pos < end:
+        ch = content[pos]
+        if ch != '/' and ch != '`':
+            # Fast path: everything except regex/division and templates is context free.
+            m = match(content, pos)
+            if m is None:
+                if strict:
+                    what = "Unterminated string literal" if ch in '"\'' else f"Unexpected character {ch!r}"
+                    raise JSTokenizeError(f"{what} at offset {pos}")
+                pos += 1
+                continue
+            kind = m.lastgroup
+            pos = m.end()
+            if kind != 'skip':
+                prev = (kind, m.group(), m.start())
+                append(prev)
+            continue
+        try:
+            pos, token = _next_token(content, pos, prev)
+        except JSTokenizeError:
+            if strict:
+                raise
+            break
+        if token is not None:
+            append(token)
+            prev = token
+    return tokens
+
+
+def _number(text):
+    text = text.replace('_', '')
+    if text.endswith('n'):
+        text = text[:-1]
+    lower = text.lower()
+    if lower.startswith('0x'):
+        return int(text, 16)
+    if lower.startswith('0o'):
+        return int(text[2:], 8)
+    if lower.startswith('0b'):
+        return int(text[2:], 2)
+    if any(c in lower for c in '.e'):
+        return float(text)
+    return int(text)
+
+
+def string_value(token):
+    """Return the Python string for a string or substitution-free template token, else None."""
+    if token[0] == STR:
+        return _unescape(token[1][1:-1])
+    if token[0] == TEMPLATE and not token[3]:
+        return _unescape(token[1])
+    return None
+
+
+_CONSTANTS = {'true': True, 'false': False, 'null': None, 'undefined': None,
+              'NaN': float('nan'), 'Infinity': float('inf')}
+
+
+def parse_literal(tokens, i):
+    """Convert the literal starting at ``tokens[i]`` to a Python value.
+
+    Handles nested arrays/objects, quoted and bare keys, trailing commas,
+    comments (already dropped by the tokenizer) and substitution-free template
+    strings. Returns ``(value, next_index)``; raises NotALiteral otherwise.
+    """
+    if i >= len(tokens):
+        raise NotALiteral("Unexpected end of input")
+    kind, text = tokens[i][0], tokens[i][1]
+
+    if kind == PUNCT and text == '[':
+        items = []
+        i += 1
+        while True:
+            if i >= len(tokens):
+                raise NotALiteral("Unterminated array")
+            if tokens[i][0] == PUNCT and tokens[i][1] == ']':
+                return items, i + 1
+            if tokens[i][0] == PUNCT and tokens[i][1] == ',':
+                # Elision, e.g. [1,,2]
+                items.append(None)
+                i += 1
+                continue
+            value, i = parse_literal(tokens, i)
+            items.append(value)
+            if i < len(tokens) and tokens[i][0] == PUNCT and tokens[i][1] == ',':
+                i += 1
+            elif not (i < len(tokens) and tokens[i][0] == PUNCT and tokens[i][1] == ']'):
+                raise NotALiteral(f"Unexpected token in array at offset {_offset(tokens, i)}")
+
+    if kind == PUNCT and text == '{':
+        obj = {}
+        i += 1
+        while True:
+            if i >= len(tokens):
+                raise NotALiteral("Unterminated object")
+            kind, text = tokens[i][0], tokens[i][1]
+            if kind == PUNCT and text == '}':
+                return obj, i + 1
+            if kind == IDENT:
+                key = text
+            elif kind == NUM:
+                key = str(_number(text))
+            else:
+                key = string_value(tokens[i])
+                if key is None:
+                    raise NotALiteral(f"Unsupported object key at offset {tokens[i][2]}")
+            i += 1
+            if i >= len(tokens) or tokens[i][0] != PUNCT or tokens[i][1] != ':':
+                raise NotALiteral(f"Expected ':' at offset {_offset(tokens, i)}")
+            obj[key], i = parse_literal(tokens, i + 1)
+            if i < len(tokens) and tokens[i][0] == PUNCT and tokens[i][1] == ',':
+                i += 1
+            elif not (i < len(tokens) and tokens[i][0] == PUNCT and tokens[i][1] == '}'):
+                raise NotALiteral(f"Unexpected token in object at offset {_offset(tokens, i)}")
+
+    if kind == PUNCT and text in ('-', '+') and i + 1 < len(tokens) and (
+            tokens[i + 1][0] == NUM or (tokens[i + 1][0] == IDENT and tokens[i + 1][1] in ('Infinity', 'NaN'))):
+        value = _number(tokens[i + 1][1]) if tokens[i + 1][0] == NUM else _CONSTANTS[tokens[i + 1][1]]
+        return (-value if text == '-' else value), i + 2
+    if kind == NUM:
+        return _number(text), i + 1
+    if kind == IDENT and text in _CONSTANTS:
+        return _CONSTANTS[text], i + 1
+    value = string_value(tokens[i])
+    if value is not None:
+        return value, i + 1
+    raise NotALiteral(f"Not a literal value at offset {tokens[i][2]}")
+
+
+def _offset(tokens, i):
+    return tokens[i][2] if i < len(tokens) else 'end of input'
+
+
+def _is(token, kind, text=None):
+    return token[0] == kind and (text is None or token[1] == text)
+
+
+_SCAN_PATTERN = re.compile(r"""["'`/]|(?<![\w$.])(?:dataUrl|d3|fetch|data\d*)(?![\w$])""")
+_STRING_PATTERN = re.compile(r""""(?:[^"\\\n]|\\.|\\\n)*"|'(?:[^'\\\n]|\\.|\\\n)*'""")
+_WORD_BEFORE = re.compile(r'[\w$]+$')
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _regex_allowed_at(content, pos):
+    """Decide from the raw text before ``pos`` whether a '/' there starts a regex."""
+    i = pos - 1
+    while i >= 0 and content[i].isspace():
+        i -= 1
+    if i < 0:
+        return True
+    ch = content[i]
+    if ch in ')]}':
+        return False
+    if ch.isalnum() or ch in '_$':
+        word = _WORD_BEFORE.search(content, max(0, i - 15), i + 1)
+        return bool(word) and word.group() in _REGEX_KEYWORDS
+    return True
+
+
+_STRUCTURE_PATTERN = re.compile(r'["\'`/{}()\[\]]')
+
+
+def scan_structure(content):
+    """The brackets of JavaScript source, found in one pass that skips over everything else.
+
+    Returns ``(brackets, literals)``: ``brackets`` lists ``(char, offset)`` for
+    every bracket outside strings, templates, regexes and comments, and
+    ``literals`` the ``(start, end)`` span of each of those. Only the
+    characters that can open one are looked at, so this is much faster than
+    tokenize(). Raises JSTokenizeError for an unterminated string, template
+    literal or block comment.
+    """
+    brackets = []
+    literals = []
+    search = _STRUCTURE_PATTERN.search
+    end = len(content)
+    pos = 0
+    while True:
+        match = search(content, pos)
+        if match is None:
+            return brackets, literals
+        start = match.start()
+        ch = content[start]
+        pos = start + 1
+        if ch in '"\'':
+            string = _STRING_PATTERN.match(content, start)
+            if string is None:
+                raise JSTokenizeError(f"Unterminated string literal at offset {start}")
+            pos = string.end()
+        elif ch == '`':
+            pos = _scan_template(content, start)[0]
+        elif ch == '/':
+            following = content[start + 1:start + 2]
+            if following == '/':
+                newline = content.find('\n', start)
+                pos = end if newline < 0 else newline
+            elif following == '*':
+                close = content.find('*/', start + 2)
+                if close < 0:
+                    raise JSTokenizeError(f"Unterminated comment at offset {start}")
+                pos = close + 2
+            elif _regex_allowed_at(content, start):
+                regex = _REGEX_PATTERN.match(content, start)
+                if regex is None:
+                    continue
+                pos = regex.end()
+            else:
+                continue
+        else:
+            brackets.append((ch, start))
+            continue
+        literals.append((start, pos))
+
+
+# Inline literals that are JSON apart from JavaScript-only syntax are rewritten
+# to JSON and decoded in C: bare keys get quoted, single-quoted and template
+# strings re-encoded, comments and trailing commas dropped.
+_LITERAL_PATTERN = re.compile(r'''(?=["'`/A-Za-z_$,\[\]{}])(?:
+    (?P<key>[A-Za-z_$][\w$]*(?=\s*:))
+  | (?P<open>[\[{])
+  | (?P<close>[\]}])
+  | (?P<str>"(?:[^"\\\n]|\\.|\\\n)*")
+  | (?P<quoted>'(?:[^'\\\n]|\\.|\\\n)*'|`(?:[^`\\$]|\\.|\$(?!\{))*`)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<undefined>undefined(?![\w$]))
+  | (?P<comma>,(?=\s*[\]}])))
+''', re.VERBOSE | re.DOTALL)
+
+
+def _decode_js_literal(content, start):
+    """Decode the array or object literal at ``start`` by rewriting it to JSON.
+
+    Returns ``(value, end)``, or None when the literal uses anything the
+    rewrite does not cover (elisions, hex numbers, expressions, ...); the
+    caller then falls back to the tokenizer and parse_literal().
+    """
+    pieces = []
+    append = pieces.append
+    last = start
+    depth = 0
+    for m in _LITERAL_PATTERN.finditer(content, start):
+        kind = m.lastgroup
+        if kind == 'open':
+            depth += 1
+            continue
+        if kind == 'close':
+            depth -= 1
+            if depth == 0:
+                break
+            continue
+        if kind == 'str':
+            continue
+        token_start, token_end = m.span()
+        append(content[last:token_start])
+        last = token_end
+        if kind == 'key':
+            append(f'"{content[token_start:token_end]}"')
+        elif kind == 'quoted':
+            append(json.dumps(_unescape(content[token_start + 1:token_end - 1])))
+        elif kind == 'undefined':
+            append('null')
+        elif kind == 'comment':
+            append(' ')
+    else:
+        return None
+    end = m.end()
+    append(content[last:end])
+    try:
+        return json.loads(''.join(pieces)), end
+    except ValueError:
+        return None
+
+
+def iter_tokens(content, pos, prev=None):
+    """Lazily yield tokens starting at ``pos``."""
+    end = len(content)
+    match = _TOKEN_PATTERN.match
+    while pos < end:
+        ch = content[pos]
+        if ch != '/' and ch != '`':
+            # Same fast path as tokenize().
+            m = match(content, pos)
+            if m is not None:
+                pos = m.end()
+                if m.lastgroup != 'skip':
+                    prev = (m.lastgroup, m.group(), m.start())
+                    yield prev
+                continue
+        pos, token = _next_token(content, pos, prev)
+        if token is not None:
+            prev = token
+            yield token
+
+
+def _take_tokens(content, pos, count):
+    tokens = []
+    for token in iter_tokens(content, pos):
+        tokens.append(token)
+        if len(tokens) == count:
+            break
+    return tokens
+
+
+def _take_literal(content, pos):
+    """Collect the tokens of the bracketed literal starting at ``pos``."""
+    tokens = []
+    depth = 0
+    for token in iter_tokens(content, pos):
+        tokens.append(token)
+        if token[0] == PUNCT:
+            if token[1] in ('[', '{', '('):
+                depth += 1
+            elif token[1] in (']', '}', ')'):
+                depth -= 1
+                if depth == 0:
+                    break
+    return tokens
+
+
+def find_data_sources(content, warn=None):
+    """Find dataUrl assignments, loader calls and inline data literals in JS source.
+
+    Returns a dict in the shape ``extract_data`` has always produced: remote or
+    local URLs under ``dataUrl``, ``dataUrl2``, ... followed by parsed inline
+    literals assigned to ``data``/``dataN`` under ``data1``, ``data2``, ...
+
+    The scan jumps between quotes, comments, regex literals and candidate
+    identifiers with a single compiled pattern, skipping strings, comments and
+    regexes whole, and only tokenizes the few spots that can hold a data source.
+    Nothing backtracks, so cost stays linear on large minified bundles. Inline
+    literals are decoded as JSON, or rewritten to JSON, before falling back to
+    tokenizing them for parse_literal().
+    """
+    urls = []
+    inline = []
+    search = _SCAN_PATTERN.search
+    pos = 0
+
+    try:
+        while True:
+            m = search(content, pos)
+            if m is None:
+                break
+            start = m.start()
+            text = m.group()
+            ch = text[0]
+
+            if ch == '"' or ch == "'":
+                sm = _STRING_PATTERN.match(content, start)
+                pos = sm.end() if sm else start + 1
+                continue
+            if ch == '`':
+                pos = _scan_template(content, start)[0]
+                continue
+            if ch == '/':
+                nxt = content[start + 1:start + 2]
+                if nxt == '/':
+                    pos = content.find('\n', start)
+                elif nxt == '*':
+                    pos = content.find('*/', start + 2)
+                    pos = pos + 2 if pos >= 0 else -1
+                elif _regex_allowed_at(content, start):
+                    rm = _REGEX_PATTERN.match(content, start)
+                    pos = rm.end() if rm else start + 1
+                else:
+                    pos = start + 1
+                if pos < 0:
+                    break
+                continue
+
+            pos = m.end()
+            name = text
+            following = _take_tokens(content, pos, 4)
+            if not following:
+                break
+
+            # dataUrl = '...' / dataUrl: '...'
+            if name == 'dataUrl':
+                if len(following) > 1 and following[0][0] == PUNCT and following[0][1] in ('=', ':'):
+                    url = string_value(following[1])
+                    if url:
+                        urls.append(url)
+                continue
+
+            # d3.csv('...') / d3.json('...') / fetch('...')
+            if name == 'd3':
+                if (len(following) == 4 and _is(following[0], PUNCT, '.')
+                        and following[1][0] == IDENT and following[1][1] in LOADER_FUNCTIONS
+                        and _is(following[2], PUNCT, '(')):
+                    url = string_value(following[3])
+                    if url:
+                        urls.append(url)
+                continue
+            if name == 'fetch':
+                if len(following) > 1 and _is(following[0], PUNCT, '('):
+                    url = string_value(following[1])
+                    if url:
+                        urls.append(url)
+                continue
+
+            # data = [...] / data2 = {...}
+            if (len(following) > 1 and _is(following[0], PUNCT, '=')
+                    and following[1][0] == PUNCT and following[1][1] in ('[', '{')):
+                literal_start = following[1][2]
+                # Fast path: literals pasted as strict JSON decode in C.
+                try:
+                    value, pos = _JSON_DECODER.raw_decode(content, literal_start)
+                    inline.append(value)
+                    continue
+                except ValueError:
+                    pass
+                decoded = _decode_js_literal(content, literal_start)
+                if decoded is not None:
+                    value, pos = decoded
+                    inline.append(value)
+                    continue
+                literal = _take_literal(content, literal_start)
+                try:
+                    value, _ = parse_literal(literal, 0)
+                    inline.append(value)
+                except (NotALiteral, ValueError) as e:
+                    if warn:
+                        warn(f"Could not parse inline {name}: {str(e)}")
+                if literal:
+                    last = literal[-1]
+                    pos = last[2] + 1
+    except JSTokenizeError as e:
+        if warn:
+            warn(str(e))
+
+    data_sources = {}
+    seen = set()
+    for url in urls:
+        if url in seen:
+            continue
+        seen.add(url)
+        data_sources['dataUrl' if not data_sources else f'dataUrl{len(data_sources) + 1}'] = url
+    for idx, value in enumerate(inline, 1):
+        data_sources[f'data{idx}'] = value
+    return data_sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract data sources from D3 JavaScript files')
+    parser.add_argument('js_files', nargs='+', help='JavaScript files to scan')
+    args = parser.parse_args()
+
+    for js_file in args.js_files:
+        with open(js_file, 'r') as f:
+            content = f.read()
+        sources = find_data_sources(content, warn=lambda msg: print(f"Warning: {msg} in {js_file}", file=sys.stderr))
+        print(json.dumps({js_file: sources}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
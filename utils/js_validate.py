@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import time
+import bisect
+import logging
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from pathlib import Path
+
+try:
+    import esprima
+except ImportError:
+    esprima = None
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.js_extract import JSTokenizeError, scan_structure
+from utils.jsonl_io import RecordWriter, iter_records
+
+logger = logging.getLogger(__name__)
+
+# The shape SYSTEM_PROMPT in refine_training_data.py asks every refined implementation to take.
+ENTRY_POINT = 'createVisualization'
+JS_LANGUAGES = {'', 'javascript', 'js', 'jsx', 'mjs', 'es6', 'ecmascript'}
+PARSERS = ('auto', 'esprima', 'tokens')
+# Records validated per pool round trip in validate_records().
+BATCH_SIZE = 2048
+
+_OPENING_FENCE = re.compile(r'```[ \t]*([\w+-]*)[ \t]*\r?\n')
+# esprima-python parses ES2017; replies using later syntax fall back to the token check.
+_MODERN_SYNTAX = re.compile(r'\?\.(?!\d)|\?\?|(?<![\w$])(?:static\s*\{|#[A-Za-z_$])|\d_\d')
+_CLOSERS = {'(': ')', '[': ']', '{': '}'}
+# A module ending in one of these was cut off mid-expression.
+_DANGLING = set('=+-*/%&|^!~?:<>,.(')
+_ENTRY_POINT = re.compile(r'(?<![\w$.])export\s+default\s+(?:async\s+)?function\s*(?:\*\s*)?' + ENTRY_POINT + r'\s*\(')
+
+
+def extract_code(output):
+    """The JavaScript in a reply: its ```javascript (or unlabelled) blocks joined, else the whole reply.
+
+    A block left open by a truncated reply runs to the end of the text, so
+    the cut is still caught by the syntax check.
+    """
+    blocks = []
+    pos = 0
+    fenced = False
+    while True:
+        opening = _OPENING_FENCE.search(output, pos)
+        if opening is None:
+            break
+        fenced = True
+        close = output.find('```', opening.end())
+        end = close if close >= 0 else len(output)
+        if opening.group(1).lower() in JS_LANGUAGES:
+            blocks.append(output[opening.end():end])
+        if close < 0:
+            break
+        pos = close + 3
+    if blocks:
+        return '\n'.join(blocks)
+    return '' if fenced else output
+
+
+def _line(code, offset):
+    return code.count('\n', 0, offset) + 1
+
+
+def check_structure(code):
+    """Fast syntax and entry-point check without a full parse; returns an error message or None.
+
+    Catches what truncated or garbled replies produce: unterminated strings,
+    template literals and comments, unbalanced brackets, a dangling operator
+    at the end and an entry point without a body.
+    """
+    try:
+        brackets, literals = scan_structure(code)
+    except JSTokenizeError as e:
+        return f"Syntax error: {e}"
+    stack = []
+    for ch, offset in brackets:
+        if ch in _CLOSERS:
+            stack.append((ch, offset))
+        elif not stack or _CLOSERS[stack[-1][0]] != ch:
+            return f"Syntax error: unexpected {ch!r} on line {_line(code, offset)}"
+        else:
+            stack.pop()
+    if stack:
+        ch, offset = stack[-1]
+        return f"Syntax error: unexpected end of input ({ch!r} from line {_line(code, offset)} is never closed)"
+    tail = len(code.rstrip())
+    if tail and code[tail - 1] in _DANGLING and not (literals and literals[-1][1] >= tail):
+        return f"Syntax error: unexpected end of input after {code[tail - 1]!r}"
+
+    literal_starts = [start for start, _ in literals]
+    bracket_offsets = [offset for _, offset in brackets]
+    for match in _ENTRY_POINT.finditer(code):
+        position = bisect.bisect_right(literal_starts, match.start()) - 1
+        if position >= 0 and literals[position][1] > match.start():
+            continue
+        index = bisect.bisect_left(bracket_offsets, match.start())
+        if sum(1 if ch in _CLOSERS else -1 for ch, _ in brackets[:index]):
+            continue
+        return None if _has_body(code, brackets, index) else f"Syntax error: {ENTRY_POINT} has no function body"
+    return f"Missing 'export default function {ENTRY_POINT}'"
+
+
+def _has_body(code, brackets, index):
+    """True when the parameter list opened by ``brackets[index]`` is followed by ``{``."""
+    depth = 0
+    for position in range(index, len(brackets)):
+        depth += 1 if brackets[position][0] in _CLOSERS else -1
+        if not depth:
+            return code[brackets[position][1] + 1:].lstrip().startswith('{')
+    return False
+
+
+def check_esprima(code):
+    """Full parse with esprima; returns an error message, or None when the module is valid and exports the entry point."""
+    try:
+        tree = esprima.parseModule(code)
+    except esprima.Error as e:
+        return f"Syntax error: {e}"
+    except RecursionError:
+        return "Syntax error: nesting too deep"
+    for node in tree.body:
+        declaration = getattr(node, 'declaration', None)
+        if (node.type == 'ExportDefaultDeclaration' and declaration is not None
+                and declaration.type == 'FunctionDeclaration'
+                and declaration.id is not None and declaration.id.name == ENTRY_POINT):
+            return None
+    return f"Missing 'export default function {ENTRY_POINT}'"
+
+
+_warned_fallback = False
+
+
+def check_parser(parser):
+    """Raise ImportError when ``parser`` needs esprima and it is not installed.
+
+    With 'auto' and no esprima, warns once that only the structural check runs.
+    """
+    global _warned_fallback
+    if parser == 'esprima' and esprima is None:
+        raise ImportError("The esprima parser is not installed (pip install esprima)")
+    if parser == 'auto' and esprima is None and not _warned_fallback:
+        _warned_fallback = True
+        logger.warning("esprima is not installed (pip install esprima); JavaScript is only checked for "
+                       "balanced brackets, terminated literals and the entry point, not parsed")
+
+
+def validate_output(output, parser='auto'):
+    """Check the code in a refined ``output``; returns an error message, or None if it is valid.
+
+    ``parser`` 'esprima' needs the esprima package; 'auto' uses it when
+    installed (and the code has no syntax newer than it knows), else the
+    structural check.
+    """
+    if not isinstance(output, str) or not output.strip():
+        return "Empty output"
+    code = extract_code(output)
+    if not code.strip():
+        return "No JavaScript code block"
+    if parser == 'esprima' or (parser == 'auto' and esprima is not None and not _MODERN_SYNTAX.search(code)):
+        check_parser(parser)
+        return check_esprima(code)
+    return check_structure(code)
+
+
+def _validate_batch(outputs, parser):
+    return [validate_output(output, parser) for output in outputs]
+
+
+class Validator:
+    """Validate outputs in-process or over a process pool of ``workers``.
+
+    Use as a context manager so the pool is shut down afterwards.
+    """
+
+    def __init__(self, workers=1, parser='auto'):
+        check_parser(parser)
+        self.workers = workers
+        self.parser = parser
+        self._pool = ProcessPoolExecutor(workers) if workers > 1 else None
+
+    def validate(self, outputs):
+        """Error message (or None) for each of ``outputs``, in order."""
+        outputs = list(outputs)
+        if self._pool is None or len(outputs) < 2:
+            return _validate_batch(outputs, self.parser)
+        size = max(1, -(-len(outputs) // (self.workers * 4)))
+        chunks = [outputs[start:start + size] for start in range(0, len(outputs), size)]
+        return [error for errors in self._pool.map(_validate_batch, chunks, itertools.repeat(self.parser))
+                for error in errors]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def retry_example(record):
+    """Training example that refines a record's original code again, or None if the record lacks it."""
+    if 'original_output' in record:
+        return {'input': record.get('input', ''), 'output': record['original_output']}
+    if 'source_id' in record:
+        return {'input': record.get('input', ''), 'source_id': record['source_id']}
+    return None
+
+
+def validate_records(records, validator, batch_size=BATCH_SIZE):
+    """Yield ``(record, error)`` for every record, validating a batch at a time."""
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield from zip(batch, validator.validate(record.get('output') for record in batch))
+
+
+def validate_file(input_file, output_file=None, retry_file=None, drop_invalid=False, workers=1, parser='auto'):
+    """Validate every refined example of ``input_file`` in one streaming pass.
+
+    With ``output_file`` each example is written there with a ``valid`` flag
+    (and ``validation_error`` when invalid), or invalid ones are dropped with
+    ``drop_invalid``. ``retry_file`` collects an example to refine again for
+    each invalid record (see retry_example()). Returns a Counter with
+    ``valid``, ``invalid``, ``not retryable`` and a count per error kind.
+    """
+    stats = Counter()
+    output = RecordWriter(output_file) if output_file else None
+    retry = RecordWriter(retry_file) if retry_file else None
+    try:
+        with Validator(workers, parser) as validator:
+            for record, error in validate_records(iter_records(input_file), validator):
+                stats['invalid' if error else 'valid'] += 1
+                if error:
+                    stats[error.split(':', 1)[0].split(' (', 1)[0]] += 1
+                    if retry is not None:
+                        example = retry_example(record)
+                        if example is None:
+                            stats['not retryable'] += 1
+                        else:
+                            retry.write(example)
+                if output is not None and not (error and drop_invalid):
+                    flagged = dict(record, valid=error is None)
+                    if error:
+                        flagged['validation_error'] = error
+                    output.write(flagged)
+    except BaseException:
+        for writer in (output, retry):
+            if writer is not None:
+                writer.abort()
+        raise
+    for writer in (output, retry):
+        if writer is not None:
+            writer.close()
+    return stats
+
+
+def add_validation_arguments(parser):
+    group = parser.add_argument_group('JavaScript validation')
+    group.add_argument('--no-validate-js', action='store_true',
+                       help=f"Accept refined code without checking its syntax and 'export default function {ENTRY_POINT}'")
+    group.add_argument('--js-parser', choices=PARSERS, default='auto',
+                       help='esprima for a full parse (pip install esprima), tokens for the built-in structural check, '
+                            'auto for esprima when installed (default: auto)')
+    return group
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the JavaScript in refined training examples')
+    parser.add_argument('input', help='Refined training data (JSON array or JSON lines)')
+    parser.add_argument('--output', '-o', help='Write every example here with a "valid" flag')
+    parser.add_argument('--drop-invalid', action='store_true', help='Leave invalid examples out of OUTPUT')
+    parser.add_argument('--retry', metavar='RETRY_FILE',
+                        help='Write an example to refine again (its request and original code) for each invalid one; '
+                             'pass it to refine_training_data.py --input')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1,
+                        help='Processes validating examples (default: one per CPU)')
+    parser.add_argument('--parser', choices=PARSERS, default='auto',
+                        help='esprima, the built-in structural check (tokens), or esprima when installed (default: auto)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        stats = validate_file(args.input, args.output, args.retry, args.drop_invalid, args.workers, args.parser)
+    except ImportError as e:
+        sys.exit(str(e))
+    total = stats['valid'] + stats['invalid']
+    parser_name = 'esprima' if args.parser == 'esprima' or (args.parser == 'auto' and esprima) else 'structural'
+    print(f"Validated {total:,} examples in {time.perf_counter() - start:.2f}s with the {parser_name} check: "
+          f"{stats['valid']:,} valid, {stats['invalid']:,} invalid")
+    for name, value in stats.most_common():
+        if name not in ('valid', 'invalid', 'not retryable'):
+            print(f"  {name:<54} {value:>8,}")
+    if args.output:
+        print(f"Wrote {'valid examples' if args.drop_invalid else 'flagged examples'} to {args.output}")
+    if args.retry:
+        skipped = f" ({stats['not retryable']} without their original code skipped)" if stats['not retryable'] else ""
+        print(f"Wrote {stats['invalid'] - stats['not retryable']:,} examples to refine again to {args.retry}{skipped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import gzip
+import json
+import argparse
+import tempfile
+from itertools import islice
+
+JSONL_SUFFIXES = ('.jsonl', '.ndjson')
+READ_CHUNK = 1 << 16
+
+
+def _base_suffix(path):
+    path = str(path)
+    if path.endswith('.gz'):
+        path = path[:-3]
+    return os.path.splitext(path)[1].lower()
+
+
+def is_jsonl(path):
+    """True when ``path`` names a JSON-lines file (.jsonl/.ndjson, optionally gzipped)."""
+    return _base_suffix(path) in JSONL_SUFFIXES
+
+
+def _open(path, mode, compressed=None):
+    if compressed if compressed is not None else str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def _iter_jsonl(f, path):
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path}:{number}: invalid JSON line: {e}") from None
+
+
+def _iter_json_array(f, path):
+    """Decode the elements of a top-level JSON array one at a time.
+
+    Only the element being decoded (plus one read chunk) is held in memory,
+    so multi-gigabyte array files stream like JSON lines.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        # Read at least as much as is buffered so a huge element costs O(n), not O(n^2).
+        chunk = f.read(max(READ_CHUNK, len(buffer) - pos))
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        eof = not chunk
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    skip(' \t\r\n')
+    if pos >= len(buffer) or buffer[pos] != '[':
+        raise ValueError(f"{path}: expected a JSON array")
+    pos += 1
+    skip(' \t\r\n')
+    if pos < len(buffer) and buffer[pos] == ']':
+        return
+    while True:
+        skip(' \t\r\n')
+        if pos >= len(buffer):
+            raise ValueError(f"{path}: unterminated JSON array")
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            value, end = None, None
+        # A value that runs to the end of the buffer may continue in the next chunk.
+        if end is None or (end == len(buffer) and not eof):
+            if eof:
+                raise ValueError(f"{path}: invalid JSON array element at offset {pos}")
+            fill()
+            continue
+        pos = end
+        yield value
+
+        # Exactly one comma between elements: rejects [1 2], [1,,2] and [1,].
+        skip(' \t\r\n')
+        if pos >= len(buffer):
+            raise ValueError(f"{path}: unterminated JSON array")
+        if buffer[pos] == ']':
+            return
+        if buffer[pos] != ',':
+            raise ValueError(f"{path}: expected ',' or ']' after JSON array element")
+        pos += 1
+
+
+def iter_records(path, limit=None):
+    """Yield the records of a JSON array or JSON-lines file without loading it whole."""
+    with _open(path, 'r') as f:
+        records = _iter_jsonl(f, path) if is_jsonl(path) else _iter_json_array(f, path)
+        yield from islice(records, limit)
+
+
+def count_records(path):
+    """Number of records in ``path``; cheap for JSON lines, a full streaming parse for arrays."""
+    if is_jsonl(path):
+        with _open(path, 'r') as f:
+            return sum(1 for line in f if line.strip())
+    return sum(1 for _ in iter_records(path))
+
+
+class RecordWriter:
+    """Stream records to a JSON array or JSON-lines file, chosen by extension.
+
+    Records go to a temporary file beside ``path`` that replaces it only when
+    the writer closes without an exception, so readers never see a partial
+    file. Use as a context manager.
+    """
+
+    def __init__(self, path, jsonl=None, indent=2):
+        self.path = str(path)
+        self.jsonl = is_jsonl(path) if jsonl is None else jsonl
+        self.indent = indent
+        self.count = 0
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        self._file = _open(self._tmp, 'w', compressed=self.path.endswith('.gz'))
+        if not self.jsonl:
+            self._file.write('[')
+
+    def write(self, record):
+        if self.jsonl:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        else:
+            text = json.dumps(record, indent=self.indent)
+            if self.indent:
+                text = text.replace('\n', '\n' + ' ' * self.indent)
+                self._file.write((',\n' if self.count else '\n') + ' ' * self.indent + text)
+            else:
+                self._file.write((', ' if self.count else '') + text)
+        self.count += 1
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+        return self.count
+
+    def close(self):
+        if self._file is None:
+            return
+        if not self.jsonl:
+            self._file.write('\n]\n' if self.count and self.indent else ']\n')
+        self._file.close()
+        self._file = None
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.unlink(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_records(path, records, jsonl=None):
+    """Write an iterable of records to ``path``; returns how many were written."""
+    with RecordWriter(path, jsonl=jsonl) as writer:
+        return writer.write_all(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert training data between JSON arrays and JSON lines')
+    parser.add_argument('input', help='JSON array or JSON-lines file (.jsonl/.ndjson, optionally .gz)')
+    parser.add_argument('output', help='Destination; the format follows its extension unless --to is given')
+    parser.add_argument('--to', choices=('json', 'jsonl'), help='Output format (default: from the output extension)')
+    parser.add_argument('--limit', type=int, help='Only convert the first N records')
+    args = parser.parse_args()
+
+    jsonl = None if args.to is None else args.to == 'jsonl'
+    try:
+        count = write_records(args.output, iter_records(args.input, limit=args.limit), jsonl=jsonl)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"Wrote {count} records to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.instrumentation import count, record_usage, span
+
+DEFAULT_LLM_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "d3_gallery_llm", "responses.sqlite")
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2  # 512 MB
+
+# Cache modes: read and write; read only (misses still call the API, nothing is
+# stored); replay (misses raise instead of calling the API).
+MODES = ('readwrite', 'readonly', 'replay')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT,
+    response TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+class CacheMiss(LookupError):
+    """Raised in replay mode when a prompt has no cached response."""
+
+
+def request_key(model, messages, **params):
+    """Stable hash of everything that determines a chat completion."""
+    payload = json.dumps({'model': model, 'messages': messages, 'params': params},
+                         sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """SQLite-backed cache of chat completion responses keyed by request_key().
+
+    Entries older than ``ttl`` seconds are treated as misses, and the least
+    recently used entries are evicted once stored responses exceed ``max_bytes``.
+    Each thread (and each worker process) opens its own connection.
+    """
+
+    def __init__(self, path=DEFAULT_LLM_CACHE_PATH, ttl=None, max_bytes=DEFAULT_MAX_BYTES, mode='readwrite'):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}; expected one of {', '.join(MODES)}")
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.mode = mode
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._init_state()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _init_state(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._written = 0
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'writes': 0, 'evicted': 0}
+
+    def __getstate__(self):
+        # Connections and locks are per process; workers reopen the database.
+        state = self.__dict__.copy()
+        for key in ('_local', '_lock', '_written', 'stats'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @property
+    def writable(self):
+        return self.mode == 'readwrite'
+
+    def key(self, model, messages, **params):
+        return request_key(model, messages, **params)
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+        count(f"llm cache {stat}", amount)
+
+    def get(self, key):
+        """Return the cached response text for ``key``, or None on a miss.
+
+        In replay mode a miss raises CacheMiss so no API call is made.
+        """
+        conn = self._connect()
+        row = conn.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+            self._count('expired')
+            if self.writable:
+                with conn:
+                    conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            row = None
+
+        if row is None:
+            self._count('misses')
+            if self.mode == 'replay':
+                raise CacheMiss(f"No cached response for request {key[:12]} (replay mode)")
+            return None
+
+        self._count('hits')
+        if self.writable:
+            with conn:
+                conn.execute('UPDATE responses SET last_used = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def put(self, key, response, model=None):
+        """Store ``response`` text for ``key`` (no-op unless the cache is read-write)."""
+        if not self.writable:
+            return
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO responses (key, model, response, created, last_used, size) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', (key, model, response, now, now, size))
+        self._count('writes')
+        with self._lock:
+            self._written += size
+            check = self.max_bytes is not None and self._written >= self.max_bytes // 20
+            if check:
+                self._written = 0
+        if check:
+            self.evict()
+
+    def discard(self, key):
+        """Drop an entry, e.g. a response that turned out to be unparseable."""
+        if not self.writable:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+
+    def complete(self, client, model, messages, **params):
+        """Cached ``client.chat.completions.create``; returns (response text, cache key).
+
+        Misses are timed and their token usage recorded here, so callers only
+        instrument the requests they make without the cache.
+        """
+        key = self.key(model, messages, **params)
+        cached = self.get(key)
+        if cached is not None:
+            return cached, key
+        with span('API call'):
+            response = client.chat.completions.create(model=model, messages=messages, **params)
+        record_usage(response.usage)
+        content = response.choices[0].message.content
+        self.put(key, content, model=model)
+        return content, key
+
+    def size(self):
+        row = self._connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        return row[0], row[1]
+
+    def evict(self):
+        """Delete least-recently-used entries until the cache fits in ``max_bytes``."""
+        if self.max_bytes is None or not self.writable:
+            return 0
+        conn = self._connect()
+        _, total = self.size()
+        if total <= self.max_bytes:
+            return 0
+        doomed = []
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY last_used'):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        with conn:
+            conn.executemany('DELETE FROM responses WHERE key = ?', doomed)
+        self._count('evicted', len(doomed))
+        return len(doomed)
+
+    def purge_expired(self):
+        if self.ttl is None or not self.writable:
+            return 0
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute('DELETE FROM responses WHERE created < ?', (time.time() - self.ttl,))
+        return cursor.rowcount
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM responses')
+        conn.execute('VACUUM')
+
+    def summary(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        rate = f" ({self.stats['hits'] / lookups:.0%} hit rate)" if lookups else ""
+        return (f"LLM cache: {self.stats['hits']} hits, {self.stats['misses']} misses{rate}, "
+                f"{self.stats['writes']} stored, {self.stats['expired']} expired, {self.stats['evicted']} evicted")
+
+
+def add_cache_arguments(parser):
+    """Register the LLM cache flags shared by every script that calls the API."""
+    group = parser.add_argument_group('LLM response cache')
+    group.add_argument('--llm-cache', default=DEFAULT_LLM_CACHE_PATH,
+                       help=f'SQLite file caching LLM responses (default: {DEFAULT_LLM_CACHE_PATH})')
+    group.add_argument('--no-llm-cache', action='store_true', help='Always call the API, bypassing the response cache')
+    group.add_argument('--llm-cache-mode', choices=MODES, default='readwrite',
+                       help='readonly never stores responses; replay serves only cached responses and fails on misses')
+    group.add_argument('--llm-cache-ttl-hours', type=float, help='Ignore cached responses older than this (default: never expire)')
+    group.add_argument('--llm-cache-max-mb', type=float, default=DEFAULT_MAX_BYTES / 1024 ** 2,
+                       help=f'Evict least recently used responses beyond this size (default: {DEFAULT_MAX_BYTES // 1024 ** 2})')
+    return group
+
+
+def cache_from_args(args):
+    if args.no_llm_cache:
+        return None
+    ttl = args.llm_cache_ttl_hours * 3600 if args.llm_cache_ttl_hours else None
+    return LLMCache(args.llm_cache, ttl=ttl, max_bytes=int(args.llm_cache_max_mb * 1024 ** 2),
+                    mode=args.llm_cache_mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or manage the LLM response cache')
+    parser.add_argument('--path', default=DEFAULT_LLM_CACHE_PATH, help='Cache database')
+    parser.add_argument('--clear', action='store_true', help='Remove every cached response')
+    parser.add_argument('--max-mb', type=float, help='Evict entries until the cache fits in this many MB')
+    parser.add_argument('--ttl-hours', type=float, help='Remove entries older than this many hours')
+    args = parser.parse_args()
+
+    cache = LLMCache(args.path, ttl=args.ttl_hours * 3600 if args.ttl_hours else None,
+                     max_bytes=int(args.max_mb * 1024 ** 2) if args.max_mb else None)
+    if args.clear:
+        cache.clear()
+    if args.ttl_hours:
+        print(f"Removed {cache.purge_expired()} expired entries")
+    if args.max_mb:
+        print(f"Evicted {cache.evict()} entries")
+
+    count, total = cache.size()
+    print(f"Cache database: {cache.path}")
+    print(f"Entries: {count}")
+    print(f"Total size: {total:,} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import argparse
+from collections import Counter
+
+# Fresh requests made for a reply that still does not parse after repair.
+PARSE_RETRIES = 1
+JSON_MODE = {"type": "json_object"}
+
+# Per-task reply schemas. A schema is a type (or tuple of types), a dict of
+# required fields -> schemas, or a one-element list giving the item schema.
+INFERENCE_SCHEMA = {'data_structure': str, 'sample_data': (list, dict), 'explanation': str}
+QUERIES_SCHEMA = {'queries': [{'query': str}]}
+REFINE_SCHEMA = {'input': str, 'output': str}
+GROUP_REFINE_SCHEMA = {'inputs': [str], 'output': str}
+
+_ESCAPES = set('"\\/bfnrtu')
+_CONTROL = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+class ResponseFormatError(ValueError):
+    """Raised when a reply is not valid JSON for its schema, even after repair.
+
+    ``response_content`` holds the raw reply for debugging.
+    """
+
+    def __init__(self, message, response_content=None):
+        super().__init__(message)
+        self.response_content = response_content
+
+
+def response_format(json_mode=True):
+    """``response_format`` request parameter asking for a JSON object, or {} to leave it out."""
+    return {'response_format': JSON_MODE} if json_mode else {}
+
+
+def extract_json_text(content):
+    """The JSON part of a reply: the body of a ```json fence if there is one, else from the first { or [.
+
+    Fences are only looked for outside the JSON, since code in string values
+    often contains its own ``` blocks.
+    """
+    text = content.strip()
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text[:text.rfind('```')] if text.rstrip().endswith('```') else text
+    elif '```json' in text and not text.startswith(('{', '[')):
+        text = text.split('```json', 1)[1]
+        if '```' in text:
+            text = text[:text.rfind('```')]
+    text = text.strip()
+    starts = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+    return text[min(starts):] if starts else text
+
+
+def repair_json(text, fixes=None):
+    """Best-effort fix of the defects models commonly produce, in one pass.
+
+    Raw control characters inside strings (unescaped newlines in code) are
+    escaped, invalid backslash escapes are doubled, trailing commas are
+    dropped and anything after the top-level value is ignored. A truncated
+    tail is cut back to the last complete element of the innermost open
+    container and every open container is closed, so a cut-off reply keeps
+    whatever it finished rather than gaining half a string. The names of the
+    fixes applied are added to ``fixes`` (a set) when given.
+    """
+    fixes = set() if fixes is None else fixes
+    out = []
+    # One entry per open container: [closer, index just after its opener, end of its last complete element].
+    stack = []
+    in_string = False
+    i = 0
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        i += 1
+        if in_string:
+            if ch == '\\':
+                if i < n and text[i] in _ESCAPES:
+                    out.append(ch + text[i])
+                    i += 1
+                else:
+                    out.append('\\\\')
+                    fixes.add('invalid escapes')
+            elif ch == '"':
+                out.append(ch)
+                in_string = False
+            elif ch < ' ':
+                out.append(_CONTROL.get(ch, f'\\u{ord(ch):04x}'))
+                fixes.add('control characters')
+            else:
+                out.append(ch)
+            continue
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in '{[':
+            out.append(ch)
+            stack.append(['}' if ch == '{' else ']', len(out), len(out)])
+        elif ch in '}]':
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+                fixes.add('trailing commas')
+            if not stack:
+                break
+            out.append(stack.pop()[0])
+            if not stack:
+                break
+        elif ch == ',' and stack:
+            stack[-1][2] = len(out)
+            out.append(ch)
+        else:
+            out.append(ch)
+    else:
+        if stack:
+            fixes.add('truncated tail')
+            # Containers left empty by the cut are dropped from their parent too.
+            while len(stack) > 1 and stack[-1][2] == stack[-1][1]:
+                stack.pop()
+            del out[stack[-1][2]:]
+            while out and (out[-1].isspace() or out[-1] == ','):
+                out.pop()
+            out.extend(closer for closer, _, _ in reversed(stack))
+    return ''.join(out)
+
+
+def validate(value, schema, path='response'):
+    """Raise ResponseFormatError unless ``value`` matches ``schema``."""
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            raise ResponseFormatError(f"{path} should be an object, got {type(value).__name__}")
+        for field, field_schema in schema.items():
+            if field not in value:
+                raise ResponseFormatError(f"{path} is missing required field {field!r}")
+            validate(value[field], field_schema, f"{path}.{field}")
+    elif isinstance(schema, list):
+        if not isinstance(value, list):
+            raise ResponseFormatError(f"{path} should be an array, got {type(value).__name__}")
+        for index, item in enumerate(value):
+            validate(item, schema[0], f"{path}[{index}]")
+    elif not isinstance(value, schema):
+        raise ResponseFormatError(f"{path} has type {type(value).__name__}")
+
+
+def parse_json(content, schema=None, allow_truncated=True, stats=None):
+    """Parse a model reply as JSON and check it against ``schema``.
+
+    Clean replies take the plain ``json.loads`` path; only replies that fail
+    it are repaired. With ``allow_truncated=False`` a reply that needed its
+    tail cut off is rejected (e.g. refined code that stops mid-function).
+    ``stats`` (a Counter) tallies clean, repaired and failed replies plus each
+    kind of fix. Raises ResponseFormatError.
+    """
+    stats = stats if stats is not None else Counter()
+    if content is None:
+        stats['failed'] += 1
+        raise ResponseFormatError("Empty response", content)
+    repaired = False
+    try:
+        value = json.loads(content)
+    except json.JSONDecodeError:
+        text = extract_json_text(content)
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError as e:
+            fixes = set()
+            try:
+                value = json.loads(repair_json(text, fixes))
+            except json.JSONDecodeError:
+                stats['failed'] += 1
+                raise ResponseFormatError(f"Invalid JSON: {e}", content) from None
+            if 'truncated tail' in fixes and not allow_truncated:
+                stats['failed'] += 1
+                raise ResponseFormatError("Response was truncated", content)
+            repaired = True
+            stats.update(fixes)
+    if schema is not None:
+        try:
+            validate(value, schema)
+        except ResponseFormatError as e:
+            stats['failed'] += 1
+            e.response_content = content
+            raise
+    stats['repaired' if repaired else 'clean'] += 1
+    return value
+
+
+def format_stats(stats):
+    """One-line summary of a parse_json ``stats`` Counter."""
+    parsed = stats['clean'] + stats['repaired']
+    fixes = ', '.join(f"{name} {count}" for name, count in sorted(stats.items())
+                      if name not in ('clean', 'repaired', 'failed'))
+    return (f"Responses: {parsed} parsed ({stats['repaired']} repaired), {stats['failed']} unusable"
+            + (f"; fixes: {fixes}" if fixes else ""))
+
+
+def add_json_mode_argument(parser):
+    parser.add_argument('--no-json-mode', action='store_true',
+                        help='Do not ask the API for JSON-mode replies (for endpoints without response_format)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parse (and repair) a model reply saved to a file')
+    parser.add_argument('response', help='File holding the raw reply, e.g. failed_to_parse.txt')
+    parser.add_argument('--schema', choices=('inference', 'queries', 'refine', 'group-refine'),
+                        help='Also validate the reply against this task\'s schema')
+    args = parser.parse_args()
+
+    schema = {'inference': INFERENCE_SCHEMA, 'queries': QUERIES_SCHEMA, 'refine': REFINE_SCHEMA,
+              'group-refine': GROUP_REFINE_SCHEMA}.get(args.schema)
+    stats = Counter()
+    with open(args.response) as f:
+        content = f.read()
+    try:
+        value = parse_json(content, schema, stats=stats)
+    except ResponseFormatError as e:
+        sys.exit(str(e))
+    print(json.dumps(value, indent=2))
+    print(format_stats(stats), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import time
+import zlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.js_extract import NUM, REGEX, STR, TEMPLATE, tokenize
+from utils.jsonl_io import RecordWriter, iter_records
+from utils.source_store import source_id, sources_path_for
+
+NUM_PERM = 128
+CODE_SHINGLE = 5        # tokens per code shingle
+QUERY_SHINGLE = 5       # characters per query shingle
+CODE_THRESHOLD = 0.85
+QUERY_THRESHOLD = 0.7
+# Shingles hashed per block when computing a signature, bounding memory for huge bundles.
+SIGNATURE_BLOCK = 4096
+STAGES = ('code', 'query')
+
+# Literals are where forks differ (colours, sizes, dataset URLs), so they collapse to placeholders.
+_PLACEHOLDERS = {NUM: '0', STR: '""', TEMPLATE: '``', REGEX: '/r/'}
+_WORD = re.compile(r'\w+')
+
+
+def code_tokens(js_content):
+    """JS tokens with every literal replaced by a placeholder of its kind."""
+    return [_PLACEHOLDERS.get(token[0], token[1]) for token in tokenize(js_content, strict=False)]
+
+
+_token_hashes = {}
+_SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _hash_shingles(items, size):
+    """Distinct 32-bit hashes of every run of ``size`` consecutive items.
+
+    Each distinct item is hashed once (crc32, cached); shingle hashes are then
+    rolled up with vectorized multiply-adds instead of joining strings.
+    """
+    if not items:
+        return np.empty(0, dtype=np.uint64)
+    hashes = _token_hashes
+    ids = np.fromiter((hashes.get(item) or hashes.setdefault(item, zlib.crc32(item.encode('utf-8')) | 1)
+                       for item in items), dtype=np.uint64, count=len(items))
+    count = max(1, len(ids) - size + 1)
+    rolled = ids[:count].copy()
+    for offset in range(1, min(size, len(ids))):
+        rolled = rolled * _SHINGLE_MULTIPLIER + ids[offset:offset + count]
+    return np.unique(rolled >> np.uint64(32))
+
+
+def code_shingles(js_content, size=CODE_SHINGLE):
+    """Hashes of the distinct ``size``-token shingles of normalized JS."""
+    return _hash_shingles(code_tokens(js_content), size)
+
+
+def query_shingles(text, size=QUERY_SHINGLE):
+    """Hashes of the distinct ``size``-character shingles of case- and punctuation-normalized text."""
+    return _hash_shingles(' '.join(_WORD.findall(text.lower())), size)
+
+
+class MinHasher:
+    """MinHash signatures from multiply-shift hashing of 32-bit shingle hashes."""
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(0, 2 ** 64, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 64, size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes):
+        signature = np.full(self.num_perm, 0xFFFFFFFF, dtype=np.uint64)
+        for start in range(0, len(hashes), SIGNATURE_BLOCK):
+            block = hashes[start:start + SIGNATURE_BLOCK, None]
+            # uint64 arithmetic wraps, which is exactly the multiply-shift family.
+            np.minimum(signature, ((block * self._a + self._b) >> np.uint64(32)).min(axis=0), out=signature)
+        return signature.astype(np.uint32)
+
+
+_worker_hasher = None
+
+
+def _init_worker(num_perm):
+    global _worker_hasher
+    _worker_hasher = MinHasher(num_perm)
+
+
+def _code_signature(js_content):
+    return _worker_hasher.signature(code_shingles(js_content))
+
+
+def similarity(signature, others):
+    """Estimated Jaccard similarity between one signature and each row of ``others``."""
+    return (others == signature).mean(axis=1)
+
+
+def lsh_params(threshold, num_perm=NUM_PERM):
+    """(bands, rows) minimizing the false positive plus false negative area around ``threshold``."""
+    s = np.linspace(0, 1, 201)
+    step = s[1] - s[0]
+    best = None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            collide = 1 - (1 - s ** rows) ** bands
+            false_positive = collide[s < threshold].sum() * step
+            false_negative = (1 - collide[s >= threshold]).sum() * step
+            error = false_positive + false_negative
+            if best is None or error < best[0]:
+                best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        root = self.parent.setdefault(item, item)
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while item != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            # The earlier item stays the root, so representatives follow input order.
+            if b < a:
+                a, b = b, a
+            self.parent[b] = a
+        return a
+
+
+class LSHClusterer:
+    """Incremental near-duplicate clustering over MinHash signatures.
+
+    Each band of an item's signature is hashed into a bucket; items sharing a
+    bucket are candidates, and an item joins the cluster of its most similar
+    candidate when their estimated similarity reaches ``threshold``. Only
+    items that matched nothing are stored in the buckets, so a cluster of
+    thousands of copies costs one comparison per copy rather than a
+    quadratic number and the whole pass stays sub-quadratic. ``scope``
+    keeps items in different scopes apart.
+    """
+
+    def __init__(self, threshold, num_perm=NUM_PERM):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.buckets = defaultdict(list)
+        self.clusters = UnionFind()
+        self._signatures = {}
+        self.comparisons = 0
+
+    def add(self, item, signature, scope=b''):
+        self.clusters.find(item)
+        keys = [scope + bytes([band]) + signature[band * self.rows:(band + 1) * self.rows].tobytes()
+                for band in range(self.bands)]
+        candidates = {other for key in keys for other in self.buckets.get(key, ())}
+        matched = False
+        if candidates:
+            candidates = sorted(candidates)
+            self.comparisons += len(candidates)
+            scores = similarity(signature, np.stack([self._signatures[other] for other in candidates]))
+            # Joining only the closest match keeps one item from chaining two distinct clusters together.
+            best = int(scores.argmax())
+            if scores[best] >= self.threshold:
+                self.clusters.union(item, candidates[best])
+                matched = True
+        if not matched:
+            self._signatures[item] = signature
+            for key in keys:
+                self.buckets[key].append(item)
+        return matched
+
+    def groups(self):
+        """Clusters with more than one member, as {root: [members in input order]}."""
+        members = defaultdict(list)
+        for item in self.clusters.parent:
+            members[self.clusters.find(item)].append(item)
+        return {root: sorted(group) for root, group in members.items() if len(group) > 1}
+
+
+def _example_source(example, sources_file):
+    if 'source_id' in example and 'output' not in example:
+        if sources_file is None:
+            raise ValueError(f"Example references source {example['source_id']} but no sources file was found")
+        return example['source_id'], None
+    return source_id(example.get('output', '')), example.get('output', '')
+
+
+def find_near_duplicates(input_file, sources_file=None, stages=STAGES, code_threshold=CODE_THRESHOLD,
+                         query_threshold=QUERY_THRESHOLD, num_perm=NUM_PERM, workers=1):
+    """Cluster near-duplicate sources and queries in one streaming pass over ``input_file``.
+
+    Sources (the distinct JS an example carries inline or references by
+    ``source_id``) are clustered by token-shingle similarity; examples on a
+    source that is not its cluster's representative are dropped. The queries
+    on each remaining source are then clustered by character-shingle
+    similarity and one example kept per cluster. Representatives are the
+    first members in input order. Tokenizing and hashing sources is spread
+    over ``workers`` processes. Returns a report dict with the kept example
+    indices and the clusters.
+    """
+    hasher = MinHasher(num_perm)
+    timings = {}
+    start = time.perf_counter()
+    pool = None
+    if workers > 1 and 'code' in stages:
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(num_perm,))
+    else:
+        _init_worker(num_perm)
+    signatures = partial(pool.map, chunksize=8) if pool is not None else map
+    batch = []
+
+    source_index = {}           # source key -> dense source number
+    source_names = []
+    example_sources = []        # example index -> source number
+    query_signatures = []
+    code = LSHClusterer(code_threshold, num_perm) if 'code' in stages else None
+
+    def flush():
+        # Signatures come back in submission order, so clustering still follows input order.
+        for (number, _), signature in zip(batch, signatures(_code_signature, [text for _, text in batch])):
+            code.add(number, signature)
+        batch.clear()
+
+    def add_source(key, text, name=None):
+        number = source_index[key] = len(source_names)
+        source_names.append(name)
+        if code is not None:
+            batch.append((number, text))
+            if len(batch) >= max(1, workers) * 64:
+                flush()
+        return number
+
+    try:
+        if sources_file is not None and 'code' in stages:
+            for record in iter_records(sources_file):
+                add_source(record['source_id'], record['output'], record.get('name'))
+
+        inputs = []
+        for index, example in enumerate(iter_records(input_file)):
+            key, text = _example_source(example, sources_file)
+            number = source_index.get(key)
+            if number is None:
+                number = add_source(key, text or '')
+            example_sources.append(number)
+            inputs.append(example.get('input', ''))
+            if 'query' in stages:
+                query_signatures.append(hasher.signature(query_shingles(example.get('input', ''))))
+        if code is not None:
+            flush()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    timings['signatures and code clustering'] = time.perf_counter() - start
+
+    code_groups = code.groups() if code is not None else {}
+    per_source = Counter(example_sources)
+    source_root = {number: root for root, group in code_groups.items() for number in group}
+    kept = [index for index, number in enumerate(example_sources) if source_root.get(number, number) == number]
+
+    query_groups = {}
+    if 'query' in stages:
+        start = time.perf_counter()
+        queries = LSHClusterer(query_threshold, num_perm)
+        for index in kept:
+            queries.add(index, query_signatures[index], scope=example_sources[index].to_bytes(4, 'little'))
+        query_groups = queries.groups()
+        duplicates = {index for group in query_groups.values() for index in group[1:]}
+        kept = [index for index in kept if index not in duplicates]
+        timings['query clustering'] = time.perf_counter() - start
+
+    return {
+        'examples': len(example_sources),
+        'sources': len(source_names),
+        'kept': kept,
+        'code_clusters': [
+            {'representative': source_names[root] or root,
+             'members': [{'source': source_names[number] or number,
+                          'examples': per_source[number]} for number in group]}
+            for root, group in code_groups.items()
+        ] if code_groups else [],
+        'query_clusters': [{'kept': inputs[root], 'duplicates': [inputs[index] for index in group[1:]],
+                            'indices': group} for root, group in query_groups.items()],
+        'comparisons': (code.comparisons if code is not None else 0),
+        'timings': timings,
+    }
+
+
+def _size_histogram(sizes):
+    bins = [(2, 2), (3, 4), (5, 9), (10, 99), (100, None)]
+    counts = Counter()
+    for size in sizes:
+        for low, high in bins:
+            if size >= low and (high is None or size <= high):
+                counts[(low, high)] += 1
+                break
+    return ', '.join(f"{low if high == low else f'{low}+' if high is None else f'{low}-{high}'}: {counts[(low, high)]}"
+                     for low, high in bins if counts[(low, high)])
+
+
+def format_report(report, top=5):
+    dropped = report['examples'] - len(report['kept'])
+    lines = [f"Examples: {report['examples']} over {report['sources']} distinct sources; "
+             f"keeping {len(report['kept'])}, dropping {dropped}"]
+    code_clusters = report['code_clusters']
+    if code_clusters:
+        forks = sum(len(cluster['members']) - 1 for cluster in code_clusters)
+        fork_examples = sum(member['examples'] for cluster in code_clusters for member in cluster['members'][1:])
+        lines.append(f"Code: {len(code_clusters)} clusters of near-identical sources, {forks} sources dropped "
+                     f"({fork_examples} examples)")
+        lines.append(f"  cluster sizes: {_size_histogram(len(cluster['members']) for cluster in code_clusters)}")
+        for cluster in sorted(code_clusters, key=lambda c: -len(c['members']))[:top]:
+            lines.append(f"  {len(cluster['members']):>5} x {cluster['representative']}")
+    query_clusters = report['query_clusters']
+    if query_clusters:
+        duplicates = sum(len(cluster['duplicates']) for cluster in query_clusters)
+        lines.append(f"Queries: {len(query_clusters)} clusters of near-identical queries, {duplicates} examples dropped")
+        lines.append(f"  cluster sizes: {_size_histogram(len(cluster['indices']) for cluster in query_clusters)}")
+        for cluster in sorted(query_clusters, key=lambda c: -len(c['indices']))[:top]:
+            lines.append(f"  {len(cluster['indices']):>5} x {cluster['kept'][:70]!r}")
+    lines.append("Timings: " + ', '.join(f"{name} {seconds:.1f}s" for name, seconds in report['timings'].items()))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find and drop near-duplicate training examples with MinHash/LSH')
+    parser.add_argument('input', help='Training data (JSON array or JSON lines)')
+    parser.add_argument('--output', '-o', help='Write the examples that survive deduplication here')
+    parser.add_argument('--clusters', help='Write every cluster (sources and queries) here as JSON lines')
+    parser.add_argument('--sources', help='Sources file for examples that reference code by source_id '
+                                          '(default: INPUT with a .sources suffix, if present)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                        help='Cluster sources by code, queries by text, or both (default: both)')
+    parser.add_argument('--code-threshold', type=float, default=CODE_THRESHOLD,
+                        help=f'Jaccard similarity of code shingles that makes sources duplicates (default: {CODE_THRESHOLD})')
+    parser.add_argument('--query-threshold', type=float, default=QUERY_THRESHOLD,
+                        help=f'Jaccard similarity of query shingles that makes queries duplicates (default: {QUERY_THRESHOLD})')
+    parser.add_argument('--num-perm', type=int, default=NUM_PERM, help=f'MinHash permutations (default: {NUM_PERM})')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1,
+                        help='Processes tokenizing and hashing sources (default: one per CPU)')
+    args = parser.parse_args()
+
+    sources_file = args.sources
+    if sources_file is None and os.path.exists(sources_path_for(args.input)):
+        sources_file = sources_path_for(args.input)
+    try:
+        report = find_near_duplicates(args.input, sources_file, args.stages, args.code_threshold,
+                                      args.query_threshold, args.num_perm, args.workers)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(format_report(report))
+
+    if args.clusters:
+        with RecordWriter(args.clusters) as writer:
+            for cluster in report['code_clusters']:
+                writer.write({'stage': 'code', **cluster})
+            for cluster in report['query_clusters']:
+                writer.write({'stage': 'query', **cluster})
+        print(f"Clusters written to {args.clusters}")
+    if args.output:
+        kept = set(report['kept'])
+        with RecordWriter(args.output) as writer:
+            writer.write_all(example for index, example in enumerate(iter_records(args.input)) if index in kept)
+        print(f"Wrote {writer.count} examples to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,72 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import json
+import asyncio
 import argparse
+from collections import Counter
 from pathlib import Path
 import openai
 import logging
 
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.rate_limit import AsyncRateLimiter, estimate_tokens
+from utils.instrumentation import add_instrumentation_arguments, count, instrumented_run, record_usage, span
+from utils.llm_cache import add_cache_arguments, cache_from_args
+from utils.prompt_builder import add_prompt_arguments, builder_from_args
+from utils.llm_response import (INFERENCE_SCHEMA, PARSE_RETRIES, ResponseFormatError, add_json_mode_argument,
+                                parse_json, response_format)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL = "gpt-4o"
+SYSTEM_PROMPT = "You are a D3.js expert that analyzes visualizations and infers their required data structures."
+# Completion tokens budgeted per request when enforcing a tokens-per-minute limit.
+EXPECTED_COMPLETION_TOKENS = 1000
+
 class D3DataInferer:
-    def __init__(self, api_key=None):
-        """Initialize with OpenAI API key. If not provided, will try to get from environment."""
+    def __init__(self, api_key=None, base_url=None, model=DEFAULT_MODEL, cache=None, prompt_builder=None,
+                 json_mode=True):
+        """Initialize with OpenAI API key. If not provided, will try to get from environment.
+
+        ``base_url`` points the client at an OpenAI-compatible endpoint such as a
+        local mock server (defaults to OPENAI_BASE_URL, then api.openai.com).
+        ``cache`` is an optional LLMCache consulted before every request, and
+        ``prompt_builder`` an optional PromptBuilder that trims code to a token budget.
+        ``json_mode`` asks the API for a JSON object reply.
+        """
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OpenAI API key must be provided or set in OPENAI_API_KEY environment variable")
-        openai.api_key = self.api_key
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.model = model
+        self.cache = cache
+        self.prompt_builder = prompt_builder
+        self.json_mode = json_mode
+        self.parse_stats = Counter()
+        self.client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
+
+    def __getstate__(self):
+        # HTTP clients are per process; workers rebuild them on unpickling.
+        state = self.__dict__.copy()
+        state['client'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
 
     def extract_visualization_code(self, js_file_path):
         """Extract relevant visualization code from the JavaScript file."""
         with open(js_file_path, 'r') as f:
             content = f.read()
+        if self.prompt_builder is not None:
+            return self.prompt_builder.trim_code(content, name=str(js_file_path))
         return content
 
-    def infer_data_structure(self, js_file_path, temperature=0):
-        """Analyze D3 visualization code and infer the expected data structure."""
-        code = self.extract_visualization_code(js_file_path)
-        
+    def build_messages(self, code):
         prompt = f"""Analyze this D3.js visualization code and:
 1. Determine the expected data structure
 2. Generate a small sample dataset that would work with this visualization
@@ -43,35 +82,136 @@ Respond in the following JSON format:
     "explanation": "Detailed explanation of the data format and fields"
 }}
 """
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
 
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a D3.js expert that analyzes visualizations and infers their required data structures."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temperature
-        )
+    def parse_response(self, content, cache_key=None):
+        """Parse the model's reply into the inference result dict.
 
+        Defects such as trailing commas or truncated tails are repaired; replies
+        that still fail (raising ResponseFormatError, which keeps the raw reply
+        as ``response_content``) are dropped from the cache so the next request
+        asks again.
+        """
+        logger.debug("Raw OpenAI response content: %s", content)
         try:
-            content = response.choices[0].message.content
-            logger.info("Raw OpenAI response content: %s", content)
-            
-            # If the response is wrapped in a code block, extract just the JSON
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-                
-            result = json.loads(content)
-            return result
-        except json.JSONDecodeError as e:
-            # Store the raw response content for debugging
-            error = ValueError("Failed to parse OpenAI response as JSON")
-            error.response_content = response.choices[0].message.content
-            logger.error("JSON parsing error: %s", str(e))
-            logger.error("Failed to parse response: %s", response.choices[0].message.content)
-            raise error
+            return parse_json(content, INFERENCE_SCHEMA, stats=self.parse_stats)
+        except ResponseFormatError as e:
+            logger.error("Failed to parse OpenAI response (%s): %s", e, content)
+            if cache_key is not None and self.cache is not None:
+                self.cache.discard(cache_key)
+            raise
+
+    def settings(self):
+        """The settings, besides temperature, that change what a request sends."""
+        return {'model': self.model, 'json_mode': self.json_mode,
+                'prompt_token_budget': self.prompt_builder.token_budget if self.prompt_builder is not None else None}
+
+    def infer_data_structure(self, js_file_path, temperature=0):
+        """Analyze D3 visualization code and infer the expected data structure."""
+        code = self.extract_visualization_code(js_file_path)
+        messages = self.build_messages(code)
+        params = dict(temperature=temperature, **response_format(self.json_mode))
+
+        for attempt in range(PARSE_RETRIES + 1):
+            key = None
+            if self.cache is not None:
+                content, key = self.cache.complete(self.client, self.model, messages, **params)
+            else:
+                with span('API call', file=str(js_file_path)):
+                    response = self.client.chat.completions.create(model=self.model, messages=messages, **params)
+                record_usage(response.usage)
+                content = response.choices[0].message.content
+            try:
+                with span('parse'):
+                    return self.parse_response(content, key)
+            except ResponseFormatError:
+                if attempt == PARSE_RETRIES:
+                    raise
+                count('parse retries')
+                logger.info("Re-requesting %s after an unusable reply", js_file_path)
+
+    async def infer_data_structure_async(self, js_file_path, temperature=0, client=None, limiter=None):
+        """Async variant of infer_data_structure sharing ``client`` and ``limiter`` across calls."""
+        code = self.extract_visualization_code(js_file_path)
+        messages = self.build_messages(code)
+        params = dict(temperature=temperature, **response_format(self.json_mode))
+        if client is None:
+            async with openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url) as client:
+                return await self._infer_async(js_file_path, messages, params, client, limiter)
+        return await self._infer_async(js_file_path, messages, params, client, limiter)
+
+    async def _infer_async(self, js_file_path, messages, params, client, limiter):
+        for attempt in range(PARSE_RETRIES + 1):
+            key = None
+            content = None
+            if self.cache is not None:
+                key = self.cache.key(self.model, messages, **params)
+                content = self.cache.get(key)
+            if content is None:
+                content = await self._request_async(client, messages, params, limiter, key)
+            try:
+                with span('parse'):
+                    return self.parse_response(content, key)
+            except ResponseFormatError:
+                if attempt == PARSE_RETRIES:
+                    raise
+                count('parse retries')
+                logger.info("Re-requesting %s after an unusable reply", js_file_path)
+
+    async def _request_async(self, client, messages, params, limiter, key):
+        if limiter is not None:
+            prompt_tokens = sum(estimate_tokens(message['content']) for message in messages)
+            with span('rate limit wait'):
+                await limiter.acquire(prompt_tokens + EXPECTED_COMPLETION_TOKENS)
+        with span('API call'):
+            response = await client.chat.completions.create(model=self.model, messages=messages, **params)
+        record_usage(response.usage)
+        content = response.choices[0].message.content
+        if key is not None:
+            self.cache.put(key, content, model=self.model)
+        return content
+
+    async def infer_many(self, js_file_paths, concurrency=8, temperature=0,
+                         requests_per_minute=None, tokens_per_minute=None):
+        """Infer data structures for many files concurrently.
+
+        Yields ``(path, result, error)`` tuples in completion order; exactly one
+        of ``result`` and ``error`` is None. At most ``concurrency`` requests are
+        in flight, all sharing one async client and one rate limiter.
+        """
+        limiter = None
+        if requests_per_minute or tokens_per_minute:
+            limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(client, path):
+            async with semaphore:
+                try:
+                    result = await self.infer_data_structure_async(path, temperature, client=client, limiter=limiter)
+                    return path, result, None
+                except Exception as e:
+                    return path, None, e
+
+        async with openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url) as client:
+            tasks = [asyncio.ensure_future(run(client, path)) for path in js_file_paths]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    yield await next_done
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    def infer_all(self, js_file_paths, **options):
+        """Run infer_many to completion from synchronous code; returns {path: result or exception}."""
+        async def collect():
+            results = {}
+            async for path, result, error in self.infer_many(js_file_paths, **options):
+                results[path] = error if error is not None else result
+            return results
+        return asyncio.run(collect())
 
     def save_sample_data(self, data, output_path):
         """Save the sample data to a JSON file."""
@@ -83,18 +223,25 @@ def main():
     parser.add_argument('visualization_file', help='Path to D3 visualization JavaScript file')
     parser.add_argument('--output', '-o', help='Output path for sample data JSON')
     parser.add_argument('--api-key', help='OpenAI API key (optional, can use OPENAI_API_KEY env var)')
+    parser.add_argument('--base-url', help='OpenAI-compatible API base URL (optional, can use OPENAI_BASE_URL env var)')
     parser.add_argument('--temperature', type=float, default=0, help='Temperature parameter for OpenAI model (default: 0)')
-    
+    add_json_mode_argument(parser)
+    add_cache_arguments(parser)
+    add_prompt_arguments(parser)
+    add_instrumentation_arguments(parser)
+
     args = parser.parse_args()
-    
-    inferer = D3DataInferer(api_key=args.api_key)
-    result = inferer.infer_data_structure(args.visualization_file, temperature=args.temperature)
-    
+
+    inferer = D3DataInferer(api_key=args.api_key, base_url=args.base_url, cache=cache_from_args(args),
+                            prompt_builder=builder_from_args(args), json_mode=not args.no_json_mode)
+    with instrumented_run(args):
+        result = inferer.infer_data_structure(args.visualization_file, temperature=args.temperature)
+
     print("\nInferred Data Structure:")
     print(result['data_structure'])
     print("\nExplanation:")
     print(result['explanation'])
-    
+
     if args.output:
         inferer.save_sample_data(result['sample_data'], args.output)
         print(f"\nSample data saved to: {args.output}")
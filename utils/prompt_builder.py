@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+import bisect
+import argparse
+import threading
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.js_extract import tokenize, IDENT, PUNCT, TEMPLATE, INLINE_DATA_NAME
+from utils.rate_limit import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a character-based estimate
+    tiktoken = None
+
+# Token kind for notes the builder adds to the code (elided literal items).
+NOTE = 'note'
+
+DEFAULT_TOKEN_BUDGET = 12000
+DEFAULT_MODEL = "gpt-4o"
+
+# Array literals longer than this are cut down to their first few items once a
+# file is over budget; the items still show the data shape.
+MAX_LITERAL_ITEMS = 5
+
+# Identifier weights used to rank code sections by how much they reveal about
+# the data the visualization expects.
+SECTION_WEIGHTS = {
+    # loading and binding
+    'data': 5, 'datum': 5, 'join': 4, 'enter': 4, 'exit': 2, 'merge': 2,
+    'csv': 5, 'tsv': 5, 'json': 5, 'dsv': 5, 'fetch': 4, 'dataUrl': 5,
+    # reshaping
+    'group': 3, 'groups': 3, 'rollup': 3, 'rollups': 3, 'index': 2, 'nest': 3, 'key': 2, 'entries': 2,
+    'stack': 3, 'hierarchy': 4, 'stratify': 4, 'pie': 3, 'sort': 1, 'filter': 1, 'map': 1, 'forEach': 1,
+    'timeParse': 4, 'utcParse': 4, 'parseFloat': 3, 'parseInt': 3, 'Number': 2, 'Date': 2,
+    # scales and axes
+    'scaleLinear': 4, 'scaleBand': 4, 'scaleOrdinal': 3, 'scaleTime': 4, 'scaleUtc': 4, 'scaleLog': 3,
+    'scaleSqrt': 3, 'scalePoint': 3, 'scaleSequential': 3, 'scaleQuantize': 3, 'scaleThreshold': 3,
+    'domain': 4, 'range': 2, 'extent': 4, 'max': 3, 'min': 3, 'sum': 3, 'mean': 3, 'median': 3,
+    'axisBottom': 2, 'axisLeft': 2, 'axisTop': 2, 'axisRight': 2, 'tickFormat': 1,
+    # generators and geo
+    'line': 2, 'area': 2, 'arc': 2, 'link': 2, 'geoPath': 3, 'feature': 4, 'mesh': 3, 'contours': 3,
+    'density2D': 3, 'projection': 2, 'fitSize': 2,
+    # selections
+    'selectAll': 2, 'select': 1, 'append': 1, 'attr': 1, 'text': 1, 'style': 0.5,
+}
+# Accessor parameters whose property reads (d.value, row.date) name data fields.
+ACCESSOR_NAMES = {'d', 'datum', 'row', 'item', 'record', 'feature', 'node', 'link'}
+ACCESSOR_WEIGHT = 3
+# Inline datasets and dataUrl assignments are the best evidence of the data shape.
+DATA_DECLARATION_WEIGHT = 1000
+
+_WORD_CHAR = re.compile(r'[\w$]')
+# Token pairs that would fuse into a different token without a space between them.
+_FUSING_PAIRS = {'++', '--', '+-', '-+', '//', '/*', '*/', '..', '<!', '!-'}
+_CONTINUATION_START = {'.', '?.', ')', ']', ',', ':', '?', '=>', '&&', '||', '??', '+', '-', '*', '/',
+                       '%', '=', '==', '===', '!=', '!==', '<', '>', '<=', '>=', '(', '['}
+_CONTINUATION_END = {'(', '[', ',', '=', '=>', '&&', '||', '??', '+', '-', '*', '/', '%', '?', ':',
+                     '==', '===', '!=', '!==', '<', '>', '<=', '>=', '.', '?.', '+=', '-='}
+_BLOCK_KEYWORDS = {'else', 'try', 'finally', 'do'}
+_OMITTED = "/* ... */"
+
+
+_encodings = {}
+
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    """Count tokens with tiktoken when installed, otherwise estimate them."""
+    if tiktoken is None:
+        return estimate_tokens(text)
+    encoding = _encodings.get(model)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding('o200k_base')
+        _encodings[model] = encoding
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _token_end(token):
+    if token[0] == TEMPLATE:
+        return token[2] + len(token[1]) + 2
+    return token[2] + len(token[1])
+
+
+def _source(content, token):
+    return content[token[2]:_token_end(token)]
+
+
+def _needs_space(left, right):
+    if _WORD_CHAR.match(left[-1]) and _WORD_CHAR.match(right[0]):
+        return True
+    return left[-1] + right[0] in _FUSING_PAIRS
+
+
+def render(content, tokens, start=0, stop=None):
+    """Re-emit tokens without comments or indentation.
+
+    A line break is kept wherever the source had one between two tokens, so
+    automatic semicolon insertion still reads the same.
+    """
+    stop = len(tokens) if stop is None else stop
+    parts = []
+    prev_text = None
+    prev_end = None
+    for i in range(start, stop):
+        token = tokens[i]
+        text = _source(content, token)
+        if prev_text is not None:
+            if '\n' in content[prev_end:token[2]]:
+                parts.append('\n')
+            elif _needs_space(prev_text, text):
+                parts.append(' ')
+        parts.append(text)
+        prev_text = text
+        prev_end = _token_end(token)
+    return ''.join(parts)
+
+
+def _matching_brackets(tokens):
+    """Map the index of every '[' to the index of its ']'."""
+    matches = {}
+    stack = []
+    for i, token in enumerate(tokens):
+        if token[0] != PUNCT:
+            continue
+        if token[1] in ('[', '(', '{'):
+            stack.append(i)
+        elif token[1] in (']', ')', '}') and stack:
+            opener = stack.pop()
+            if tokens[opener][1] == '[' and token[1] == ']':
+                matches[opener] = i
+    return matches
+
+
+def truncate_literals(content, tokens, max_items=MAX_LITERAL_ITEMS):
+    """Return (content, tokens) with long array literals cut to ``max_items`` items."""
+    matches = _matching_brackets(tokens)
+    pieces = []
+    markers = []
+    cursor = 0
+    i = 0
+    while i < len(tokens):
+        close = matches.get(i)
+        if close is None:
+            i += 1
+            continue
+        # Top-level commas inside the literal
+        commas = []
+        depth = 0
+        for j in range(i + 1, close):
+            kind, text = tokens[j][0], tokens[j][1]
+            if kind != PUNCT:
+                continue
+            if text in ('[', '(', '{'):
+                depth += 1
+            elif text in (']', ')', '}'):
+                depth -= 1
+            elif text == ',' and depth == 0:
+                commas.append(j)
+        items = len(commas) + (0 if commas and commas[-1] == close - 1 else 1)
+        if items <= max_items:
+            i += 1
+            continue
+        cut = tokens[commas[max_items - 1]][2] + 1
+        pieces.append(content[cursor:cut])
+        offset = sum(len(piece) for piece in pieces) + 1
+        marker = f"/* {items - max_items} more items */"
+        pieces.append(f" {marker} ")
+        markers.append((NOTE, marker, offset))
+        cursor = tokens[close][2]
+        i = close + 1
+    if not pieces:
+        return content, tokens
+    pieces.append(content[cursor:])
+    trimmed = ''.join(pieces)
+    # The tokenizer drops comments, so the markers go back in as NOTE tokens.
+    tokens = tokenize(trimmed, strict=False)
+    for marker in markers:
+        tokens.insert(bisect.bisect_left(tokens, marker[2], key=lambda token: token[2]), marker)
+    return trimmed, tokens
+
+
+def _opens_block(prev):
+    """Whether a '{' after ``prev`` opens a statement block rather than an object literal."""
+    if prev is None:
+        return True
+    if prev[0] == PUNCT:
+        return prev[1] in (')', '=>', ';', '{', '}')
+    return prev[0] == IDENT and prev[1] in _BLOCK_KEYWORDS
+
+
+def split_sections(content, tokens):
+    """Split tokens into statement-sized sections.
+
+    Sections only break at statement level: inside a block, never inside
+    parentheses, brackets or object literals (but again inside a callback's
+    block, so ``d3.csv(url).then(data => { ... })`` bodies still split).
+
+    Returns ``(sections, parents, closers)``: (start, stop) token ranges, the
+    index of the block-header section enclosing each section (or None), and a
+    map from each header section to the section holding its closing brace.
+    """
+    sections = []
+    parents = []
+    closers = {}
+    start = 0
+    stack = []  # 'block', 'object', '(' or '['
+    headers = []  # header section index of each open block
+    parent = None
+    for i, token in enumerate(tokens[:-1]):
+        kind, text = token[0], token[1]
+        closed_block = False
+        if kind == PUNCT:
+            if text == '{':
+                stack.append('block' if _opens_block(tokens[i - 1] if i else None) else 'object')
+                if stack[-1] == 'block':
+                    headers.append(len(sections))
+            elif text in ('(', '['):
+                stack.append(text)
+            elif text in ('}', ')', ']') and stack:
+                closed_block = stack.pop() == 'block'
+                if closed_block and headers:
+                    closers[headers.pop()] = len(sections)
+        if stack and stack[-1] != 'block':
+            continue
+
+        following = tokens[i + 1]
+        if kind == PUNCT and (text == ';' or (text == '{' and stack and stack[-1] == 'block')):
+            boundary = True
+        elif closed_block:
+            boundary = not (following[0] == PUNCT and following[1] in _CONTINUATION_START)
+        else:
+            boundary = ('\n' in content[_token_end(token):following[2]]
+                        and not (kind == PUNCT and text in _CONTINUATION_END)
+                        and not (following[0] == PUNCT and following[1] in _CONTINUATION_START))
+        if boundary:
+            sections.append((start, i + 1))
+            parents.append(parent)
+            start = i + 1
+            parent = headers[-1] if headers else None
+    if tokens:
+        sections.append((start, len(tokens)))
+        parents.append(parent)
+    return sections, parents, closers
+
+
+def score_section(tokens, start, stop):
+    score = 0.0
+    for i in range(start, stop):
+        token = tokens[i]
+        if token[0] != IDENT:
+            continue
+        if (INLINE_DATA_NAME.match(token[1]) or token[1] == 'dataUrl') \
+                and i + 1 < stop and tokens[i + 1][1] == '=':
+            score += DATA_DECLARATION_WEIGHT
+        score += SECTION_WEIGHTS.get(token[1], 0)
+        if token[1] in ACCESSOR_NAMES and i + 1 < stop and tokens[i + 1][1] == '.':
+            score += ACCESSOR_WEIGHT
+    return score
+
+
+def _is_trivial(tokens, start, stop):
+    """Sections of bare punctuation (stray ';', ',') are dropped without a marker."""
+    return all(token[0] == PUNCT and token[1] not in ('{', '}') for token in tokens[start:stop])
+
+
+def truncate_text(text, budget, model=DEFAULT_MODEL):
+    """Keep leading lines of plain text (reports, explanations) within ``budget`` tokens."""
+    if count_tokens(text, model) <= budget:
+        return text
+    lines = text.splitlines()
+    kept = []
+    used = 0
+    for line in lines:
+        cost = count_tokens(line, model) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    kept.append(f"[... {len(lines) - len(kept)} more lines truncated]")
+    return '\n'.join(kept)
+
+
+class PromptBuilder:
+    """Fits visualization sources into a per-request token budget.
+
+    Code is minified through the js_extract tokenizer; if it is still over
+    budget, long array literals are shortened and then the statements that say
+    most about the data (loading, binding, scales, accessors) are kept in
+    source order with the rest elided. Tokens saved per file are recorded in
+    ``stats`` for format_report().
+    """
+
+    def __init__(self, token_budget=DEFAULT_TOKEN_BUDGET, model=DEFAULT_MODEL):
+        self.token_budget = token_budget
+        self.model = model
+        self._init_stats()
+
+    def _init_stats(self):
+        self._lock = threading.Lock()
+        self.stats = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_lock', None)
+        state['stats'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_stats()
+
+    def count(self, text):
+        return count_tokens(text, self.model)
+
+    def _record(self, name, original, final, dropped=0):
+        with self._lock:
+            self.stats.append({'name': name, 'original': original, 'final': final, 'dropped_sections': dropped})
+
+    def trim_code(self, content, name='<code>', budget=None):
+        """Return ``content`` minified and, if needed, cut down to ``budget`` tokens."""
+        budget = self.token_budget if budget is None else budget
+        original = self.count(content)
+        tokens = tokenize(content, strict=False)
+        code = render(content, tokens)
+        if self.count(code) > budget:
+            content, tokens = truncate_literals(content, tokens)
+            code = render(content, tokens)
+        dropped = 0
+        if self.count(code) > budget:
+            code, dropped = self._select_sections(content, tokens, budget)
+        self._record(name, original, self.count(code), dropped)
+        return code
+
+    def _select_sections(self, content, tokens, budget):
+        sections, parents, closers = split_sections(content, tokens)
+        rendered = [render(content, tokens, start, stop) for start, stop in sections]
+        costs = [self.count(text) + 1 for text in rendered]
+        marker_cost = self.count(_OMITTED) + 1
+        trivial = {i for i, (start, stop) in enumerate(sections) if _is_trivial(tokens, start, stop)}
+
+        ranked = sorted((i for i in range(len(sections)) if i not in trivial),
+                        key=lambda i: (-score_section(tokens, *sections[i]) / costs[i], i))
+        keep = set()
+        added = []  # groups in the order they were kept
+        used = marker_cost
+        for i in ranked:
+            if i in keep:
+                continue
+            # A section brings its enclosing block headers and their closing braces.
+            group = []
+            node = i
+            while node is not None and node not in keep:
+                group.append(node)
+                if node in closers:
+                    group.append(closers[node])
+                node = parents[node]
+            group = [j for j in dict.fromkeys(group) if j not in keep]
+            # Charge every kept section for a possible elision marker before it.
+            cost = sum(costs[j] + marker_cost for j in group)
+            if used + cost <= budget:
+                keep.update(group)
+                added.append(group)
+                used += cost
+
+        code = self._join_sections(rendered, keep, trivial)
+        # Token counts are not exactly additive; drop the weakest sections until it fits.
+        while self.count(code) > budget and len(added) > 1:
+            keep.difference_update(added.pop())
+            code = self._join_sections(rendered, keep, trivial)
+        # A single statement larger than the whole budget: hard cut.
+        while code and self.count(code) > budget:
+            code = code[:int(len(code) * budget / self.count(code) * 0.95)]
+        return code, len(sections) - len(keep)
+
+    @staticmethod
+    def _join_sections(rendered, keep, trivial):
+        lines = []
+        omitted = False
+        for i, text in enumerate(rendered):
+            if i in keep:
+                lines.append(text)
+                omitted = False
+            elif not omitted and i not in trivial:
+                lines.append(_OMITTED)
+                omitted = True
+        return '\n'.join(lines)
+
+    def fit_context(self, context, report_share=0.3, explanation_share=0.15):
+        """Trim a generate_queries context dict so the whole prompt fits the budget.
+
+        The data report and explanation are capped at fixed shares of the budget
+        and the code gets whatever they leave.
+        """
+        name = context.get('name', '<context>')
+        report = truncate_text(context.get('report') or '', int(self.token_budget * report_share), self.model)
+        explanation = truncate_text(context.get('explanation') or '', int(self.token_budget * explanation_share),
+                                    self.model)
+        code_budget = self.token_budget - self.count(report) - self.count(explanation)
+        fitted = dict(context)
+        fitted['report'] = report
+        fitted['explanation'] = explanation
+        fitted['js_content'] = self.trim_code(context.get('js_content') or '', name=name, budget=code_budget)
+        return fitted
+
+    def format_report(self, only_trimmed=False):
+        lines = [f"{'file':<48} {'tokens':>9} {'sent':>9} {'saved':>7}"]
+        total_original = total_final = 0
+        for stat in self.stats:
+            total_original += stat['original']
+            total_final += stat['final']
+            if only_trimmed and stat['final'] >= stat['original']:
+                continue
+            saved = 1 - stat['final'] / stat['original'] if stat['original'] else 0
+            name = stat['name'] if len(stat['name']) <= 48 else '...' + stat['name'][-45:]
+            lines.append(f"{name:<48} {stat['original']:>9,} {stat['final']:>9,} {saved:>7.0%}")
+        saved = 1 - total_final / total_original if total_original else 0
+        lines.append(f"{'total (' + str(len(self.stats)) + ' files)':<48} {total_original:>9,} {total_final:>9,} {saved:>7.0%}")
+        return '\n'.join(lines)
+
+
+def add_prompt_arguments(parser):
+    """Register the prompt budget flags shared by the scripts that send code to the API."""
+    parser.add_argument('--prompt-token-budget', type=int, default=DEFAULT_TOKEN_BUDGET,
+                        help=f'Trim code in prompts to this many tokens; 0 sends files unmodified (default: {DEFAULT_TOKEN_BUDGET})')
+
+
+def builder_from_args(args):
+    return PromptBuilder(args.prompt_token_budget) if args.prompt_token_budget else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show how visualization sources are trimmed to a prompt token budget')
+    parser.add_argument('js_files', nargs='+', help='JavaScript files to trim')
+    parser.add_argument('--budget', type=int, default=DEFAULT_TOKEN_BUDGET, help=f'Token budget per file (default: {DEFAULT_TOKEN_BUDGET})')
+    parser.add_argument('--show', action='store_true', help='Print the trimmed code')
+    args = parser.parse_args()
+
+    builder = PromptBuilder(args.budget)
+    for path in args.js_files:
+        with open(path, 'r') as f:
+            code = builder.trim_code(f.read(), name=path)
+        if args.show:
+            print(f"// {path}\n{code}\n")
+    print(f"Token counts via {'tiktoken' if tiktoken is not None else 'character estimate'}")
+    print(builder.format_report())
+
+
+if __name__ == "__main__":
+    main()
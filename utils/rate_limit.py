@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import re
+import time
+import random
+import asyncio
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_SECONDS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value):
+    """Parse rate-limit reset durations such as '1s', '6m0s' or '20ms' into seconds."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_SECONDS[unit] for amount, unit in parts)
+
+
+def retry_after(headers):
+    """Seconds a 429/503 response asks us to wait, if it says."""
+    for name in ('retry-after-ms', 'Retry-After-Ms'):
+        if headers.get(name):
+            return parse_duration(headers[name] + 'ms')
+    return parse_duration(headers.get('retry-after') or headers.get('Retry-After'))
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for rate-limit budgeting."""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Continuous-refill bucket holding up to ``capacity`` units, refilled per minute."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until ``amount`` units are available (0 if they are now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+    def give(self, amount):
+        """Return over-reserved units (or charge more when ``amount`` is negative)."""
+        self._refill()
+        self.available = min(self.capacity, self.available + amount)
+
+    def set_limit(self, per_minute):
+        self._refill()
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = min(self.available, self.capacity)
+
+    def observe_remaining(self, remaining):
+        """Clamp to the server's view; it also counts requests from other clients."""
+        self._refill()
+        self.available = min(self.available, float(remaining))
+
+
+class AsyncRateLimiter:
+    """Request- and token-per-minute limiter shared by concurrent coroutines.
+
+    Either limit may be None to leave that dimension unlimited.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens=0):
+        async with self._lock:
+            while True:
+                wait = 0.0
+                if self.requests:
+                    wait = max(wait, self.requests.wait_time(1))
+                if self.tokens and tokens:
+                    wait = max(wait, self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens and tokens:
+                self.tokens.take(tokens)
+
+    def reconcile_tokens(self, reserved, used):
+        """Correct a token reservation once the response reports actual usage."""
+        if self.tokens and used is not None:
+            self.tokens.give(reserved - used)
+
+    def update_from_headers(self, headers):
+        """Adopt the limits and remaining budget reported in x-ratelimit-* headers."""
+        for name, attr in (('requests', 'requests'), ('tokens', 'tokens')):
+            limit = headers.get(f'x-ratelimit-limit-{name}')
+            remaining = headers.get(f'x-ratelimit-remaining-{name}')
+            bucket = getattr(self, attr)
+            try:
+                if limit is not None:
+                    limit = int(limit)
+                    if bucket is None:
+                        bucket = TokenBucket(limit)
+                        setattr(self, attr, bucket)
+                    elif bucket.capacity != limit:
+                        bucket.set_limit(limit)
+                if bucket is not None and remaining is not None:
+                    bucket.observe_remaining(int(remaining))
+            except ValueError:
+                continue
+
+
+class AdaptiveConcurrency:
+    """Additive-increase/multiplicative-decrease cap on in-flight requests.
+
+    Every success raises the limit by about one per window's worth of
+    completions up to ``maximum``; a 429 or 5xx halves it (at most once per
+    ``cooldown`` seconds so a burst of failures counts once) and can pause new
+    requests for a Retry-After interval.
+    """
+
+    def __init__(self, maximum, initial=None, minimum=1, cooldown=2.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(initial or maximum)
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.peak = 0
+        self.backoffs = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        while True:
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with self._condition:
+                await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+                if self._paused_until <= time.monotonic():
+                    self.in_flight += 1
+                    self.peak = max(self.peak, self.in_flight)
+                    return
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def slot(self):
+        return _Slot(self)
+
+    def success(self):
+        self.limit = min(self.maximum, self.limit + 1.0 / max(1.0, self.limit))
+
+    def backoff(self, delay=None):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+            self.backoffs += 1
+        if delay:
+            self._paused_until = max(self._paused_until, now + delay)
+
+
+class _Slot:
+    def __init__(self, controller):
+        self.controller = controller
+
+    async def __aenter__(self):
+        await self.controller.acquire()
+
+    async def __aexit__(self, *exc):
+        await self.controller.release()
+
+
+def backoff_delay(attempt, base=0.5, cap=60.0):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
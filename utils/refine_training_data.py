@@ -1,20 +1,43 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import json
 import openai
+import hashlib
+import itertools
 import logging
 import time
 import asyncio
+import argparse
 import aiohttp
 from pathlib import Path
 from tqdm import tqdm
-from typing import List, Dict, Any
+from collections import Counter
+from typing import Iterable, List, Dict, Any, Optional
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.jsonl_io import RecordWriter, count_records, is_jsonl, iter_records
+from utils.source_store import example_source, example_source_id, load_sources, source_id, sources_path_for
+from utils.d3_features import add_sample_arguments, index_from_args, sample_from_args
+from utils.js_validate import add_validation_arguments, check_parser, validate_output
+from utils.batch_jobs import BatchRun, add_batch_arguments, backend_from_args
+from utils.instrumentation import add_instrumentation_arguments, count, instrumented_run, record_usage, span
+from utils.llm_cache import CacheMiss, LLMCache, add_cache_arguments, cache_from_args
+from utils.llm_response import (GROUP_REFINE_SCHEMA, PARSE_RETRIES, REFINE_SCHEMA, ResponseFormatError,
+                                add_json_mode_argument, format_stats, parse_json, response_format)
+from utils.rate_limit import AsyncRateLimiter, AdaptiveConcurrency, backoff_delay, estimate_tokens, retry_after
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+# Completion tokens reserved per request until the response reports real usage.
+EXPECTED_COMPLETION_TOKENS = 2000
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+FAILED_QUERIES_NAME = 'failed_queries.json'
+
 SYSTEM_PROMPT = """You are an expert software engineer specializing in data visualization. Your task is to analyze training data made to train LLMs for D3 visualizations - and generate high-quality, production-ready D3.js rebuilds of the provided json training data. For each request, follow these steps:
 
 1. Analyze the Input-Output Pattern
@@ -65,28 +88,237 @@ For example:
 Remember to maintain proper JSON escaping for the code in the output field. Your response should be valid JSON that could be directly used for training an LLM.
 
 """
+
+def example_id(example: Dict[str, Any]) -> str:
+    """Stable ID for a training example: a hash of its input and output (or the source it references)."""
+    payload = json.dumps([example.get('input'), example.get('output', example.get('source_id'))], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class RefineJournal:
+    """Append-only JSON-lines record of finished examples, kept beside the output file.
+
+    Every line holds one example ID with either its refined result or its
+    failure, flushed to disk as soon as the example finishes. A later entry
+    for the same ID supersedes an earlier one, so a retried failure that
+    succeeds replaces it. Only IDs and line numbers are kept in memory;
+    finalize() streams the surviving entries into the output and the
+    failures file.
+    """
+
+    def __init__(self, output_file):
+        self.output_file = str(output_file)
+        self.path = self.output_file + '.journal'
+        # Example ID -> journal line holding its latest entry.
+        self.completed: Dict[str, int] = {}
+        self.failed: Dict[str, int] = {}
+        self._lines = 0
+        self._file = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _entries(self):
+        with open(self.path, 'r') as f:
+            for number, line in enumerate(f, 1):
+                self._lines = number
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    entry['id']
+                except (json.JSONDecodeError, KeyError):
+                    # A crash can leave the last line half-written; that example is simply redone.
+                    logger.warning(f"Ignoring unreadable line {number} of {self.path}")
+                    continue
+                yield number, entry
+
+    def load(self) -> 'RefineJournal':
+        if self.exists():
+            for number, entry in self._entries():
+                self._apply(entry, number)
+        return self
+
+    def _apply(self, entry: Dict[str, Any], number: int) -> None:
+        if 'result' in entry:
+            self.completed[entry['id']] = number
+            self.failed.pop(entry['id'], None)
+        else:
+            self.failed[entry['id']] = number
+
+    def open(self, append: bool) -> None:
+        """Start writing; ``append`` keeps earlier entries, otherwise the journal starts empty."""
+        torn = False
+        if append and self.exists() and os.path.getsize(self.path):
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+        else:
+            self.completed.clear()
+            self.failed.clear()
+            self._lines = 0
+        self._file = open(self.path, 'a' if append else 'w')
+        if torn:
+            self._file.write('\n')
+
+    def record(self, key: str, result: Dict[str, Any]) -> None:
+        entry = {'id': key, 'failure': result} if 'error' in result else {'id': key, 'result': result}
+        self._lines += 1
+        self._apply(entry, self._lines)
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def finalize(self) -> Path:
+        """Atomically write the output and failed_queries.json from the journal's latest entries."""
+        failed_file = Path(self.output_file).parent / FAILED_QUERIES_NAME
+        with RecordWriter(self.output_file) as output, RecordWriter(failed_file, jsonl=False) as failures:
+            for number, entry in self._entries():
+                if self.completed.get(entry['id']) == number:
+                    output.write(entry['result'])
+                elif self.failed.get(entry['id']) == number:
+                    failures.write(entry['failure'])
+            if not failures.count:
+                failures.abort()
+        if not self.failed and failed_file.exists():
+            failed_file.unlink()
+        return failed_file
+
+
 class BatchProcessor:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, cache: Optional[LLMCache] = None, base_url: Optional[str] = None,
+                 max_retries: int = 5, json_mode: bool = True, validate_js: bool = True, js_parser: str = 'auto'):
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OpenAI API key must be provided or set in OPENAI_API_KEY environment variable")
         openai.api_key = self.api_key
+        self.cache = cache
+        self.api_url = (base_url or os.getenv("OPENAI_BASE_URL") or DEFAULT_API_BASE).rstrip('/') + "/chat/completions"
+        self.max_retries = max_retries
+        self.json_mode = json_mode
+        # Refined code must parse and export createVisualization (see utils/js_validate.py).
+        if validate_js:
+            check_parser(js_parser)
+        self.validate_js = validate_js
+        self.js_parser = js_parser
+        self.parse_stats = Counter()
+        self.limiter = AsyncRateLimiter()
+        self.concurrency = AdaptiveConcurrency(8)
+        # source_id -> code for examples that reference a deduplicated source.
+        self.sources: Optional[Dict[str, str]] = None
 
-    async def process_example(self, session: aiohttp.ClientSession, example: Dict[str, Any]) -> Dict[str, Any]:
-        """Process a single example using the OpenAI API."""
-        try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
+    def load_sources(self, sources_file: Optional[str], training_file: str) -> None:
+        """Load ``sources_file``, or the sources file stored beside ``training_file`` if there is one."""
+        if sources_file is None:
+            sources_file = sources_path_for(training_file)
+            if not os.path.exists(sources_file):
+                return
+        self.sources = load_sources(sources_file)
+        logger.info(f"Loaded {len(self.sources)} sources from {sources_file}")
+
+    async def request_completion(self, session: aiohttp.ClientSession, data: Dict[str, Any]) -> Dict[str, Any]:
+        """POST a chat completion under the shared rate limiter and concurrency window.
+
+        429 and 5xx responses shrink the window and are retried with backoff
+        (honouring Retry-After); every response's x-ratelimit-* headers re-tune
+        the limiter.
+        """
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        reserved = sum(estimate_tokens(message['content']) for message in data['messages']) + EXPECTED_COMPLETION_TOKENS
+        body = json.dumps(data).encode('utf-8')
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                count('API retries')
+            async with self.concurrency.slot():
+                with span('rate limit wait'):
+                    await self.limiter.acquire(reserved)
+                with span('API call', attempt=attempt):
+                    async with session.post(self.api_url, headers=headers, data=body) as response:
+                        self.limiter.update_from_headers(response.headers)
+                        raw = await response.read()
+                        count('bytes sent', len(body))
+                        count('bytes received', len(raw))
+                        if response.status == 200:
+                            result = json.loads(raw)
+                        else:
+                            error = f"HTTP {response.status}: {raw[:200].decode('utf-8', 'replace')}"
+                            if response.status not in RETRY_STATUSES:
+                                raise RuntimeError(error)
+                            wait = retry_after(response.headers)
+                            self.concurrency.backoff(wait if wait is not None else backoff_delay(attempt))
+                            continue
+            self.concurrency.success()
+            usage = result.get('usage') or {}
+            record_usage(usage)
+            self.limiter.reconcile_tokens(reserved, usage.get('total_tokens'))
+            return result
+        raise RuntimeError(f"Giving up after {self.max_retries + 1} attempts: {error}")
+
+    def request_body(self, user_prompt: str) -> Dict[str, Any]:
+        """Chat completion request for ``user_prompt``, as sent directly or in a batch job."""
+        return {
+            "model": "gpt-4o",
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            "temperature": 0,
+            **response_format(self.json_mode)
+        }
+
+    def cache_key(self, data: Dict[str, Any]) -> Optional[str]:
+        if self.cache is None:
+            return None
+        params = {name: value for name, value in data.items() if name not in ('model', 'messages')}
+        return self.cache.key(data['model'], data['messages'], **params)
+
+    async def complete(self, session: aiohttp.ClientSession, user_prompt: str):
+        """Return (model response text, cache key) for ``user_prompt``, consulting the cache first."""
+        data = self.request_body(user_prompt)
+        cache_key = self.cache_key(data)
+        model_response = self.cache.get(cache_key) if cache_key is not None else None
+
+        if model_response is None:
+            result = await self.request_completion(session, data)
+            model_response = result['choices'][0]['message']['content']
+            if cache_key is not None:
+                self.cache.put(cache_key, model_response, model=data['model'])
+
+        return model_response, cache_key
+
+    def refined_example(self, example: Dict[str, Any], refined_input: str, refined_output: str,
+                        code: str) -> Dict[str, Any]:
+        """Result record; deduplicated examples keep referencing their source instead of repeating it."""
+        result = {"input": refined_input, "output": refined_output}
+        if 'source_id' in example and 'output' not in example:
+            result['source_id'] = example['source_id']
+        else:
+            result['original_output'] = code
+        return result
+
+    def unit_prompt(self, examples: List[Dict[str, Any]], code: str) -> str:
+        """User prompt refining ``examples``, which all share the implementation ``code``.
+
+        One example gets a single variation; several get one variation each
+        and a single refined implementation they all share.
+        """
+        if len(examples) == 1:
             # Create a prompt that includes both input and original output
-            user_prompt = f"""Analyze this D3.js visualization example and provide a refined version.
+            return f"""Analyze this D3.js visualization example and provide a refined version.
 
-Original Request: {example['input']}
+Original Request: {examples[0]['input']}
 
 Original D3.js Implementation:
-{example['output']}
+{code}
 
 Provide your response in the following JSON format EXACTLY (no additional text before or after):
 {{
@@ -100,164 +332,456 @@ IMPORTANT:
 3. Properly escape all quotes and newlines in the JSON
 4. Include the complete implementation in the output field"""
 
-            data = {
-                "model": "gpt-4o",
-                "messages": [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "temperature": 0
-            }
-            
-            async with session.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=data
-            ) as response:
-                result = await response.json()
-                model_response = result['choices'][0]['message']['content']
-                
-                # Debug: Log the raw response
-                logger.debug(f"Raw model response:\n{model_response}")
-                
-                # Try to parse the model's response as JSON
-                try:
-                    # Strip any potential markdown code block indicators
-                    cleaned_response = model_response.strip()
-                    if cleaned_response.startswith('```json'):
-                        cleaned_response = cleaned_response[7:]
-                    if cleaned_response.endswith('```'):
-                        cleaned_response = cleaned_response[:-3]
-                    cleaned_response = cleaned_response.strip()
-                    
-                    parsed_response = json.loads(cleaned_response)
-                    
-                    # Validate the response has the required fields
-                    if not isinstance(parsed_response, dict) or \
-                       'input' not in parsed_response or \
-                       'output' not in parsed_response:
-                        raise ValueError("Response missing required fields")
-                    
-                    return {
-                        "input": parsed_response['input'],
-                        "output": parsed_response['output'],
-                        "original_output": example['output']
-                    }
-                except (json.JSONDecodeError, ValueError) as e:
-                    logger.error(f"Invalid response format: {str(e)}")
-                    logger.error(f"Attempted to parse:\n{cleaned_response}")
-                    return {
-                        "input": example['input'],
-                        "error": f"Invalid response format: {str(e)}",
-                        "raw_response": model_response
-                    }
-                    
+        requests = '\n'.join(f"{number}. {example['input']}" for number, example in enumerate(examples, 1))
+        return f"""Analyze this D3.js visualization example and provide a refined version. It was requested {len(examples)} different ways.
+
+Original Requests:
+{requests}
+
+Original D3.js Implementation:
+{code}
+
+Provide your response in the following JSON format EXACTLY (no additional text before or after):
+{{
+    "inputs": ["<a creative variation of original request 1 appropriate for the data type>", "<... one per original request, in the same order>"],
+    "output": "A friendly response followed by the refined D3.js code including imports and full implementation, with adjustments ONLY as needed."
+}}
+
+IMPORTANT:
+1. Your entire response must be valid JSON
+2. Do not include any text outside the JSON object
+3. Properly escape all quotes and newlines in the JSON
+4. Include the complete implementation in the output field
+5. "inputs" must contain exactly {len(examples)} strings"""
+
+    @staticmethod
+    def failures(examples: List[Dict[str, Any]], error: str, raw_response: Optional[str] = None) -> List[Dict[str, Any]]:
+        failures = []
+        for example in examples:
+            failure = {"input": example['input'], "error": error}
+            if raw_response is not None:
+                failure["raw_response"] = raw_response
+            failures.append(failure)
+        return failures
+
+    def parse_unit(self, examples: List[Dict[str, Any]], code: str, model_response: str,
+                   cache_key: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Validate the model's reply to unit_prompt() and build one result per example.
+
+        Common JSON defects are repaired (see utils/llm_response.py), but a
+        reply whose code was cut off is rejected, as is (unless validation is
+        off) code that does not parse or lacks the createVisualization export.
+        Unusable replies become failures and are dropped from the cache.
+        """
+        logger.debug(f"Raw model response:\n{model_response}")
+        try:
+            schema = REFINE_SCHEMA if len(examples) == 1 else GROUP_REFINE_SCHEMA
+            with span('parse'):
+                parsed_response = parse_json(model_response, schema, allow_truncated=False, stats=self.parse_stats)
+            if len(examples) == 1:
+                inputs = [parsed_response['input']]
+            else:
+                inputs = parsed_response['inputs']
+                if len(inputs) != len(examples):
+                    raise ResponseFormatError(f"Expected {len(examples)} inputs, got {len(inputs)}")
+            if self.validate_js:
+                with span('validate JS'):
+                    error = validate_output(parsed_response['output'], self.js_parser)
+                if error:
+                    count('invalid JS')
+                    raise ResponseFormatError(f"Invalid JavaScript: {error}")
+            return [self.refined_example(example, refined_input, parsed_response['output'], code)
+                    for example, refined_input in zip(examples, inputs)]
+        except ResponseFormatError as e:
+            logger.error(f"Invalid response format: {str(e)}")
+            if cache_key is not None:
+                self.cache.discard(cache_key)
+            return self.failures(examples, f"Invalid response format: {str(e)}", model_response)
+
+    async def process_unit(self, session: aiohttp.ClientSession, examples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Refine examples sharing one source with a single request; returns one result per example.
+
+        A reply that cannot be used even after repair is requested again; a
+        group's is retried one example at a time, so only examples whose own
+        reply fails end up as failures.
+        """
+        try:
+            code = example_source(examples[0], self.sources)
+            for attempt in range(PARSE_RETRIES + 1):
+                model_response, cache_key = await self.complete(session, self.unit_prompt(examples, code))
+                results = self.parse_unit(examples, code, model_response, cache_key)
+                if attempt == PARSE_RETRIES or not any("error" in result for result in results):
+                    return results
+                if len(examples) > 1:
+                    return [result for example in examples
+                            for result in await self.process_unit(session, [example])]
+                count('parse retries')
+                logger.info("Re-requesting an example after an unusable reply")
         except Exception as e:
             logger.error(f"Error processing example: {str(e)}")
-            return {
-                "input": example['input'],
-                "error": str(e)
-            }
-
-    async def process_batch(self, session: aiohttp.ClientSession, batch: List[Dict[str, Any]], 
-                          example_pbar: tqdm) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
-        """Process a batch of examples concurrently."""
-        tasks = [self.process_example(session, example) for example in batch]
-        results = await asyncio.gather(*tasks)
-        
-        successes = []
-        failures = []
-        
-        for result in results:
-            if "error" in result:
-                failures.append(result)
+            return self.failures(examples, str(e))
+
+    async def process_example(self, session: aiohttp.ClientSession, example: Dict[str, Any]) -> Dict[str, Any]:
+        """Process a single example using the OpenAI API."""
+        return (await self.process_unit(session, [example]))[0]
+
+    async def process_group(self, session: aiohttp.ClientSession, examples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Refine several examples that share one source with a single request.
+
+        The code is sent once with every original request; the model returns one
+        variation per request and one refined implementation they all share.
+        """
+        return await self.process_unit(session, examples)
+
+    async def process_all(self, training_data: Iterable[Dict[str, Any]], output_file: str, concurrency: int = 8,
+                          resume: bool = False, retry_failed: bool = False,
+                          total: Optional[int] = None, group_by_source: bool = False) -> RefineJournal:
+        """Refine every example through a sliding window of in-flight requests.
+
+        A new request starts as soon as any finishes (up to the adaptive
+        concurrency limit and the rate limiter), so a slow response never holds
+        up the rest. Each finished example is appended to the journal beside
+        ``output_file``; the output itself is only written, atomically, once
+        every example has finished.
+
+        ``training_data`` may be any iterable (e.g. iter_records()), consumed
+        only as fast as the window drains. With ``resume`` examples already in
+        the journal are skipped, failures included; ``retry_failed`` runs the
+        journaled failures again. ``group_by_source`` refines consecutive
+        examples that share a source with one process_group() request.
+        """
+        journal = self.open_journal(output_file, resume, retry_failed)
+        if total is None and hasattr(training_data, '__len__'):
+            total = len(training_data)
+        pbar = tqdm(total=total, desc="Refining examples")
+        skipped = []
+        requests = 0
+
+        window = max(1, concurrency)
+        self.concurrency = AdaptiveConcurrency(window)
+
+        async def run(unit):
+            nonlocal requests
+            requests += 1
+            return unit, await self.process_unit(session, [example for _, example in unit])
+
+        conn = aiohttp.TCPConnector(limit=window)
+        try:
+            async with aiohttp.ClientSession(connector=conn) as session:
+                todo = self.pending_units(training_data, journal, retry_failed, group_by_source,
+                                          on_skip=lambda: (skipped.append(1), pbar.update(1)))
+                pending = set()
+                while True:
+                    # Keep the window full; the concurrency controller decides how many actually run.
+                    for unit in todo:
+                        pending.add(asyncio.ensure_future(run(unit)))
+                        if len(pending) >= window:
+                            break
+                    if not pending:
+                        break
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        self.record_unit(journal, *task.result())
+                        pbar.update(len(task.result()[0]))
+                    pbar.set_postfix(window=int(self.concurrency.limit), failed=len(journal.failed))
+        finally:
+            pbar.close()
+            journal.close()
+
+        self.finish(journal, len(skipped))
+        logger.info(f"Processing complete: {len(journal.completed)} refined, {len(journal.failed)} failed, "
+                    f"{requests} requests, {self.concurrency.backoffs} backoffs, peak {self.concurrency.peak} in flight. "
+                    f"Check {output_file} for results.")
+        return journal
+
+    def process_all_batch(self, training_data: Iterable[Dict[str, Any]], output_file: str, backend,
+                          workdir: Optional[str] = None, poll_interval: float = 30.0, resume: bool = False,
+                          retry_failed: bool = False, group_by_source: bool = False) -> RefineJournal:
+        """Refine every example through batch jobs instead of live requests.
+
+        Cached replies are used directly; every other unit becomes one line of
+        a batch job file (``custom_id`` is the unit's first example ID). The
+        replies go through the same parse_unit() validation as live requests
+        and land in the same journal. Job IDs are kept in ``workdir`` (default
+        ``<output>.batch``) so an interrupted run re-attaches to its jobs.
+        """
+        journal = self.open_journal(output_file, resume, retry_failed)
+        run = BatchRun(backend, workdir or f"{output_file}.batch", poll_interval)
+        skipped = []
+        # custom_id -> (unit, cache key, model) for requests sent to the batch.
+        outstanding = {}
+        cached = 0
+
+        def requests():
+            nonlocal cached
+            for unit in self.pending_units(training_data, journal, retry_failed, group_by_source,
+                                           on_skip=lambda: skipped.append(1)):
+                examples = [example for _, example in unit]
+                try:
+                    code = example_source(examples[0], self.sources)
+                except ValueError as e:
+                    self.record_unit(journal, unit, self.failures(examples, str(e)))
+                    continue
+                data = self.request_body(self.unit_prompt(examples, code))
+                cache_key = self.cache_key(data)
+                try:
+                    model_response = self.cache.get(cache_key) if cache_key is not None else None
+                except CacheMiss as e:
+                    self.record_unit(journal, unit, self.failures(examples, str(e)))
+                    continue
+                if model_response is not None:
+                    cached += 1
+                    self.record_unit(journal, unit, self.parse_unit(examples, code, model_response, cache_key))
+                    continue
+                outstanding[unit[0][0]] = (unit, cache_key, data['model'])
+                yield unit[0][0], data
+
+        if (resume or retry_failed) and run.exists():
+            # Rebuild the custom_id mapping without writing (or paying for) new jobs.
+            for _ in requests():
+                pass
+            run.load()
+        else:
+            if run.exists():
+                logger.warning(f"Discarding batch jobs recorded in {run.workdir} (use --resume to re-attach to them)")
+            jobs = run.prepare(requests())
+            logger.info(f"Queued {len(outstanding)} requests in {jobs} batch job files "
+                        f"({cached} answered from cache, {len(skipped)} skipped)")
+
+        pbar = tqdm(total=len(outstanding), desc="Collecting batch results")
+        for custom_id, model_response, error in run.results():
+            entry = outstanding.pop(custom_id, None)
+            if entry is None:
+                continue
+            unit, cache_key, model = entry
+            examples = [example for _, example in unit]
+            if error is not None:
+                results = self.failures(examples, error)
             else:
-                successes.append(result)
-            example_pbar.update(1)
-            
-        return successes, failures
-
-    async def process_all_batches(self, training_data: List[Dict[str, Any]], batch_size: int, output_file: str) -> None:
-        """Process all batches with concurrent requests within each batch and write results as we go."""
-        failed = []
-        
-        # Create progress bar for batches
-        total_batches = (len(training_data) + batch_size - 1) // batch_size
-        batch_pbar = tqdm(total=total_batches, desc="Processing batches", position=0)
-        
-        # Start JSON array
-        with open(output_file, 'w') as f:
-            f.write('[\n')
-        
-        # Configure connection pooling
-        conn = aiohttp.TCPConnector(limit=batch_size)
-        async with aiohttp.ClientSession(connector=conn) as session:
-            # Process in batches
-            for i in range(0, len(training_data), batch_size):
-                batch = training_data[i:i + batch_size]
-                
-                # Create progress bar for examples within the current batch
-                with tqdm(total=len(batch), desc=f"Batch {i//batch_size + 1}/{total_batches}", 
-                         position=1, leave=False) as example_pbar:
-                    
-                    results, failures = await self.process_batch(session, batch, example_pbar)
-                    failed.extend(failures)
-                    
-                    # Write results immediately, maintaining JSON array format
-                    with open(output_file, 'a') as f:
-                        for j, result in enumerate(results):
-                            # Add comma if not first item
-                            if i > 0 or j > 0:
-                                f.write(',\n')
-                            # Write indented JSON object
-                            json_str = json.dumps(result, indent=2)
-                            # Indent the entire object
-                            indented = '\n'.join('  ' + line for line in json_str.split('\n'))
-                            f.write(indented)
-                
-                batch_pbar.update(1)
-                
-                # Add a small delay between batches
-                if i + batch_size < len(training_data):
-                    await asyncio.sleep(1)
-        
-        # Close JSON array
-        with open(output_file, 'a') as f:
-            f.write('\n]')
-        
-        batch_pbar.close()
-        
-        # Write failures to separate file
-        if failed:
-            failed_file = Path(output_file).parent / 'failed_queries.json'
-            with open(failed_file, 'w') as f:
-                json.dump(failed, f, indent=2)
-            logger.info(f"Failed queries saved to {failed_file}")
-        
-        logger.info(f"Processing complete. Check {output_file} for results.")
-
-    def process_in_batches(self, input_file: str, output_file: str, batch_size: int = 5, limit: int = None):
-        """Process the data in batches using concurrent API calls."""
-        with open(input_file, 'r') as f:
-            training_data = json.load(f)
+                if cache_key is not None:
+                    self.cache.put(cache_key, model_response, model=model)
+                results = self.parse_unit(examples, example_source(examples[0], self.sources),
+                                          model_response, cache_key)
+            self.record_unit(journal, unit, results)
+            pbar.update(1)
+        pbar.close()
+
+        for unit, _, _ in outstanding.values():
+            self.record_unit(journal, unit, self.failures([example for _, example in unit],
+                                                          "No result in batch output"))
+        self.finish(journal, len(skipped))
+        run.cleanup()
+        logger.info(f"Batch processing complete: {len(journal.completed)} refined, {len(journal.failed)} failed. "
+                    f"Check {output_file} for results.")
+        return journal
+
+    @staticmethod
+    def open_journal(output_file: str, resume: bool, retry_failed: bool) -> RefineJournal:
+        """Journal for ``output_file``, continuing the existing one when resuming or retrying."""
+        journal = RefineJournal(output_file)
+        if resume or retry_failed:
+            journal.load()
+        elif journal.exists():
+            logger.warning(f"Starting over; {journal.path} from an earlier run is discarded (use --resume to continue it)")
+        journal.open(append=resume or retry_failed)
+        return journal
+
+    @staticmethod
+    def pending_units(training_data: Iterable[Dict[str, Any]], journal: RefineJournal, retry_failed: bool,
+                      group_by_source: bool, on_skip=None):
+        """Yield lists of ``(example ID, example)`` to refine with one request each.
+
+        Examples already journaled (or already seen in this run) are skipped.
+        With ``group_by_source`` consecutive examples sharing a source form one
+        unit; otherwise every unit is a single example.
+        """
+        seen = set()
+
+        def unfinished():
+            for example in training_data:
+                key = example_id(example)
+                if key in seen or key in journal.completed or (key in journal.failed and not retry_failed):
+                    if on_skip is not None:
+                        on_skip()
+                    continue
+                seen.add(key)
+                yield key, example
+
+        if not group_by_source:
+            for item in unfinished():
+                yield [item]
+            return
+        source_key = lambda item: item[1].get('source_id') or source_id(item[1].get('output', ''))
+        for _, group in itertools.groupby(unfinished(), key=source_key):
+            yield list(group)
 
+    @staticmethod
+    def record_unit(journal: RefineJournal, unit, results: List[Dict[str, Any]]) -> None:
+        """Journal one result per example; failures carry the example so they can be retried."""
+        with span('journal write'):
+            for (key, example), result in zip(unit, results):
+                if "error" in result:
+                    result.update(id=key, example=example)
+                journal.record(key, result)
+
+    @staticmethod
+    def finish(journal: RefineJournal, skipped: int) -> None:
+        journal.close()
+        if skipped:
+            logger.info(f"Skipped {skipped} examples already refined, failed or duplicated")
+        with span('finalize output'):
+            failed_file = journal.finalize()
+        if journal.failed:
+            logger.info(f"Failed queries saved to {failed_file}; rerun with --retry-failed to retry only those")
+
+    def _run(self, training_data, output_file, concurrency, resume, retry_failed,
+             requests_per_minute, tokens_per_minute, total=None, group_by_source=False,
+             batch=None, batch_dir=None, poll_interval=30.0):
+        self.limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+        try:
+            if batch is not None:
+                return self.process_all_batch(training_data, output_file, batch, batch_dir, poll_interval,
+                                              resume=resume, retry_failed=retry_failed,
+                                              group_by_source=group_by_source)
+            return asyncio.run(self.process_all(training_data, output_file, concurrency,
+                                                resume=resume, retry_failed=retry_failed, total=total,
+                                                group_by_source=group_by_source))
+        except KeyboardInterrupt:
+            logger.warning(f"Interrupted; finished examples are kept in {output_file}.journal. "
+                           f"Rerun with --resume to refine only the rest.")
+            raise
+
+    def process_in_batches(self, input_file: str, output_file: str, concurrency: int = 8, limit: int = None,
+                           requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None,
+                           resume: bool = False, sources_file: Optional[str] = None,
+                           group_by_source: bool = False, batch=None, batch_dir: Optional[str] = None,
+                           poll_interval: float = 30.0, select: Optional[set] = None):
+        """Process the data with up to ``concurrency`` concurrent API calls.
+
+        ``input_file`` and ``output_file`` may be JSON arrays or JSON lines
+        (.jsonl); examples are streamed rather than loaded up front. Examples
+        may reference deduplicated code by ``source_id``, resolved from
+        ``sources_file`` (default: the .sources file beside the input). Optional
+        request/token limits seed the rate limiter; the API's rate-limit
+        headers take over once responses arrive. ``resume`` picks up an
+        interrupted run from its journal. With a ``batch`` backend (see
+        utils/batch_jobs.py) the requests run as batch jobs instead. ``select``,
+        a set of source IDs such as a stratified sample, limits the run to
+        examples on those sources.
+        """
+        self.load_sources(sources_file, input_file)
         if limit:
-            training_data = training_data[:limit]
             logger.info(f"Limited to {limit} examples for development")
+        if select is not None:
+            examples = (example for example in iter_records(input_file) if example_source_id(example) in select)
+            examples = itertools.islice(examples, limit) if limit else examples
+            total = None
+        else:
+            examples = iter_records(input_file, limit=limit)
+            # Counting JSON lines is cheap; arrays would need a second full parse just for the progress bar.
+            total = count_records(input_file) if is_jsonl(input_file) else None
+            if total is not None and limit:
+                total = min(total, limit)
+
+        return self._run(examples, output_file, concurrency, resume, False,
+                         requests_per_minute, tokens_per_minute, total=total, group_by_source=group_by_source,
+                         batch=batch, batch_dir=batch_dir, poll_interval=poll_interval)
 
-        # Create/clear the output file
-        with open(output_file, 'w') as f:
-            pass  # Just create/clear the file
+    def retry_failures(self, output_file: str, failed_file: Optional[str] = None, concurrency: int = 8,
+                       requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None,
+                       input_file: Optional[str] = None, sources_file: Optional[str] = None,
+                       group_by_source: bool = False, batch=None, batch_dir: Optional[str] = None,
+                       poll_interval: float = 30.0):
+        """Refine only the examples listed in failed_queries.json, merging successes into ``output_file``.
 
-        # Run the async processing
-        asyncio.run(self.process_all_batches(training_data, batch_size, output_file))
+        Failures that reference a source need ``sources_file`` or the
+        ``input_file`` whose .sources file it is.
+        """
+        failed_file = failed_file or Path(output_file).parent / FAILED_QUERIES_NAME
+        if not RefineJournal(output_file).exists():
+            raise FileNotFoundError(f"No journal for {output_file}; retrying needs the run that produced {failed_file}")
+
+        def examples():
+            missing = 0
+            for failure in iter_records(failed_file):
+                if 'example' in failure:
+                    yield failure['example']
+                else:
+                    missing += 1
+            if missing:
+                logger.warning(f"{missing} failures in {failed_file} do not include their "
+                               f"original example and could not be retried")
+
+        if sources_file or input_file:
+            self.load_sources(sources_file, input_file)
+        logger.info(f"Retrying failed examples from {failed_file}")
+        return self._run(examples(), output_file, concurrency, True, True,
+                         requests_per_minute, tokens_per_minute, group_by_source=group_by_source,
+                         batch=batch, batch_dir=batch_dir, poll_interval=poll_interval)
 
 def main():
-    input_file = "./d3_training_data.json"
-    output_file = "./refined_d3_training_data.json"
-    
-    processor = BatchProcessor()
-    processor.process_in_batches(input_file, output_file, batch_size=5, limit=None)
+    parser = argparse.ArgumentParser(description='Refine D3 training examples with OpenAI')
+    parser.add_argument('--input', '-i', default="./d3_training_data.json", help='Training data to refine (JSON array or .jsonl)')
+    parser.add_argument('--output', '-o', default="./refined_d3_training_data.json", help='Where to write refined examples (.jsonl writes JSON lines)')
+    parser.add_argument('--concurrency', '-c', type=int, default=8,
+                        help='Maximum requests in flight; shrinks automatically on 429/5xx (default: 8)')
+    parser.add_argument('--requests-per-minute', type=int, help='Initial request rate limit (default: learned from API headers)')
+    parser.add_argument('--tokens-per-minute', type=int, help='Initial token rate limit (default: learned from API headers)')
+    parser.add_argument('--base-url', help='OpenAI-compatible API base URL (default: OPENAI_BASE_URL or api.openai.com)')
+    parser.add_argument('--limit', type=int, help='Only refine the first N examples')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run, skipping examples already in OUTPUT.journal')
+    parser.add_argument('--retry-failed', nargs='?', const='', metavar='FAILED_JSON',
+                        help=f'Refine only the examples in {FAILED_QUERIES_NAME} (default: next to OUTPUT) '
+                             f'and merge the successes into OUTPUT')
+    parser.add_argument('--sources', help='Sources file for examples that reference code by source_id '
+                                          '(default: INPUT with a .sources suffix, if present)')
+    parser.add_argument('--group-by-source', action='store_true',
+                        help='Refine consecutive examples sharing the same code with one request each')
+    add_json_mode_argument(parser)
+    add_batch_arguments(parser)
+    add_cache_arguments(parser)
+    add_validation_arguments(parser)
+    add_sample_arguments(parser)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    cache = cache_from_args(args)
+    try:
+        processor = BatchProcessor(cache=cache, base_url=args.base_url, json_mode=not args.no_json_mode,
+                                   validate_js=not args.no_validate_js, js_parser=args.js_parser)
+    except ImportError as e:
+        sys.exit(str(e))
+    batch_dir = args.batch_dir or f"{args.output}.batch"
+    batch = backend_from_args(args, batch_dir, processor.api_key)
+    batch_options = dict(batch=batch, batch_dir=batch_dir, poll_interval=args.poll_interval)
+    select = None
+    index = index_from_args(args)
+    if index is not None:
+        # Sample among the sources the training data actually has examples for.
+        present = {example_source_id(example) for example in iter_records(args.input)}
+        mask = index.first_per('source_id', index.has_source(present))
+        select = set(index.source_id[sample_from_args(args, index, mask, report=logger.info)].tolist())
+    with instrumented_run(args, report=logger.info):
+        try:
+            if args.retry_failed is not None:
+                processor.retry_failures(args.output, args.retry_failed or None, concurrency=args.concurrency,
+                                         requests_per_minute=args.requests_per_minute,
+                                         tokens_per_minute=args.tokens_per_minute, input_file=args.input,
+                                         sources_file=args.sources, group_by_source=args.group_by_source,
+                                         **batch_options)
+            else:
+                processor.process_in_batches(args.input, args.output, concurrency=args.concurrency, limit=args.limit,
+                                             requests_per_minute=args.requests_per_minute,
+                                             tokens_per_minute=args.tokens_per_minute, resume=args.resume,
+                                             sources_file=args.sources, group_by_source=args.group_by_source,
+                                             select=select, **batch_options)
+        except KeyboardInterrupt:
+            sys.exit(130)
+    if processor.parse_stats:
+        logger.info(format_stats(processor.parse_stats))
+    if cache is not None:
+        logger.info(cache.summary())
 
 if __name__ == "__main__":
     main()
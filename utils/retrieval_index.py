@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import time
+import zlib
+import struct
+import hashlib
+import argparse
+from functools import lru_cache
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.catalog import add_catalog_arguments, catalog_from_args
+
+INDEX_VERSION = 1
+INDEX_NAME = '.gallery_retrieval.idx'
+MAGIC = b'D3RETIDX'
+# Text of a visualization that is indexed, and how much each field counts towards a term's frequency.
+FIELD_WEIGHTS = {'queries': 1.0, 'explanation': 0.5, 'report': 0.25}
+REPORT_FILES = ('data_report.txt', 'inferred_data_report.txt')
+# Data reports can run to megabytes of column statistics; their head describes the data.
+REPORT_CHARS = 4000
+K1 = 1.2
+B = 0.75
+NGRAM_BUCKETS = 1 << 20
+NGRAM_WEIGHT = 5.0
+CACHE_SIZE = 4096
+DEFAULT_PORT = 8765
+
+_WORD = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset("""
+    a an and are as at be by can could do for from how i in into is it its me my of on or please show that the
+    their them this to using want what which with would you
+""".split())
+_ALIGN = 64
+
+
+def terms(text):
+    """Lower-cased words of ``text`` without stopwords, plural endings stripped."""
+    words = []
+    for word in _WORD.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith('ies'):
+            word = word[:-3] + 'y'
+        elif len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def term_hash(term):
+    """64-bit ID of a term; the index stores these instead of a vocabulary."""
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def ngrams(words):
+    """Hashed character trigrams of ``words``, which still match across typos and word forms."""
+    grams = []
+    for word in words:
+        padded = f" {word} ".encode('utf-8')
+        grams.extend(zlib.crc32(padded[i:i + 3]) & (NGRAM_BUCKETS - 1) for i in range(len(padded) - 2))
+    return grams
+
+
+def read_document(viz_dir):
+    """{field: text} indexed for one visualization directory; empty when it has nothing to index."""
+    fields = {}
+    try:
+        queries = json.loads((viz_dir / 'queries.json').read_text()).get('queries', [])
+        fields['queries'] = '\n'.join(query['query'] for query in queries
+                                      if isinstance(query, dict) and isinstance(query.get('query'), str))
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        fields['explanation'] = (viz_dir / 'explanation.txt').read_text(errors='replace')
+    except OSError:
+        pass
+    for name in REPORT_FILES:
+        try:
+            with open(viz_dir / name, errors='replace') as f:
+                fields['report'] = f.read(REPORT_CHARS)
+            break
+        except OSError:
+            continue
+    return {field: text for field, text in fields.items() if text.strip()}
+
+
+def _postings(keys, docs, weights):
+    """Group (key, doc, weight) triples by key: sorted keys, offsets into docs/weights, docs, weights."""
+    order = np.lexsort((docs, keys))
+    keys, docs, weights = keys[order], docs[order], weights[order]
+    unique, starts = np.unique(keys, return_index=True)
+    offsets = np.append(starts, len(keys)).astype(np.int64)
+    return unique, offsets, docs.astype(np.uint32), weights.astype(np.float32)
+
+
+def build_index(gallery_root, catalog=None, with_ngrams=False, field_weights=FIELD_WEIGHTS):
+    """Index every visualization under ``gallery_root`` that has queries, an explanation or a report.
+
+    Each visualization is one document whose fields count towards term
+    frequencies by ``field_weights``. Postings store each term's final BM25
+    contribution to the document, so a lookup only adds them up. With
+    ``with_ngrams`` documents also get an L2-normalized TF-IDF vector of
+    hashed character trigrams. Returns (arrays, names).
+    """
+    root = Path(gallery_root)
+    directories = catalog.visualizations() if catalog is not None else \
+        sorted(path for path in root.iterdir() if path.is_dir() and not path.name.startswith('.'))
+    names = []
+    lengths = []
+    term_keys, term_docs, term_freqs = [], [], []
+    gram_keys, gram_docs, gram_freqs = [], [], []
+    for viz_dir in directories:
+        fields = read_document(viz_dir)
+        if not fields:
+            continue
+        doc = len(names)
+        names.append(viz_dir.name)
+        frequencies = Counter()
+        grams = Counter()
+        length = 0.0
+        for field, text in fields.items():
+            weight = field_weights.get(field, 0.0)
+            words = terms(text)
+            length += weight * len(words)
+            for word, count in Counter(words).items():
+                frequencies[word] += weight * count
+            if with_ngrams:
+                grams.update(ngrams(words))
+        lengths.append(length)
+        term_keys.extend(term_hash(word) for word in frequencies)
+        term_freqs.extend(frequencies.values())
+        term_docs.extend([doc] * len(frequencies))
+        gram_keys.extend(grams)
+        gram_freqs.extend(grams.values())
+        gram_docs.extend([doc] * len(grams))
+
+    count = len(names)
+    arrays = {}
+    keys, offsets, docs, freqs = _postings(np.array(term_keys, dtype=np.uint64), np.array(term_docs, dtype=np.int64),
+                                           np.array(term_freqs, dtype=np.float64))
+    lengths = np.array(lengths, dtype=np.float64)
+    average = lengths.mean() if count and lengths.mean() else 1.0
+    df = np.diff(offsets)
+    idf = np.log1p((count - df + 0.5) / (df + 0.5))
+    freqs = freqs.astype(np.float64)
+    norms = K1 * (1 - B + B * lengths[docs] / average)
+    arrays.update(term_hashes=keys, term_offsets=offsets, term_docs=docs,
+                  term_impacts=(np.repeat(idf, df) * freqs * (K1 + 1) / (freqs + norms)).astype(np.float32))
+
+    if with_ngrams:
+        keys, offsets, docs, freqs = _postings(np.array(gram_keys, dtype=np.uint32),
+                                               np.array(gram_docs, dtype=np.int64),
+                                               np.array(gram_freqs, dtype=np.float64))
+        df = np.diff(offsets)
+        idf = np.log((1 + count) / (1 + df)) + 1
+        weights = (1 + np.log(freqs.astype(np.float64))) * np.repeat(idf, df)
+        squares = np.bincount(docs, weights=weights ** 2, minlength=count)
+        weights /= np.sqrt(squares)[docs]
+        arrays.update(gram_ids=keys, gram_idf=idf.astype(np.float32), gram_offsets=offsets, gram_docs=docs,
+                      gram_weights=weights.astype(np.float32))
+    return arrays, names
+
+
+def save_index(path, arrays, names, gallery_root, field_weights=FIELD_WEIGHTS):
+    """Write the arrays 64-byte aligned after a JSON header, so load_index() can map them in place."""
+    header = {'version': INDEX_VERSION, 'gallery_root': str(gallery_root), 'built': time.time(),
+              'field_weights': field_weights, 'k1': K1, 'b': B, 'names': names, 'arrays': {}}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // _ALIGN) * _ALIGN
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+    encoded = json.dumps(header).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(encoded)) // _ALIGN) * _ALIGN
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(encoded)) + encoded)
+        for name, array in arrays.items():
+            f.write(b'\0' * (data_start + header['arrays'][name]['offset'] - f.tell()))
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp, path)
+
+
+def load_index(path):
+    """Map a saved index; returns (header, arrays), or None when it is missing or of another INDEX_VERSION."""
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    with f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length))
+        if header.get('version') != INDEX_VERSION:
+            return None
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data_start = -(-(len(MAGIC) + 8 + length) // _ALIGN) * _ALIGN
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        count = math.prod(spec['shape'])
+        arrays[name] = np.frombuffer(mapped, dtype, count, data_start + spec['offset']).reshape(spec['shape'])
+    return header, arrays
+
+
+class Retriever:
+    """Top-k visualizations for a natural-language request over a saved index.
+
+    Scores are BM25 over the indexed fields, plus ``ngram_weight`` times the
+    cosine similarity of hashed trigram vectors when the index has them.
+    Results for the last ``cache_size`` distinct requests are cached.
+    """
+
+    def __init__(self, path, ngram_weight=NGRAM_WEIGHT, cache_size=CACHE_SIZE):
+        loaded = load_index(path)
+        if loaded is None:
+            raise FileNotFoundError(f"No version {INDEX_VERSION} retrieval index at {path}")
+        self.header, arrays = loaded
+        self.path = str(path)
+        self.names = self.header['names']
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.has_ngrams = 'gram_ids' in arrays
+        self.ngram_weight = ngram_weight if self.has_ngrams else 0.0
+        self._search = lru_cache(maxsize=cache_size)(self._search)
+
+    def __len__(self):
+        return len(self.names)
+
+    def search(self, query, k=10):
+        """``[(visualization name, score), ...]`` for the ``k`` best matches, best first."""
+        return self._search(' '.join(terms(query)), k)
+
+    def cache_info(self):
+        return self._search.cache_info()
+
+    @staticmethod
+    def _lookup(keys, wanted):
+        """Positions in the sorted ``keys`` of those ``wanted`` keys it holds."""
+        positions = np.searchsorted(keys, wanted)
+        found = positions < len(keys)
+        found[found] &= keys[positions[found]] == wanted[found]
+        return positions[found], found
+
+    def _search(self, normalized, k):
+        words = normalized.split()
+        if not words or not self.names:
+            return ()
+        positions, _ = self._lookup(self.term_hashes, np.array(sorted({term_hash(word) for word in words}),
+                                                               dtype=np.uint64))
+        bounds = [(self.term_offsets[p], self.term_offsets[p + 1]) for p in positions.tolist()]
+        docs = [self.term_docs[start:end] for start, end in bounds]
+        weights = [self.term_impacts[start:end] for start, end in bounds]
+        if self.ngram_weight:
+            grams = Counter(ngrams(words))
+            ids = np.array(sorted(grams), dtype=np.uint32)
+            positions, found = self._lookup(self.gram_ids, ids)
+            query = (1 + np.log(np.array([grams[gram] for gram in ids[found].tolist()], dtype=np.float64))) \
+                * self.gram_idf[positions]
+            if len(query):
+                query *= self.ngram_weight / np.linalg.norm(query)
+                # A query has dozens of trigrams, so their postings are gathered in one indexing operation.
+                starts = self.gram_offsets[positions]
+                lengths = self.gram_offsets[positions + 1] - starts
+                postings = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+                docs.append(self.gram_docs[postings])
+                weights.append(self.gram_weights[postings] * np.repeat(query, lengths))
+        if not docs:
+            return ()
+        scores = np.bincount(np.concatenate(docs), weights=np.concatenate(weights), minlength=len(self.names))
+        top = np.argpartition(-scores, k)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return tuple((self.names[doc], round(float(scores[doc]), 4)) for doc in top.tolist() if scores[doc] > 0)
+
+
+def index_path_for(gallery_root):
+    return Path(gallery_root) / INDEX_NAME
+
+
+def make_server(retriever, host='127.0.0.1', port=DEFAULT_PORT, max_k=100):
+    """HTTP server answering ``GET /search?q=...&k=10`` with JSON results (and ``GET /health``)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in separate writes; with Nagle on, keep-alive clients wait out a delayed ACK.
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            if url.path == '/health':
+                return self.reply(200, {'visualizations': len(retriever), 'ngrams': retriever.has_ngrams})
+            if url.path != '/search':
+                return self.reply(404, {'error': f"Unknown path {url.path}; use /search?q=..."})
+            query = params.get('q', [''])[0]
+            try:
+                k = min(max_k, max(1, int(params.get('k', ['10'])[0])))
+            except ValueError:
+                return self.reply(400, {'error': 'k must be an integer'})
+            if not query.strip():
+                return self.reply(400, {'error': 'Missing q'})
+            start = time.perf_counter()
+            results = retriever.search(query, k)
+            took_ms = (time.perf_counter() - start) * 1000
+            self.reply(200, {'query': query, 'took_ms': round(took_ms, 3),
+                             'results': [{'name': name, 'score': score} for name, score in results]})
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find gallery visualizations for a natural-language request')
+    parser.add_argument('gallery_dir', help='Directory containing D3 visualizations')
+    parser.add_argument('--index', help=f'Index file (default: GALLERY_DIR/{INDEX_NAME})')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Rebuild the index from queries.json, explanations and data reports (it is built '
+                             'automatically when missing)')
+    parser.add_argument('--ngrams', action='store_true',
+                        help='Also index hashed character-trigram vectors, which match typos and word variants')
+    parser.add_argument('--ngram-weight', type=float, default=NGRAM_WEIGHT,
+                        help=f'Weight of trigram similarity added to the BM25 score (default: {NGRAM_WEIGHT})')
+    parser.add_argument('--query', '-q', action='append', default=[], help='Request to look up (repeatable)')
+    parser.add_argument('-k', type=int, default=10, help='Visualizations per request (default: 10)')
+    parser.add_argument('--serve', action='store_true', help='Answer GET /search?q=...&k=... over HTTP')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to serve on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to serve on (default: {DEFAULT_PORT})')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help=f'Distinct requests whose results are cached (default: {CACHE_SIZE})')
+    add_catalog_arguments(parser)
+    args = parser.parse_args()
+
+    path = args.index or index_path_for(args.gallery_dir)
+    if args.rebuild or load_index(path) is None:
+        catalog = catalog_from_args(args, args.gallery_dir)
+        start = time.perf_counter()
+        arrays, names = build_index(args.gallery_dir, catalog, args.ngrams)
+        save_index(path, arrays, names, args.gallery_dir)
+        print(f"Indexed {len(names):,} visualizations ({len(arrays['term_hashes']):,} terms"
+              f"{', with trigram vectors' if args.ngrams else ''}) in {time.perf_counter() - start:.2f}s: "
+              f"{path} ({os.path.getsize(path) / 1024:.0f} KB)")
+    retriever = Retriever(path, args.ngram_weight, args.cache_size)
+
+    for query in args.query:
+        start = time.perf_counter()
+        results = retriever.search(query, args.k)
+        print(f"\n{query!r} ({(time.perf_counter() - start) * 1000:.2f} ms)")
+        for rank, (name, score) in enumerate(results, 1):
+            print(f"  {rank:>3}. {name:<50} {score:8.3f}")
+        if not results:
+            print("  no matches")
+    if args.serve:
+        server = make_server(retriever, args.host, args.port)
+        print(f"Serving {len(retriever):,} visualizations on http://{args.host}:{server.server_address[1]}"
+              f"/search?q=...&k=10")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
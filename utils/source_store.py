@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import hashlib
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.jsonl_io import RecordWriter, iter_records, write_records
+
+
+def source_id(text):
+    """Content hash identifying a visualization source."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def sources_path_for(training_file):
+    """Default sources file stored beside a training-data file: ``data.jsonl`` -> ``data.sources.jsonl``."""
+    path = Path(training_file)
+    suffixes = ''.join(path.suffixes[-2:]) if path.suffix == '.gz' else path.suffix
+    return str(path.with_name(path.name[:len(path.name) - len(suffixes)] + '.sources' + suffixes))
+
+
+class SourceWriter:
+    """Stream unique sources to a JSON or JSON-lines file, each stored once.
+
+    ``add()`` returns the source's ID; a source already written is not written
+    again. Only the IDs seen so far are kept in memory.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._writer = RecordWriter(path)
+        self._seen = set()
+        self.references = 0
+
+    def add(self, text, name=None):
+        key = source_id(text)
+        self.references += 1
+        if key not in self._seen:
+            self._seen.add(key)
+            record = {'source_id': key, 'output': text}
+            if name is not None:
+                record['name'] = name
+            self._writer.write(record)
+        return key
+
+    @property
+    def count(self):
+        return len(self._seen)
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._writer.__exit__(exc_type, exc, tb)
+
+
+def load_sources(path):
+    """Map source IDs to their code."""
+    return {record['source_id']: record['output'] for record in iter_records(path)}
+
+
+def example_source(example, sources=None):
+    """Code an example refers to, whether inline (``output``) or by ``source_id``."""
+    if 'output' in example:
+        return example['output']
+    if sources is None:
+        raise ValueError(f"Example references source {example.get('source_id')} but no sources file was given")
+    try:
+        return sources[example['source_id']]
+    except KeyError:
+        raise ValueError(f"Unknown source {example.get('source_id')}") from None
+
+
+def example_source_id(example):
+    """Source ID of an example, whether it references its code or carries it inline."""
+    if 'output' in example:
+        return source_id(example['output'])
+    return example.get('source_id')
+
+
+def inflate(examples, sources):
+    """Yield examples with each ``source_id`` replaced by the full ``output`` it names."""
+    for example in examples:
+        if 'output' not in example:
+            example = dict(example)
+            example['output'] = example_source(example, sources)
+            del example['source_id']
+        yield example
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Expand deduplicated training data back to inline source code')
+    parser.add_argument('input', help='Training data whose examples reference sources by source_id')
+    parser.add_argument('output', help='Where to write examples with their full output inline')
+    parser.add_argument('--sources', help='Sources file (default: INPUT with a .sources suffix)')
+    args = parser.parse_args()
+
+    sources_file = args.sources or sources_path_for(args.input)
+    if not os.path.exists(sources_file):
+        sys.exit(f"Sources file {sources_file} not found")
+    count = write_records(args.output, inflate(iter_records(args.input), load_sources(sources_file)))
+    print(f"Wrote {count} examples to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
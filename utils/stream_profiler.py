@@ -0,0 +1,600 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import csv
+import json
+import math
+import random
+import hashlib
+import argparse
+from collections import Counter
+from itertools import zip_longest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils.data_profiler import (
+    _NULL_STRINGS, _string_kind, _python_kind, _format_value, records_to_columns,
+)
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CHUNK_ROWS = 50000
+# Parsed JSON records are far heavier than CSV rows, so they are batched smaller.
+CHUNK_RECORDS = 5000
+READ_SIZE = 1024 * 1024
+SAMPLE_SIZE = 3
+HLL_PRECISION = 12
+_JSON_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+
+
+class RunningStats:
+    """Welford mean/variance with Chan's chunk merge, plus min/max."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def update(self, values):
+        values = values[np.isfinite(values)]
+        n = len(values)
+        if not n:
+            return
+        chunk_mean = float(values.mean())
+        chunk_m2 = float(((values - chunk_mean) ** 2).sum())
+        total = self.count + n
+        delta = chunk_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += chunk_m2 + delta * delta * self.count * n / total
+        self.count = total
+        chunk_min, chunk_max = float(values.min()), float(values.max())
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+
+    @property
+    def std(self):
+        return (self.m2 / self.count) ** 0.5 if self.count else 0.0
+
+
+_FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+_FNV_PRIME = np.uint64(0x100000001b3)
+MAX_VECTOR_HASH_CHARS = 256
+
+
+def _mix64(h):
+    """splitmix64 finalizer; spreads FNV output across all 64 bits."""
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xbf58476d1ce4e5b9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+
+def hash_strings(values):
+    """Hash an array of strings to uint64, vectorized over the code-point matrix."""
+    array = np.asarray(values, dtype=str)
+    if not len(array):
+        return np.zeros(0, dtype=np.uint64)
+    width = array.dtype.itemsize // 4
+    if width > MAX_VECTOR_HASH_CHARS:
+        return np.fromiter(
+            (int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+             for value in array),
+            dtype=np.uint64, count=len(array))
+    codes = np.ascontiguousarray(array).view(np.uint32).reshape(len(array), max(width, 1))
+    h = np.full(len(array), _FNV_OFFSET, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for k in range(codes.shape[1]):
+            h ^= codes[:, k].astype(np.uint64)
+            h *= _FNV_PRIME
+        return _mix64(h)
+
+
+class HyperLogLog:
+    """Fixed-memory distinct-count estimator (2**precision one-byte registers)."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        if not len(hashes):
+            return
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.intp)
+        rest = (hashes << np.uint64(self.p))
+        max_rank = 64 - self.p + 1
+        with np.errstate(divide='ignore'):
+            leading = 63 - np.floor(np.log2(rest.astype(np.float64)))
+        rank = np.where(rest == 0, max_rank, np.minimum(leading + 1, max_rank)).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def add(self, values):
+        self.add_hashes(hash_strings([str(value) for value in values]))
+
+    def estimate(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return int(round(m * np.log(m / zeros)))
+        return int(round(raw))
+
+
+class Reservoir:
+    """Uniform sample of fixed size over a stream (Algorithm L).
+
+    Instead of drawing a random number per item, the gap to the next
+    replacement is drawn directly, so chunks are mostly skipped over.
+    """
+
+    def __init__(self, size=SAMPLE_SIZE, seed=0):
+        self.size = size
+        self.seen = 0
+        self.items = []
+        self._random = random.Random(seed)
+        self._weight = math.exp(math.log(self._random.random()) / size)
+        self._next = size + self._gap()
+
+    def _gap(self):
+        return int(math.log(self._random.random()) / math.log(1 - self._weight)) + 1
+
+    def extend(self, chunk):
+        start = self.seen
+        fill = min(len(chunk), self.size - len(self.items)) if len(self.items) < self.size else 0
+        self.items.extend(chunk[:fill])
+        self.seen += len(chunk)
+        while self._next <= self.seen:
+            self.items[self._random.randrange(self.size)] = chunk[self._next - start - 1]
+            self._weight *= math.exp(math.log(self._random.random()) / self.size)
+            self._next += self._gap()
+
+
+class ColumnAccumulator:
+    """Online per-column statistics with memory independent of row count."""
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.kinds = Counter()
+        self.stats = RunningStats()
+        self.distinct = HyperLogLog()
+        self.min_text = None
+        self.max_text = None
+
+    def _update_text_range(self, uniques):
+        if len(uniques):
+            low, high = str(uniques[0]), str(uniques[-1])
+            self.min_text = low if self.min_text is None else min(self.min_text, low)
+            self.max_text = high if self.max_text is None else max(self.max_text, high)
+
+    def update_strings(self, values):
+        column = np.asarray(values, dtype=str)
+        self.count += len(column)
+        is_null = np.isin(column, list(_NULL_STRINGS))
+        self.nulls += int(is_null.sum())
+        present = column[~is_null]
+        if not len(present):
+            return
+        self.distinct.add_hashes(hash_strings(present))
+
+        # Fast path: the whole chunk converts to float in one vectorized call.
+        try:
+            numbers = present.astype(np.float64)
+        except ValueError:
+            numbers = None
+        if numbers is not None:
+            has_fraction = (np.mod(numbers[np.isfinite(numbers)], 1) != 0).any() \
+                or (np.char.find(present, '.') >= 0).any()
+            self.kinds['float' if has_fraction else 'int'] += len(present)
+            self.stats.update(numbers)
+            return
+
+        # Classify distinct values only; gallery columns are highly repetitive.
+        uniques, inverse = np.unique(present, return_inverse=True)
+        kinds = np.array([_string_kind(value) for value in uniques], dtype=object)
+        kind_counts = np.bincount(inverse, minlength=len(uniques))
+        for kind in set(kinds):
+            self.kinds[kind] += int(kind_counts[kinds == kind].sum())
+        numeric = np.isin(kinds, ['int', 'float'])
+        if numeric.any():
+            self.stats.update(present[numeric[inverse]].astype(np.float64))
+        if (~numeric).any():
+            self._update_text_range(uniques[~numeric])
+
+    def update_values(self, values):
+        self.count += len(values)
+        kinds = [_python_kind(value) for value in values]
+        kind_array = np.array(kinds, dtype=object)
+        self.nulls += int((kind_array == 'null').sum())
+        self.kinds.update(kind for kind in kinds if kind != 'null')
+        numeric = [value for value, kind in zip(values, kinds) if kind in ('int', 'float')]
+        if numeric:
+            self.stats.update(np.asarray(numeric, dtype=np.float64))
+        scalars = [value if kind != 'object' and kind != 'array' else json.dumps(value, sort_keys=True)
+                   for value, kind in zip(values, kinds) if kind != 'null']
+        if scalars:
+            self.distinct.add(scalars)
+        strings = sorted(value for value, kind in zip(values, kinds) if kind == 'str')
+        if strings:
+            self._update_text_range(strings)
+
+    def summary(self):
+        kinds = [kind for kind, _ in self.kinds.most_common()]
+        if set(kinds) == {'int', 'float'}:
+            kinds = ['float']
+        if not kinds:
+            kind = 'empty'
+        elif len(kinds) == 1:
+            kind = kinds[0]
+        else:
+            kind = f"mixed ({', '.join(sorted(kinds))})"
+        parts = [f"type={kind}", f"nulls={self.nulls:,}", f"distinct~{self.distinct.estimate():,}"]
+        if self.stats.count:
+            parts += [f"min={_format_value(self.stats.min)}", f"max={_format_value(self.stats.max)}",
+                      f"mean={self.stats.mean:.6g}", f"std={self.stats.std:.6g}"]
+        elif self.min_text is not None:
+            parts += [f"min={_format_value(self.min_text)}", f"max={_format_value(self.max_text)}"]
+        return '; '.join(parts)
+
+
+def iter_csv_chunks(f, delimiter=',', chunk_rows=CHUNK_ROWS):
+    """Yield the header, then lists of at most ``chunk_rows`` rows, skipping blank lines."""
+    reader = (row for row in csv.reader(f, delimiter=delimiter) if row)
+    yield next(reader, None) or []
+    chunk = []
+    for row in reader:
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _JSONStream:
+    """Incremental decoder over a text file for top-level arrays and arrays inside a top-level object."""
+
+    def __init__(self, f, read_size=READ_SIZE):
+        self.f = f
+        self.read_size = read_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        if self.eof:
+            return False
+        chunk = self.f.read(size or self.read_size)
+        if not chunk:
+            self.eof = True
+            return False
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        self.buffer += chunk
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} in JSON stream")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        read_size = self.read_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number ending exactly at the buffer edge may continue in the next chunk.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Double the read size so a value spanning many chunks is re-scanned O(log n) times.
+            if not self._fill(read_size):
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                self.pos = end
+                return value
+            read_size *= 2
+
+    def skip(self, depth=0):
+        """Advance past the next value without decoding it; ``depth=1`` finishes an already opened one.
+
+        Brackets are counted between strings with str.count, so skipping a
+        large member costs a scan, not a decode, and memory stays at a read chunk.
+        """
+        if depth == 0 and self.peek() not in ('[', '{'):
+            self.value()
+            return
+        read_size = self.read_size
+        while True:
+            quote = self.buffer.find('"', self.pos)
+            segment_end = len(self.buffer) if quote < 0 else quote
+            segment = self.buffer[self.pos:segment_end]
+            after = depth + segment.count('[') + segment.count('{') - segment.count(']') - segment.count('}')
+            if after > 0:
+                depth = after
+                self.pos = segment_end
+            else:
+                for i, ch in enumerate(segment):
+                    if ch == '[' or ch == '{':
+                        depth += 1
+                    elif ch == ']' or ch == '}':
+                        depth -= 1
+                        if depth == 0:
+                            self.pos += i + 1
+                            return
+            if quote >= 0:
+                string = _JSON_STRING.match(self.buffer, quote)
+                if string is not None:
+                    self.pos = string.end()
+                    read_size = self.read_size
+                    continue
+                # The string runs past the buffer; read more, doubling so it is re-scanned O(log n) times.
+                read_size *= 2
+            if not self._fill(read_size):
+                raise ValueError("Unterminated JSON value")
+
+    def array_items(self, opened=False):
+        if not opened:
+            self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError("Malformed JSON array")
+
+
+_GEO_ROOT_TYPES = {'FeatureCollection', 'GeometryCollection', 'Topology'}
+
+
+def _streams_member(key, first_item, stream_key, root):
+    """Whether an array member of an object root is the one to stream, given its first item's type.
+
+    ``stream_key`` always is, otherwise the first array member is. In GeoJSON
+    and TopoJSON roots arrays of numbers such as ``bbox`` are passed over.
+    """
+    if key == stream_key:
+        return True
+    return first_item in ('object', 'array') or root.get('type') not in _GEO_ROOT_TYPES
+
+
+def _ijson_array(events, event):
+    """Build the items of an array from ijson events, ``event`` being the first one after start_array."""
+    while event[1] != 'end_array':
+        builder = ijson.common.ObjectBuilder()
+        depth = 0
+        while True:
+            builder.event(event[1], event[2])
+            if event[1] in ('start_map', 'start_array'):
+                depth += 1
+            elif event[1] in ('end_map', 'end_array'):
+                depth -= 1
+            if depth == 0:
+                break
+            event = next(events)
+        yield builder.value
+        event = next(events)
+
+
+_IJSON_KINDS = {'start_map': 'object', 'start_array': 'array', 'end_array': 'empty'}
+
+
+def _ijson_records(f, root, stream_key):
+    events = ijson.parse(f, use_float=True)
+    first = next(events, None)
+    if first is None:
+        return
+    if first[1] == 'start_array':
+        yield from _ijson_array(events, next(events))
+        return
+    if first[1] != 'start_map':
+        return
+    streamed = False
+    key = None
+    depth = 1
+    for _, event, value in events:
+        if depth > 1:
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+        elif event == 'map_key':
+            key = value
+        elif event == 'end_map':
+            return
+        elif event in ('start_map', 'start_array'):
+            root[key] = None
+            if event == 'start_array' and not streamed:
+                item = next(events)
+                if item[1] == 'end_array':
+                    continue
+                if _streams_member(key, _IJSON_KINDS.get(item[1], 'scalar'), stream_key, root):
+                    streamed = True
+                    yield from _ijson_array(events, item)
+                    continue
+                if item[1] in ('start_map', 'start_array'):
+                    depth += 1
+            depth += 1
+        else:
+            root[key] = value
+
+
+def iter_json_records(f, stream_key='features'):
+    """Stream items of a top-level JSON array, or of one array member of a top-level object.
+
+    For an object root the member streamed is ``stream_key`` or, failing that,
+    the first array-valued member (``{"meta": ..., "data": [...]}``). Other
+    non-scalar members are skipped without being decoded, so memory stays
+    bounded for TopoJSON ``objects``/``arcs`` too.
+
+    Returns ``(root, items)`` where ``root`` maps the object root's member names
+    to their values for scalars and to None otherwise (filled in as the stream is
+    consumed) and ``items`` is a generator. Uses ijson when it is installed.
+    """
+    root = {}
+    if ijson is not None:
+        return root, _ijson_records(f, root, stream_key)
+
+    stream = _JSONStream(f)
+
+    def items():
+        start = stream.peek()
+        if start == '[':
+            yield from stream.array_items()
+            return
+        stream.expect('{')
+        streamed = False
+        while stream.peek() != '}':
+            key = stream.value()
+            stream.expect(':')
+            start = stream.peek()
+            if start == '[' and not streamed:
+                root[key] = None
+                stream.pos += 1
+                first = stream.peek()
+                kind = {'{': 'object', '[': 'array', ']': 'empty'}.get(first, 'scalar')
+                if kind != 'empty' and _streams_member(key, kind, stream_key, root):
+                    streamed = True
+                    yield from stream.array_items(opened=True)
+                else:
+                    stream.skip(depth=1)
+            elif start in ('[', '{'):
+                root[key] = None
+                stream.skip()
+            else:
+                root[key] = stream.value()
+            if stream.peek() == ',':
+                stream.pos += 1
+
+    return root, items()
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_profile_delimited(path, delimiter=',', chunk_rows=CHUNK_ROWS):
+    reservoir = Reservoir()
+    rows = 0
+    with open(path, 'r', newline='') as f:
+        chunks = iter_csv_chunks(f, delimiter, chunk_rows)
+        header = next(chunks)
+        accumulators = [ColumnAccumulator() for _ in header]
+        for chunk in chunks:
+            rows += len(chunk)
+            reservoir.extend(chunk)
+            for accumulator, values in zip(accumulators, zip_longest(*chunk, fillvalue='')):
+                accumulator.update_strings(values)
+    columns = dict(zip(header, accumulators))
+
+    kind = 'TSV' if delimiter == '\t' else 'CSV'
+    lines = [f"{kind} File Analysis (streaming): {os.path.basename(path)}", "=" * 50,
+             f"File Size: {os.path.getsize(path):,} bytes",
+             f"Number of Rows (excluding headers): {rows:,}"]
+    lines += _format_accumulators(columns)
+    lines += ["", "Sample Rows (reservoir):", "-" * 50]
+    lines += [f"Row {i}: {row}" for i, row in enumerate(reservoir.items)]
+    return '\n'.join(lines)
+
+
+def stream_profile_json(path, chunk_rows=CHUNK_RECORDS):
+    accumulators = {}
+    reservoir = Reservoir()
+    geometry_types = Counter()
+    records = 0
+    with open(path, 'r') as f:
+        root, items = iter_json_records(f)
+        for chunk in _chunks(items, chunk_rows):
+            records += len(chunk)
+            rows = []
+            reservoir.extend(chunk)
+            for item in chunk:
+                if isinstance(item, dict) and item.get('type') == 'Feature':
+                    geometry_types[(item.get('geometry') or {}).get('type')] += 1
+                    rows.append(item.get('properties') or {})
+                elif isinstance(item, dict):
+                    rows.append(item)
+                else:
+                    rows.append({'value': item})
+            for key, values in records_to_columns(rows).items():
+                accumulators.setdefault(key, ColumnAccumulator())
+            for key, accumulator in accumulators.items():
+                accumulator.update_values([row.get(key) for row in rows])
+
+    lines = [f"JSON File Analysis (streaming): {os.path.basename(path)}", "=" * 50,
+             f"File Size: {os.path.getsize(path):,} bytes",
+             f"Number of Records: {records:,}"]
+    if root:
+        lines.append(f"Root Keys: {', '.join(map(str, root.keys()))}")
+    if geometry_types:
+        lines.append("Geometry Types: " + ', '.join(f"{kind} ({count})" for kind, count in geometry_types.most_common()))
+    lines += _format_accumulators(accumulators)
+    lines += ["", "Sample Rows (reservoir):", "-" * 50]
+    lines += [f"Row {i}: {json.dumps(item, default=str)[:200]}" for i, item in enumerate(reservoir.items)]
+    return '\n'.join(lines)
+
+
+def _format_accumulators(columns):
+    lines = [f"Number of Columns: {len(columns)}", f"Column Names: {', '.join(map(str, columns))}",
+             "", "Field Summary (approximate distinct counts):", "-" * 50]
+    lines += [f"{name}: {accumulator.summary()}" for name, accumulator in columns.items()]
+    return lines
+
+
+def stream_profile_file(path, chunk_rows=None):
+    """Profile a CSV, TSV or JSON/GeoJSON file in bounded memory."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.csv', '.tsv'):
+        return stream_profile_delimited(path, '\t' if ext == '.tsv' else ',', chunk_rows or CHUNK_ROWS)
+    return stream_profile_json(path, chunk_rows or CHUNK_RECORDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile very large CSV/TSV/JSON files in bounded memory')
+    parser.add_argument('input_files', nargs='+', help='Files to profile')
+    parser.add_argument('--chunk-rows', type=int, help=f'Rows per processing chunk (default: {CHUNK_ROWS} CSV rows, {CHUNK_RECORDS} JSON records)')
+    args = parser.parse_args()
+    for path in args.input_files:
+        print(stream_profile_file(path, args.chunk_rows))
+        print()
+
+
+if __name__ == "__main__":
+    main()